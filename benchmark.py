@@ -0,0 +1,511 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from statistics import median
+from contextlib import contextmanager
+from urllib.parse import urlencode
+import httplib2
+import psycopg2
+import pymongo
+from googleapiclient.errors import HttpError
+import streamlit_api as yt
+from response_cache import ResponseCache, set_response_cache
+from warehouse_schema import migrate_warehouse_schema
+from youtube_scheduler import RequestScheduler, set_request_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Relative slowdown of the wall time and peak memory of a stage tolerated before it is
+# reported as a regression. API calls and quota units are deterministic and must not grow
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+# Comments of the synthetic channels above which a real MongoDB is required, as every
+# mongomock upsert scans the collection and the comment stages grow quadratically
+MONGOMOCK_MAX_COMMENTS = 2000
+
+# Metrics compared against the baseline, whether they are timing dependent, and the
+# smallest increase reported, so that noise on short stages is not taken for a regression
+BASELINE_METRICS = (
+    ('api_calls', False, 0),
+    ('quota_units', False, 0),
+    ('seconds', True, 0.05),
+    ('peak_memory_mb', True, 1.0),
+)
+
+# Timed runs of a benchmark, each stage is reported with its median time
+DEFAULT_REPEATS = 5
+
+class _FakeRequest:
+    """Stand-in of a googleapiclient HttpRequest answered by a FakeYouTube"""
+
+    def __init__(self, youtube: 'FakeYouTube', resource: str, params: dict):
+        self._youtube = youtube
+        self._resource = resource
+        self._params = params
+        self.methodId = 'youtube.{}.list'.format(resource)
+        self.uri = 'https://youtube.googleapis.com/youtube/v3/{}?{}'.format(resource, urlencode(sorted(params.items())))
+        self.headers = {}
+
+    def execute(self, num_retries: int = 0) -> dict:
+        return self._youtube.respond(self._resource, self._params, self.headers.get('If-None-Match'))
+
+class _FakeResource:
+    def __init__(self, youtube: 'FakeYouTube', name: str):
+        self._youtube = youtube
+        self._name = name
+
+    def list(self, **params) -> _FakeRequest:
+        return _FakeRequest(self._youtube, self._name, params)
+
+class FakeYouTube:
+    """
+        Offline stand-in of the youtube api object serving synthetic channels. Every
+        request sleeps for latency seconds, responses carry etags and conditional
+        requests of unchanged resources answer 304 like the real API. The data is
+        derived from the ids, so the same arguments always produce the same channels.
+        Subclasses script other data by overriding _playlist_ids, _video_ids,
+        _published_at, _comment_threads and _reply_ids.
+
+        Args:
+            channels: int, number of channels
+            playlists: int, playlists per channel
+            videos: int, videos per playlist
+            comments: int, comment threads per video
+            replies: int, replies per comment thread
+            latency: float, seconds each request takes
+    """
+
+    RESOURCES = ('channels', 'playlists', 'playlistItems', 'videos', 'commentThreads', 'comments')
+
+    def __init__(self, channels: int = 5, playlists: int = 3, videos: int = 20, comments: int = 10,
+                 replies: int = 2, latency: float = 0.01):
+        self.playlists_per_channel = playlists
+        self.videos_per_playlist = videos
+        self.threads_per_video = comments
+        self.replies_per_thread = replies
+        self.latency = latency
+        self.channel_ids = ['UCbench{:06d}'.format(index) for index in range(channels)]
+        self._revision = 0
+        self._lock = threading.Lock()
+        self.requests = {}
+        # (resource, parameters) of every request in the order they were answered
+        self.history = []
+
+    def __getattr__(self, name):
+        if name in self.RESOURCES:
+            return lambda: _FakeResource(self, name)
+        raise AttributeError(name)
+
+    def advance(self):
+        """
+            Adds views and a comment thread to every tenth video of each playlist, as if time
+            passed between two syncs. Those videos were published in the last days, so the
+            incremental sync refreshes their statistics.
+        """
+        self._revision += 1
+
+    def _number(self, key: str, modulo: int) -> int:
+        return int(hashlib.md5(key.encode()).hexdigest()[:8], 16) % modulo
+
+    def _video_index(self, video_id: str) -> int:
+        # Position of a synthetic video in its playlist
+        index = video_id.rsplit('_', 1)[-1]
+        return int(index) if index.isdigit() else self._number(video_id, 100)
+
+    def _bumps(self, video_id: str) -> int:
+        return self._revision if self._video_index(video_id) % 10 == 0 else 0
+
+    def _views(self, video_id: str) -> int:
+        return self._number(video_id, 100000) + 1000 * self._bumps(video_id)
+
+    def _page(self, items: list, params: dict) -> dict:
+        size = int(params.get('maxResults', 5))
+        start = int(params.get('pageToken') or 0)
+        response = {'pageInfo': {'totalResults': len(items)}, 'items': items[start:start + size]}
+        if start + size < len(items):
+            response['nextPageToken'] = str(start + size)
+        return response
+
+    def _comment(self, comment_id: str, index: int) -> dict:
+        # Comments with a higher index are newer
+        return {'id': comment_id, 'snippet': {
+            'textOriginal': 'Synthetic comment {}'.format(comment_id),
+            'authorDisplayName': 'author{}'.format(index % 97),
+            'publishedAt': '2023-01-{:02d}T{:02d}:{:02d}:00Z'.format(
+                index // 1440 % 28 + 1, index // 60 % 24, index % 60
+            ),
+        }}
+
+    def _comment_count(self, video_id: str) -> int:
+        return sum(1 + len(self._reply_ids(thread_id)) for thread_id, _ in self._comment_threads(video_id))
+
+    def _items(self, resource: str, params: dict) -> dict:
+        if resource == 'channels':
+            channel_id = params['id']
+            items = [] if channel_id not in self.channel_ids else [{
+                'id': channel_id,
+                'snippet': {'title': 'Channel {}'.format(channel_id), 'description': 'Synthetic channel'},
+                'statistics': {
+                    'viewCount': str(sum(self._views(video_id) for video_id in self._channel_video_ids(channel_id))),
+                    'subscriberCount': str(self._number(channel_id, 10000) + 10 * self._revision),
+                    'videoCount': str(len(self._channel_video_ids(channel_id))),
+                },
+                'status': {'privacyStatus': 'public'},
+                'contentDetails': {},
+            }]
+            return {'pageInfo': {'totalResults': len(items)}, 'items': items}
+        if resource == 'playlists':
+            return self._page([
+                {'id': playlist_id, 'snippet': {'title': 'Playlist {}'.format(playlist_id), 'description': ''}}
+                for playlist_id in self._playlist_ids(params['channelId'])
+            ], params)
+        if resource == 'playlistItems':
+            return self._page([
+                {'snippet': {'resourceId': {'videoId': video_id}, 'publishedAt': self._published_at(video_id)}}
+                for video_id in self._video_ids(params['playlistId'])
+            ], params)
+        if resource == 'videos':
+            items = []
+            for index, video_id in enumerate(params['id'].split(',')):
+                items.append({
+                    'id': video_id,
+                    'snippet': {
+                        'title': 'Video {}'.format(video_id), 'description': 'Synthetic video',
+                        'publishedAt': self._published_at(video_id),
+                        'thumbnails': {'default': {'url': 'https://i.ytimg.com/vi/{}/default.jpg'.format(video_id)}},
+                    },
+                    'statistics': {
+                        'viewCount': str(self._views(video_id)),
+                        'likeCount': str(self._views(video_id) // 20),
+                        'favoriteCount': '0',
+                        'commentCount': str(self._comment_count(video_id)),
+                    },
+                    'contentDetails': {'duration': 'PT{}M{}S'.format(index % 30 + 1, index % 60), 'caption': 'false'},
+                })
+            return {'pageInfo': {'totalResults': len(items)}, 'items': items}
+        if resource == 'commentThreads':
+            threads = []
+            for thread_id, index in self._comment_threads(params['videoId']):
+                reply_ids = self._reply_ids(thread_id)
+                thread = {'id': thread_id, 'snippet': {
+                    'totalReplyCount': len(reply_ids), 'topLevelComment': self._comment(thread_id, index),
+                }}
+                # Threads carry up to five of their replies like the API
+                if 'replies' in params.get('part', '') and reply_ids:
+                    thread['replies'] = {'comments': [
+                        self._comment(reply_id, reply) for reply, reply_id in enumerate(reply_ids[:5])
+                    ]}
+                threads.append(thread)
+            return self._page(threads, params)
+        if resource == 'comments':
+            return self._page([
+                self._comment(reply_id, reply) for reply, reply_id in enumerate(self._reply_ids(params['parentId']))
+            ], params)
+        raise KeyError(resource)
+
+    def _playlist_ids(self, channel_id: str) -> list:
+        return ['PL{}_{}'.format(channel_id, index) for index in range(self.playlists_per_channel)] \
+            if channel_id in self.channel_ids else []
+
+    def _video_ids(self, playlist_id: str) -> list:
+        return ['{}_{}'.format(playlist_id[2:], index) for index in range(self.videos_per_playlist)]
+
+    def _published_at(self, video_id: str) -> str:
+        if self._video_index(video_id) % 5 == 0:
+            # Every fifth video is recent, within yt.SYNC_RECENT_DAYS of the default configuration
+            published_at = datetime.now(timezone.utc).date() - timedelta(days=1 + self._number(video_id, 7))
+            return published_at.strftime('%Y-%m-%dT08:00:00Z')
+        return '20{:02d}-{:02d}-15T08:00:00Z'.format(15 + self._number(video_id, 9), self._number(video_id, 12) + 1)
+
+    def _comment_threads(self, video_id: str) -> list:
+        """(thread id, index dating the thread) of the threads of a video, newest first like order=time"""
+        return [
+            ('{}.c{}'.format(video_id, index), index)
+            for index in reversed(range(self.threads_per_video + self._bumps(video_id)))
+        ]
+
+    def _reply_ids(self, thread_id: str) -> list:
+        return ['{}.r{}'.format(thread_id, reply) for reply in range(self.replies_per_thread)]
+
+    def _channel_video_ids(self, channel_id: str) -> list:
+        return [video_id for playlist_id in self._playlist_ids(channel_id) for video_id in self._video_ids(playlist_id)]
+
+    def respond(self, resource: str, params: dict, etag: str = None) -> dict:
+        """Answers a request after the simulated latency"""
+        with self._lock:
+            self.requests[resource] = self.requests.get(resource, 0) + 1
+            self.history.append((resource, dict(params)))
+        time.sleep(self.latency)
+        response = self._items(resource, params)
+        response['etag'] = hashlib.md5(json.dumps(response, sort_keys=True).encode()).hexdigest()
+        for item in response['items']:
+            item['etag'] = hashlib.md5(json.dumps(item, sort_keys=True).encode()).hexdigest()
+        if etag is not None and etag == response['etag']:
+            raise HttpError(httplib2.Response({'status': 304}), b'')
+        return response
+
+def _connect_mongo(mongo_uri: str):
+    if mongo_uri:
+        client = pymongo.MongoClient(mongo_uri)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit('Pass --mongo-uri of a local MongoDB, or install mongomock to benchmark in memory')
+        client = mongomock.MongoClient()
+    database = client['youtube_benchmark']
+    client.drop_database('youtube_benchmark')
+    yt.ensure_datalake_indexes(database)
+    return database
+
+def _postgres_factory(dsn: str):
+    @contextmanager
+    def connect():
+        connection = psycopg2.connect(dsn)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    with connect() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute('DROP SCHEMA IF EXISTS myschema CASCADE')
+        connection.commit()
+        migrate_warehouse_schema(connection)
+    return connect
+
+class StageRecorder:
+    """
+        Measures the stages of a benchmark run: wall time, API calls and quota units
+        charged by the request scheduler, rows per second, and peak traced memory
+        when tracemalloc is tracing
+
+        Args:
+            scheduler: RequestScheduler every request of the run goes through
+    """
+
+    def __init__(self, scheduler: RequestScheduler):
+        self.scheduler = scheduler
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measures the block, which stores the number of rows it processed in the yielded dictionary"""
+        before = self.scheduler.stats()
+        result = {'rows': 0}
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            baseline_memory = tracemalloc.get_traced_memory()[0]
+        started_at = time.perf_counter()
+        yield result
+        seconds = time.perf_counter() - started_at
+        after = self.scheduler.stats()
+        self.stages[name] = {
+            'seconds': round(seconds, 4),
+            'api_calls': sum(after['calls'].values()) - sum(before['calls'].values()),
+            'quota_units': after['quota_used'] - before['quota_used'],
+            'peak_memory_mb': round((tracemalloc.get_traced_memory()[1] - baseline_memory) / 2 ** 20, 3)
+            if tracing else None,
+            'rows': result['rows'],
+            'rows_per_sec': round(result['rows'] / seconds, 1) if seconds else 0.0,
+        }
+        logger.info('%s: %s', name, self.stages[name])
+
+def run_benchmark(fake: FakeYouTube, mongo_db, connection_factory=None, max_workers: int = yt.YOUTUBE_MAX_WORKERS,
+                  max_comments: int = None, trace_memory: bool = False) -> dict:
+    """
+        Runs the ingest and migration stages against a fake YouTube API. Tracing memory
+        slows the stages down, so a run either measures their time or their peak memory.
+
+        Args:
+            fake: FakeYouTube serving the synthetic channels
+            mongo_db: mongo database object of the data lake, emptied by the caller
+            connection_factory: callable returning a context manager that yields a warehouse
+                                connection, None to skip the migration stage
+            max_workers: int, API requests in flight at the same time
+            max_comments: int, comments and replies stored per video, None for all of them
+            trace_memory: bool, measure the peak memory of the stages with tracemalloc
+        Returns:
+            A dictionary of the measurements of every stage
+    """
+    scheduler = RequestScheduler(daily_quota=10 ** 9, requests_per_second=10 ** 6, burst=10 ** 6)
+    set_request_scheduler(scheduler)
+    set_response_cache(ResponseCache('', mode='off'))
+    recorder = StageRecorder(scheduler)
+    channel_ids = fake.channel_ids
+    youtube_factory = lambda: fake
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with recorder.stage('fetch') as stage:
+            channels = yt.get_youtube_channels_information(channel_ids, youtube_factory, max_workers)
+            stage['rows'] = sum(len(playlist['videos']) for data in channels.values() for playlist in data['playlists'])
+        with recorder.stage('save_to_lake') as stage:
+            for data in channels.values():
+                yt.save_data_to_mongo_db(data, mongo_db)
+                stage['rows'] += 1 + sum(1 + len(playlist['videos']) for playlist in data['playlists'])
+        del channels
+        with recorder.stage('comments') as stage:
+            for channel_id in channel_ids:
+                stage['rows'] += yt.sync_channel_comments(channel_id, mongo_db, youtube_factory, max_workers,
+                                                          max_comments)['comments']
+        fake.advance()
+        with recorder.stage('incremental_sync') as stage:
+            synced = yt.sync_youtube_channels_information(channel_ids, mongo_db, youtube_factory, max_workers,
+                                                          comments=False)
+            stage['rows'] = sum(len(playlist['videos']) for data in synced.values() for playlist in data['playlists'])
+            del synced
+        with recorder.stage('incremental_comments') as stage:
+            for channel_id in channel_ids:
+                stage['rows'] += yt.sync_channel_comments(channel_id, mongo_db, youtube_factory, max_workers,
+                                                          max_comments)['comments']
+        if connection_factory is not None:
+            with recorder.stage('migrate') as stage:
+                results = yt.migrate_channels_to_warehouse(channel_ids, mongo_db, connection_factory)
+                failed = [result for result in results if result['status'] != 'migrated']
+                if failed:
+                    raise RuntimeError('Migrating {} failed: {}'.format(failed[0]['channel_id'], failed[0]['error']))
+                stage['rows'] = sum(stats['rows'] for result in results for stats in result['load_stats'].values())
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return recorder.stages
+
+def median_stages(runs: list) -> dict:
+    """
+        Combines the measurements of repeated runs into the median time of each stage.
+        API calls, quota units and rows do not depend on timing and are taken from the first run.
+
+        Args:
+            runs: list of the measurements returned by run_benchmark
+        Returns:
+            A dictionary of the measurements of every stage
+    """
+    stages = {}
+    for name, measurements in runs[0].items():
+        seconds = round(median(run[name]['seconds'] for run in runs), 4)
+        stages[name] = dict(
+            measurements, seconds=seconds,
+            rows_per_sec=round(measurements['rows'] / seconds, 1) if seconds else 0.0,
+        )
+    return stages
+
+def compare_with_baseline(stages: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """
+        Compares the measurements of a run with a baseline run
+
+        Args:
+            stages: dictionary, measurements returned by run_benchmark
+            baseline: dictionary, measurements of the baseline run
+            tolerance: float, relative increase of timing dependent metrics tolerated, increases
+                       smaller than the minimum of the metric in BASELINE_METRICS are always tolerated
+        Returns:
+            A list of regression messages, empty when the run is as good as the baseline
+    """
+    regressions = []
+    for name, measurements in stages.items():
+        if name not in baseline:
+            continue
+        for metric, timing_dependent, minimum_increase in BASELINE_METRICS:
+            if measurements[metric] is None or baseline[name][metric] is None:
+                continue
+            allowed = baseline[name][metric] * (1 + tolerance) if timing_dependent else baseline[name][metric]
+            if measurements[metric] > max(allowed, baseline[name][metric] + minimum_increase):
+                regressions.append('{} {}: {} against {} in the baseline'.format(
+                    name, metric, measurements[metric], baseline[name][metric]
+                ))
+    return regressions
+
+def format_report(stages: dict) -> str:
+    """Formats the measurements of every stage as a text table"""
+    columns = ('seconds', 'api_calls', 'quota_units', 'peak_memory_mb', 'rows', 'rows_per_sec')
+    lines = ['{:<22}'.format('stage') + ''.join('{:>16}'.format(column) for column in columns)]
+    for name, measurements in stages.items():
+        lines.append('{:<22}'.format(name) + ''.join(
+            '{:>16}'.format('-' if measurements[column] is None else measurements[column]) for column in columns
+        ))
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks ingestion and migration offline against a fake YouTube API with synthetic channels'
+    )
+    parser.add_argument('--channels', type=int, default=2)
+    parser.add_argument('--playlists', type=int, default=2, help='playlists per channel')
+    parser.add_argument('--videos', type=int, default=10, help='videos per playlist')
+    parser.add_argument('--comments', type=int, default=5, help='comment threads per video')
+    parser.add_argument('--replies', type=int, default=2, help='replies per comment thread')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds each fake API request takes')
+    parser.add_argument('--workers', type=int, default=yt.YOUTUBE_MAX_WORKERS, help='API requests in flight')
+    parser.add_argument('--mongo-uri', help='local MongoDB to benchmark against, its youtube_benchmark database '
+                                            'is dropped. mongomock when omitted')
+    parser.add_argument('--postgres-dsn', help='scratch PostgreSQL database for the migration stage, '
+                                               'its myschema is dropped. The stage is skipped when omitted')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='json file of the baseline measurements')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative slowdown of time and memory tolerated against the baseline')
+    parser.add_argument('--output', help='json file to write the measurements to')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS,
+                        help='timed runs, the median time of each stage is reported')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the second run measuring the peak memory of the stages')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+
+    comments = args.channels * args.playlists * args.videos * args.comments * (1 + args.replies)
+    if not args.mongo_uri and comments > MONGOMOCK_MAX_COMMENTS:
+        parser.error('{} comments are too many for mongomock, whose upserts scan the collection. '
+                     'Pass --mongo-uri or use smaller sizes'.format(comments))
+
+    def run_from_scratch(trace_memory: bool) -> dict:
+        fake = FakeYouTube(args.channels, args.playlists, args.videos, args.comments, args.replies, args.latency)
+        mongo_db = _connect_mongo(args.mongo_uri)
+        connection_factory = _postgres_factory(args.postgres_dsn) if args.postgres_dsn else None
+        return run_benchmark(fake, mongo_db, connection_factory, args.workers, trace_memory=trace_memory)
+
+    stages = median_stages([run_from_scratch(trace_memory=False) for _ in range(args.repeats)])
+    if not args.no_memory:
+        # Measured by another run from scratch, as tracing the allocations would slow the timed ones down
+        for name, measurements in run_from_scratch(trace_memory=True).items():
+            stages[name]['peak_memory_mb'] = measurements['peak_memory_mb']
+    print(format_report(stages))
+
+    result = {'config': {key: value for key, value in vars(args).items() if key in (
+        'channels', 'playlists', 'videos', 'comments', 'replies', 'latency', 'workers'
+    )}, 'stages': stages}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(result, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(result, file, indent=2)
+        print('Saved the baseline to {}'.format(args.baseline))
+        return
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}, run with --save-baseline to store one'.format(args.baseline))
+        return
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    if baseline['config'] != result['config']:
+        print('The baseline was measured with {}, results are not comparable'.format(baseline['config']))
+        return
+    regressions = compare_with_baseline(stages, baseline['stages'], args.tolerance)
+    for regression in regressions:
+        print('Regression: {}'.format(regression))
+    if regressions:
+        sys.exit(1)
+    print('No regression against {}'.format(args.baseline))
+
+if __name__ == '__main__':
+    main()
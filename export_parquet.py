@@ -0,0 +1,319 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from urllib.parse import quote
+import pyarrow as pa
+import pyarrow.dataset as ds
+import streamlit_api as yt
+
+logger = logging.getLogger(__name__)
+
+# Rows converted to arrow at a time, the memory of an export is bounded by it
+EXPORT_BATCH_SIZE = 50000
+
+# File of the output directory remembering when the lake was last exported
+EXPORT_STATE_FILE = '_export_state.json'
+
+_labels = pa.dictionary(pa.int32(), pa.string())
+_timestamp = pa.timestamp('s', tz='UTC')
+
+# Schema and hive partition columns of each exported dataset. Repetitive strings are
+# dictionary encoded so they are stored and loaded once per row group
+EXPORT_DATASETS = {
+    'channels': (pa.schema([
+        ('channel_id', pa.string()),
+        ('channel_name', pa.string()),
+        ('channel_description', pa.string()),
+        ('channel_status', _labels),
+        ('channel_views', pa.int64()),
+        ('channel_subscribers', pa.int64()),
+        ('channel_video_count', pa.int64()),
+    ]), ('channel_id',)),
+    'playlists': (pa.schema([
+        ('playlist_id', pa.string()),
+        ('channel_id', pa.string()),
+        ('playlist_name', pa.string()),
+        ('playlist_description', pa.string()),
+    ]), ('channel_id',)),
+    'videos': (pa.schema([
+        ('video_id', pa.string()),
+        ('channel_id', pa.string()),
+        ('playlist_ids', pa.list_(_labels)),
+        ('video_name', pa.string()),
+        ('video_description', pa.string()),
+        ('published_at', _timestamp),
+        ('publish_month', pa.string()),
+        ('view_count', pa.int64()),
+        ('like_count', pa.int64()),
+        ('dislike_count', pa.int64()),
+        ('favourite_count', pa.int64()),
+        ('comment_count', pa.int64()),
+        ('duration_seconds', pa.int32()),
+        ('thumbnail_url', pa.string()),
+        ('caption_status', _labels),
+    ]), ('channel_id', 'publish_month')),
+    'comments': (pa.schema([
+        ('comment_id', pa.string()),
+        ('video_id', _labels),
+        ('parent_id', pa.string()),
+        ('channel_id', pa.string()),
+        ('comment_author', _labels),
+        ('comment_text', pa.string()),
+        ('published_at', _timestamp),
+        ('publish_month', pa.string()),
+    ]), ('channel_id', 'publish_month')),
+}
+
+# Warehouse queries returning the rows of each dataset, scoped by %(channel_ids)s
+WAREHOUSE_EXPORT_QUERIES = {
+    'channels': '''
+        SELECT channel_id, channel_name, channel_description, channel_status,
+            channel_views, channel_subscribers, channel_video_count
+        FROM myschema."channel_details"
+        WHERE %(channel_ids)s::TEXT[] IS NULL OR channel_id = ANY(%(channel_ids)s::TEXT[])
+    ''',
+    'playlists': '''
+        SELECT playlist_id, channel_id, playlist_name, playlist_description
+        FROM myschema."playlist"
+        WHERE %(channel_ids)s::TEXT[] IS NULL OR channel_id = ANY(%(channel_ids)s::TEXT[])
+    ''',
+    'videos': '''
+        SELECT v.video_id, p.channel_id, ARRAY[v.playlist_id], v.video_name, v.video_description, v.published_date,
+            v.view_count, v.like_count, v.dislike_count, v.favourite_count, v.comment_count, v.duration,
+            v.thumbnail_url, v.caption_status
+        FROM myschema."Video" v
+        INNER JOIN myschema."playlist" p ON v.playlist_id = p.playlist_id
+        WHERE %(channel_ids)s::TEXT[] IS NULL OR p.channel_id = ANY(%(channel_ids)s::TEXT[])
+    ''',
+    'comments': '''
+        SELECT c.comment_id, c.video_id, c.parent_id, p.channel_id, c.comment_author, c.comment_text, c.comment_published_date
+        FROM myschema."Comment" c
+        INNER JOIN myschema."Video" v ON c.video_id = v.video_id
+        INNER JOIN myschema."playlist" p ON v.playlist_id = p.playlist_id
+        WHERE %(channel_ids)s::TEXT[] IS NULL OR p.channel_id = ANY(%(channel_ids)s::TEXT[])
+    ''',
+}
+
+def _timestamp_value(value):
+    # The lake keeps the api timestamps as strings, the warehouse as timestamps without time zone
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def _dated(row: dict) -> dict:
+    row['published_at'] = _timestamp_value(row['published_at'])
+    row['publish_month'] = row['published_at'].strftime('%Y-%m') if row['published_at'] else 'unknown'
+    return row
+
+def iter_lake_rows(name: str, mongo_db, channel_ids: list = None):
+    """
+        Iterates over the flattened rows of a dataset read from the data lake
+
+        Args:
+            name: string, dataset name in EXPORT_DATASETS
+            mongo_db: mongo database object
+            channel_ids: list of the channel ids to export, None for all of them
+        Returns:
+            A generator of row dictionaries
+    """
+    query = {'channel_id': {'$in': channel_ids}} if channel_ids is not None else {}
+    if name == 'channels':
+        for channel in mongo_db[yt.LAKE_CHANNELS].find(query, batch_size=yt.LAKE_BULK_WRITE_SIZE):
+            yield dict(channel, channel_status=channel.get('status'))
+    elif name == 'playlists':
+        yield from mongo_db[yt.LAKE_PLAYLISTS].find(query, batch_size=yt.LAKE_BULK_WRITE_SIZE)
+    elif name == 'videos':
+        for video in mongo_db[yt.LAKE_VIDEOS].find(query, batch_size=yt.LAKE_BULK_WRITE_SIZE):
+            yield _dated(dict(
+                video, published_at=video.get('video_published_date'), duration_seconds=video.get('video_duration')
+            ))
+    elif name == 'comments':
+        for comment in mongo_db[yt.LAKE_COMMENTS].find(query, batch_size=yt.LAKE_BULK_WRITE_SIZE):
+            yield _dated(dict(comment, published_at=comment.get('comment_published_date')))
+
+def iter_warehouse_rows(name: str, connection, channel_ids: list = None):
+    """
+        Iterates over the rows of a dataset read from the warehouse through a server-side cursor
+
+        Args:
+            name: string, dataset name in EXPORT_DATASETS
+            connection: psycopg2 connection object
+            channel_ids: list of the channel ids to export, None for all of them
+        Returns:
+            A generator of row dictionaries
+    """
+    schema, _ = EXPORT_DATASETS[name]
+    columns = [field.name for field in schema if field.name != 'publish_month']
+    rows = yt.iter_sql_query_results(
+        WAREHOUSE_EXPORT_QUERIES[name], connection, {'channel_ids': channel_ids}, batch_size=EXPORT_BATCH_SIZE
+    )
+    for row in rows:
+        row = dict(zip(columns, row))
+        yield _dated(row) if 'published_at' in row else row
+
+def iter_record_batches(rows, schema: pa.Schema, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+        Converts rows into typed arrow record batches of at most batch_size rows
+
+        Args:
+            rows: iterable of row dictionaries, keys missing from the schema are ignored
+            schema: pyarrow schema of the batches
+            batch_size: int, rows per batch
+        Returns:
+            A generator of pyarrow RecordBatch
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            return
+        yield pa.RecordBatch.from_pylist(chunk, schema=schema)
+
+def write_dataset(name: str, rows, output_dir: str, run_id: str) -> int:
+    """
+        Streams rows into a hive partitioned Parquet dataset. Partitions written by the
+        run replace their previous files, other partitions are left untouched, see
+        remove_channel_partitions.
+
+        Args:
+            name: string, dataset name in EXPORT_DATASETS
+            rows: iterable of row dictionaries
+            output_dir: string, directory of the datasets
+            run_id: string, unique id of the run used in the file names
+        Returns:
+            The number of rows written
+    """
+    schema, partition_columns = EXPORT_DATASETS[name]
+    written = [0]
+
+    def batches():
+        for batch in iter_record_batches(rows, schema):
+            written[0] += batch.num_rows
+            yield batch
+
+    ds.write_dataset(
+        pa.RecordBatchReader.from_batches(schema, batches()),
+        os.path.join(output_dir, name),
+        format='parquet',
+        partitioning=ds.partitioning(
+            pa.schema([schema.field(column) for column in partition_columns]), flavor='hive'
+        ),
+        basename_template='part-{}-{{i}}.parquet'.format(run_id),
+        existing_data_behavior='delete_matching',
+        file_options=ds.ParquetFileFormat().make_write_options(compression='zstd'),
+    )
+    return written[0]
+
+def remove_channel_partitions(output_dir: str, channel_ids: list = None):
+    """
+        Removes the exported partitions of channels before they are exported again, so
+        rows deleted since the previous export do not stay behind in partitions the new
+        export writes nothing to
+
+        Args:
+            output_dir: string, directory of the datasets
+            channel_ids: list of the channel ids exported again, None to remove every dataset
+    """
+    for name in EXPORT_DATASETS:
+        dataset_dir = os.path.join(output_dir, name)
+        if channel_ids is None:
+            shutil.rmtree(dataset_dir, ignore_errors=True)
+            continue
+        for channel_id in channel_ids:
+            # Hive partition values are percent encoded
+            shutil.rmtree(os.path.join(dataset_dir, 'channel_id={}'.format(quote(channel_id, safe=''))),
+                          ignore_errors=True)
+
+def _read_state(output_dir: str) -> dict:
+    try:
+        with open(os.path.join(output_dir, EXPORT_STATE_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+def _write_state(output_dir: str, state: dict):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, EXPORT_STATE_FILE), 'w') as file:
+        json.dump(state, file)
+
+def export_lake(mongo_db, output_dir: str, channel_ids: list = None, full: bool = False) -> dict:
+    """
+        Exports the data lake to Parquet. Unless channel ids are given or full is set,
+        only the channels synced since the previous export are written. The partitions
+        of the written channels are replaced, every partition on a full export.
+
+        Args:
+            mongo_db: mongo database object
+            output_dir: string, directory of the datasets
+            channel_ids: list of the channel ids to export, None for the changed ones
+            full: bool, export every channel
+        Returns:
+            A dictionary of the rows written per dataset
+    """
+    started_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    state = _read_state(output_dir)
+    incremental = channel_ids is None
+    if incremental and not full and state.get('lake_exported_at'):
+        channel_ids = [
+            channel['channel_id'] for channel in mongo_db[yt.LAKE_CHANNELS].find(
+                {'last_synced_at': {'$gte': state['lake_exported_at']}}, {'channel_id': 1}
+            )
+        ]
+        logger.info('%d channels synced since %s', len(channel_ids), state['lake_exported_at'])
+    run_id = str(int(time.time() * 1000))
+    remove_channel_partitions(output_dir, channel_ids)
+    counts = {
+        name: write_dataset(name, iter_lake_rows(name, mongo_db, channel_ids), output_dir, run_id)
+        for name in EXPORT_DATASETS
+    }
+    if incremental:
+        _write_state(output_dir, dict(state, lake_exported_at=started_at))
+    return counts
+
+def export_warehouse(connection, output_dir: str, channel_ids: list = None) -> dict:
+    """
+        Exports the warehouse tables to Parquet, replacing the partitions of the exported
+        channels, every partition when no channel ids are given
+
+        Args:
+            connection: psycopg2 connection object
+            output_dir: string, directory of the datasets
+            channel_ids: list of the channel ids to export, None for all of them
+        Returns:
+            A dictionary of the rows written per dataset
+    """
+    run_id = str(int(time.time() * 1000))
+    remove_channel_partitions(output_dir, channel_ids)
+    counts = {}
+    for name in EXPORT_DATASETS:
+        counts[name] = write_dataset(name, iter_warehouse_rows(name, connection, channel_ids), output_dir, run_id)
+        connection.rollback()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='Exports the data lake or the warehouse to Parquet datasets')
+    parser.add_argument('output_dir', help='directory of the channels, playlists, videos and comments datasets')
+    parser.add_argument('--source', choices=('lake', 'warehouse'), default='lake')
+    parser.add_argument('--channels', help='channel ids to export, separated by commas or spaces')
+    parser.add_argument('--full', action='store_true', help='export every channel of the lake, not only the changed ones')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    channel_ids = yt.parse_channel_ids(args.channels) if args.channels else None
+    if args.source == 'lake':
+        counts = export_lake(yt.get_mongo_client(), args.output_dir, channel_ids, args.full)
+    else:
+        with yt.postgre_connection() as connection:
+            counts = export_warehouse(connection, args.output_dir, channel_ids)
+    for name, count in counts.items():
+        logger.info('Exported %d %s', count, name)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import streamlit_api as yt
+from response_cache import CACHE_MODES, set_response_cache_mode
+
+logger = logging.getLogger(__name__)
+
+class IngestCheckpoint:
+    """
+        Progress of a batch ingest stored in a sqlite file. Channels are recorded once
+        they are fetched, migrated or failed, and playlists once they are saved to the
+        data lake, so an interrupted run skips the work that was already done.
+
+        Args:
+            path: string, path of the sqlite file
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS channels (
+                channel_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                error TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS playlists (
+                channel_id TEXT NOT NULL,
+                playlist_id TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (channel_id, playlist_id)
+            );
+        ''')
+
+    def channel_status(self, channel_id: str) -> str:
+        """Status of a channel: None, 'ingested', 'migrated', 'not found' or 'failed'"""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT status FROM channels WHERE channel_id = ?', (channel_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_channel_status(self, channel_id: str, status: str, error: str = None):
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO channels VALUES (?, ?, ?, ?)', (channel_id, status, error, time.time())
+            )
+            self._connection.commit()
+
+    def saved_playlists(self, channel_id: str) -> set:
+        """Ids of the playlists of a channel already saved to the data lake"""
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT playlist_id FROM playlists WHERE channel_id = ?', (channel_id,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def set_playlist_saved(self, channel_id: str, playlist_id: str):
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO playlists VALUES (?, ?, ?)', (channel_id, playlist_id, time.time())
+            )
+            self._connection.commit()
+
+    def counts(self) -> dict:
+        """Number of channels per status"""
+        with self._lock:
+            return dict(self._connection.execute('SELECT status, COUNT(*) FROM channels GROUP BY status').fetchall())
+
+    def channel_errors(self, status: str) -> dict:
+        """Last error of the channels with a status, e.g. the ingested channels that failed to migrate"""
+        with self._lock:
+            return dict(self._connection.execute(
+                'SELECT channel_id, error FROM channels WHERE status = ? AND error IS NOT NULL', (status,)
+            ).fetchall())
+
+def ingest_channel(channel_id: str, mongo_db, checkpoint: IngestCheckpoint, incremental: bool = False) -> str:
+    """
+        Fetches a channel into the data lake playlist by playlist, skipping the playlists
+        the checkpoint already has, then the comments of the videos whose comment count changed
+
+        Args:
+            channel_id: string, youtube channel id
+            mongo_db: mongo database object
+            checkpoint: IngestCheckpoint of the run
+            incremental: bool, sync the channel against the data lake in one step instead
+        Returns:
+            The new status of the channel, 'ingested' or 'not found'
+    """
+    youtube = yt.get_youtube_api_object()
+    if incremental:
+        errors = {}
+        channels = yt.sync_youtube_channels_information([channel_id], mongo_db, max_workers=1, errors=errors,
+                                                        comments=False)
+        if channel_id in errors:
+            raise errors[channel_id]
+        if channel_id not in channels:
+            return 'not found'
+        yt.sync_channel_comments(channel_id, mongo_db)
+        return 'ingested'
+
+    channel = yt.get_channel_details(channel_id, youtube)
+    if not channel:
+        return 'not found'
+    saved_playlists = checkpoint.saved_playlists(channel_id)
+    playlist_ids = []
+    for playlist in yt.iter_channel_playlist_details(channel_id, youtube):
+        playlist_ids.append(playlist['playlist_id'])
+        if playlist['playlist_id'] in saved_playlists:
+            continue
+        playlist['videos'] = yt.get_playlist_videos(playlist['playlist_id'], youtube)
+        yt.save_playlist_to_datalake(playlist, mongo_db)
+        checkpoint.set_playlist_saved(channel_id, playlist['playlist_id'])
+    yt.finish_channel_in_datalake(channel, playlist_ids, mongo_db)
+    # Videos whose comments were synced before an interruption are skipped
+    yt.sync_channel_comments(channel_id, mongo_db)
+    return 'ingested'
+
+def read_channel_ids(source: str) -> list:
+    """Reads channel ids from a file, or from stdin when source is -"""
+    if source == '-':
+        return yt.parse_channel_ids(sys.stdin.read())
+    with open(source) as file:
+        return yt.parse_channel_ids(file.read())
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingests YouTube channels into the data lake without the browser')
+    parser.add_argument('source', nargs='?', default='-',
+                        help='file of channel ids separated by commas, spaces or new lines, - for stdin')
+    parser.add_argument('--checkpoint', default='.ingest_checkpoint.sqlite', help='sqlite file of the run progress')
+    parser.add_argument('--workers', type=int, default=4, help='channels ingested at the same time')
+    parser.add_argument('--incremental', action='store_true',
+                        help='sync channels against the data lake, checkpointed per channel only')
+    parser.add_argument('--retry-failed', action='store_true', help='ingest the channels that failed before again')
+    parser.add_argument('--migrate', action='store_true', help='migrate the ingested channels to the warehouse at the end')
+    parser.add_argument('--cache-mode', choices=CACHE_MODES,
+                        help='API response cache mode e.g. record or replay to reprocess, '
+                             'youtube_cache_mode by default')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(threadName)s %(levelname)s %(message)s')
+
+    if args.cache_mode:
+        set_response_cache_mode(args.cache_mode)
+    checkpoint = IngestCheckpoint(args.checkpoint)
+    mongo_db = yt.get_mongo_client()
+    channel_ids = read_channel_ids(args.source)
+    skipped = ('ingested', 'migrated', 'not found') + (() if args.retry_failed else ('failed',))
+    pending = [channel_id for channel_id in channel_ids if checkpoint.channel_status(channel_id) not in skipped]
+    logger.info('%d channels, %d left to ingest', len(channel_ids), len(pending))
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    futures = {
+        executor.submit(ingest_channel, channel_id, mongo_db, checkpoint, args.incremental): channel_id
+        for channel_id in pending
+    }
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            channel_id = futures[future]
+            try:
+                checkpoint.set_channel_status(channel_id, future.result())
+            except Exception as e:
+                logger.warning('Unable to ingest channel %s: %r', channel_id, e)
+                checkpoint.set_channel_status(channel_id, 'failed', str(e) or repr(e))
+            logger.info('%d/%d channels done', done, len(pending))
+    except KeyboardInterrupt:
+        # The checkpoint keeps the saved playlists of the channels being ingested
+        logger.info('Interrupted, run again with the same checkpoint to resume')
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    if args.migrate:
+        ingested = [channel_id for channel_id in channel_ids if checkpoint.channel_status(channel_id) == 'ingested']
+        logger.info('Migrating %d channels to the warehouse', len(ingested))
+        results = yt.migrate_channels_to_warehouse(ingested, mongo_db)
+        for result in results:
+            if result['status'] == 'migrated':
+                checkpoint.set_channel_status(result['channel_id'], 'migrated')
+            else:
+                # The channel stays ingested, so the next run with --migrate tries it again
+                error = result['error'] or result['status']
+                logger.warning('Unable to migrate channel %s: %s', result['channel_id'], error)
+                checkpoint.set_channel_status(result['channel_id'], 'ingested', error)
+        if results and results[0]['refresh_error']:
+            logger.warning('Unable to refresh the summary views: %s', results[0]['refresh_error'])
+    logger.info('Channels per status: %s', checkpoint.counts())
+    failed_migrations = checkpoint.channel_errors('ingested')
+    if failed_migrations:
+        logger.info('%d ingested channels failed to migrate: %s', len(failed_migrations), failed_migrations)
+
+if __name__ == '__main__':
+    main()
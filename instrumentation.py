@@ -0,0 +1,388 @@
+import cProfile
+import functools
+import inspect
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from query_cache import get_query_cache
+from response_cache import get_response_cache
+from youtube_scheduler import get_request_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the exported metric names
+METRIC_PREFIX = 'youtube_pipeline_'
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+ROWS_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+# Help text and buckets of the histograms recorded by the pipeline
+HISTOGRAMS = {
+    'stage_seconds': ('Seconds spent in each pipeline stage', SECONDS_BUCKETS),
+    'youtube_request_seconds': ('Seconds per YouTube API request, response cache hits included', SECONDS_BUCKETS),
+    'db_seconds': ('Seconds per MongoDB or PostgreSQL operation', SECONDS_BUCKETS),
+    'db_rows': ('Rows or documents per MongoDB or PostgreSQL operation', ROWS_BUCKETS),
+}
+
+# Names of the stages timed by instrumented_stage, in the order they were decorated
+STAGE_NAMES = []
+
+# Lines of each profile kept, sorted by cumulative time
+PROFILE_TOP = 40
+
+INSTRUMENTATION_ENABLED = os.getenv('instrumentation', 'on').lower() not in ('off', 'false', '0')
+
+def query_label(query: str) -> str:
+    """
+        Labels a warehouse query by the myschema tables and views it reads e.g.
+        Video+channel_details+playlist, so the metrics of a query text stay few
+
+        Args:
+            query: string, sql query
+        Returns:
+            The sorted table names joined with +, 'other' when it reads no myschema table
+    """
+    tables = sorted(set(re.findall(r'myschema\."?(\w+)', query)))
+    return '+'.join(tables) or 'other'
+
+class Histogram:
+    """
+        Cumulative histogram of observed values with fixed upper bounds, like a
+        Prometheus histogram. Not thread safe, PipelineMetrics guards it.
+
+        Args:
+            buckets: tuple of the increasing upper bounds of the buckets
+    """
+
+    def __init__(self, buckets: tuple):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q quantile, the largest bound past the last bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+class PipelineMetrics:
+    """
+        Process wide timers and histograms of the ingest, migration and query paths.
+        Stages are timed with stage() or the instrumented_stage decorator, and each one
+        is written to the log as a JSON line. Stages named in profiled_stages also run
+        under cProfile, one at a time, and their last profile is kept.
+
+        Args:
+            enabled: bool, record anything at all
+            profiled_stages: iterable of the stage names to profile, '*' for every stage
+    """
+
+    def __init__(self, enabled: bool = True, profiled_stages=()):
+        self.enabled = enabled
+        self.profiled_stages = set(profiled_stages)
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._errors = {}
+        self._profiles = {}
+        self._profiling = threading.Lock()
+        self._started_at = time.time()
+
+    def observe(self, name: str, value: float, **labels):
+        """
+            Records a value in the histogram of name with the given labels
+
+            Args:
+                name: string, histogram name in HISTOGRAMS
+                value: float, observed value
+                labels: label values of the series
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def observe_db(self, db: str, operation: str, target: str, seconds: float, rows: int):
+        """
+            Records the latency and the rows of a database operation
+
+            Args:
+                db: string, 'mongo' or 'postgres'
+                operation: string e.g. bulk_write, copy, merge or query
+                target: string, collection, table or query_label of the operation
+                seconds: float, duration of the operation
+                rows: int, rows or documents written or read
+        """
+        self.observe('db_seconds', seconds, db=db, operation=operation, target=target)
+        self.observe('db_rows', rows, db=db, operation=operation, target=target)
+
+    def _should_profile(self, name: str) -> bool:
+        return '*' in self.profiled_stages or name in self.profiled_stages
+
+    @contextmanager
+    def stage(self, name: str, **fields):
+        """
+            Times a pipeline stage, counting it as failed when it raises
+
+            Args:
+                name: string, stage name
+                fields: values added to the structured log line of the stage e.g. channel_id
+        """
+        if not self.enabled:
+            yield
+            return
+        # cProfile only sees the calling thread, and only one profiler may be active at a time
+        profile = None
+        if self._should_profile(name) and self._profiling.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                self._profiling.release()
+                profile = None
+        status = 'ok'
+        started_at = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            status = 'error'
+            fields['error'] = repr(e)
+            with self._lock:
+                self._errors[name] = self._errors.get(name, 0) + 1
+            raise
+        finally:
+            seconds = time.perf_counter() - started_at
+            if profile is not None:
+                profile.disable()
+                self._profiling.release()
+                self._save_profile(name, profile)
+            self.observe('stage_seconds', seconds, stage=name)
+            logger.info(json.dumps(dict(
+                fields, event='stage', stage=name, status=status, seconds=round(seconds, 6),
+                thread=threading.current_thread().name
+            ), default=str))
+
+    def _save_profile(self, name: str, profile: cProfile.Profile):
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        with self._lock:
+            self._profiles[name] = {'captured_at': time.time(), 'text': output.getvalue()}
+
+    def profiles(self) -> dict:
+        """Last profile text of each profiled stage and when it was captured"""
+        with self._lock:
+            return {name: dict(profile) for name, profile in self._profiles.items()}
+
+    def summary(self, name: str) -> list:
+        """
+            Summarizes every series of a histogram
+
+            Args:
+                name: string, histogram name in HISTOGRAMS
+            Returns:
+                A list of dictionaries of the labels, count, sum, mean, p50 and p95 of each series
+        """
+        with self._lock:
+            series = [(dict(labels), histogram) for (key, labels), histogram in self._histograms.items()
+                      if key == name]
+            rows = [dict(
+                labels, count=histogram.count, sum=histogram.sum, mean=histogram.sum / histogram.count,
+                p50=histogram.quantile(0.5), p95=histogram.quantile(0.95)
+            ) for labels, histogram in series]
+        return sorted(rows, key=lambda row: row['sum'], reverse=True)
+
+    def errors(self) -> dict:
+        """Number of failed runs of each stage"""
+        with self._lock:
+            return dict(self._errors)
+
+    def reset(self):
+        """Drops every recorded value and profile"""
+        with self._lock:
+            self._histograms.clear()
+            self._errors.clear()
+            self._profiles.clear()
+            self._started_at = time.time()
+
+    def prometheus_text(self) -> str:
+        """
+            Renders the histograms, the stage errors, the YouTube API calls and quota of
+            the request scheduler and the hit rates of the response and query caches in
+            the Prometheus text exposition format
+        """
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples):
+            lines.append('# HELP {}{} {}'.format(METRIC_PREFIX, name, help_text))
+            lines.append('# TYPE {}{} {}'.format(METRIC_PREFIX, name, kind))
+            for suffix, labels, value in samples:
+                lines.append('{}{}{}{} {}'.format(
+                    METRIC_PREFIX, name, suffix, _format_labels(labels), _format_value(value)
+                ))
+
+        with self._lock:
+            histograms = [
+                (key, dict(labels), histogram.buckets, list(histogram.counts), histogram.count, histogram.sum)
+                for (key, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0])
+            ]
+            errors = dict(self._errors)
+            started_at = self._started_at
+        for name, (help_text, _) in HISTOGRAMS.items():
+            samples = []
+            for key, labels, buckets, counts, count, total in histograms:
+                if key != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    samples.append(('_bucket', dict(labels, le=bound), cumulative))
+                samples.append(('_sum', labels, total))
+                samples.append(('_count', labels, count))
+            metric(name, 'histogram', help_text, samples)
+        metric('stage_errors_total', 'counter', 'Failed runs of each pipeline stage',
+               [('', {'stage': stage}, count) for stage, count in sorted(errors.items())])
+        metric('start_time_seconds', 'gauge', 'Unix time the metrics were last reset', [('', {}, started_at)])
+
+        # The scheduler counts reset with the daily quota at midnight Pacific time, so they are gauges
+        scheduler = get_request_scheduler().stats()
+        metric('youtube_api_calls_today', 'gauge', 'YouTube API requests sent today per endpoint',
+               [('', {'endpoint': endpoint}, calls) for endpoint, calls in sorted(scheduler['calls'].items())])
+        metric('youtube_quota_units_today', 'gauge', 'YouTube API quota units spent today per endpoint',
+               [('', {'endpoint': endpoint}, units) for endpoint, units in sorted(scheduler['units'].items())])
+        metric('youtube_quota_remaining', 'gauge', 'Estimated YouTube API quota units left today',
+               [('', {}, scheduler['quota_remaining'])])
+        metric('youtube_api_retries_today', 'gauge', 'YouTube API requests retried today',
+               [('', {}, scheduler['retries'])])
+
+        responses = get_response_cache().stats()
+        metric('response_cache_lookups_total', 'counter', 'YouTube API response cache lookups per endpoint', [
+            ('', {'endpoint': endpoint, 'result': result}, count)
+            for result in ('hits', 'misses') for endpoint, count in sorted(responses[result].items())
+        ])
+        metric('response_cache_hit_ratio', 'gauge', 'Share of the response cache lookups that were hits',
+               [('', {}, responses['hit_rate'])])
+        queries = get_query_cache().stats()
+        metric('query_cache_lookups_total', 'counter', 'Warehouse query result cache lookups',
+               [('', {'result': result}, queries[result]) for result in ('hits', 'misses')])
+        metric('query_cache_hit_ratio', 'gauge', 'Share of the query result cache lookups that were hits',
+               [('', {}, queries['hit_rate'])])
+        metric('query_cache_entries', 'gauge', 'Warehouse query results cached', [('', {}, queries['entries'])])
+        return '\n'.join(lines) + '\n'
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, _escape_label(
+        _format_value(value) if isinstance(value, (int, float)) else value
+    )) for key, value in labels.items()) + '}'
+
+def _escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+def get_metrics() -> PipelineMetrics:
+    """
+        Gets the metrics shared by the process, configured from instrumentation and
+        instrumentation_profile (stage names separated by commas, * for every stage)
+    """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = PipelineMetrics(
+                enabled=INSTRUMENTATION_ENABLED,
+                profiled_stages=[name.strip() for name in os.getenv('instrumentation_profile', '').split(',')
+                                 if name.strip()],
+            )
+        return _metrics
+
+def set_metrics(metrics: PipelineMetrics):
+    """Replaces the shared metrics"""
+    global _metrics
+    with _metrics_lock:
+        _metrics = metrics
+
+def instrumented_stage(name: str, *logged_arguments):
+    """
+        Decorates a function so every call is timed as a stage of the shared metrics
+
+        Args:
+            name: string, stage name
+            logged_arguments: names of the arguments added to the structured log line e.g. channel_id
+    """
+    if name not in STAGE_NAMES:
+        STAGE_NAMES.append(name)
+
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            fields = {}
+            if logged_arguments:
+                arguments = signature.bind_partial(*args, **kwargs).arguments
+                fields = {argument: arguments.get(argument) for argument in logged_arguments}
+            with get_metrics().stage(name, **fields):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = get_metrics().prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+def start_metrics_server(port: int, host: str = '') -> ThreadingHTTPServer:
+    """
+        Serves the shared metrics at /metrics for Prometheus from a daemon thread
+
+        Args:
+            port: int, port to listen on, 0 for any free port
+            host: string, address to listen on, every address by default
+        Returns:
+            The running server, shut it down with server.shutdown()
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info('Serving metrics at http://%s:%d/metrics', host or '0.0.0.0', server.server_address[1])
+    return server
@@ -0,0 +1,218 @@
+import json
+import logging
+import psycopg2.extras
+
+logger = logging.getLogger(__name__)
+
+JOB_KINDS = ('ingest', 'migrate')
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+# Jobs table created by warehouse_schema. A channel has at most one queued job of each kind,
+# and workers claim the queued jobs by priority through the partial index
+JOBS_DDL = (
+    '''
+    CREATE TABLE IF NOT EXISTS myschema.jobs (
+        job_id BIGSERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        channel_id TEXT NOT NULL,
+        options JSONB NOT NULL DEFAULT '{}',
+        priority INT NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        result JSONB,
+        attempts INT NOT NULL DEFAULT 0,
+        worker TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        started_at TIMESTAMPTZ,
+        heartbeat_at TIMESTAMPTZ,
+        finished_at TIMESTAMPTZ
+    )
+    ''',
+    '''
+    CREATE UNIQUE INDEX IF NOT EXISTS jobs_queued_channel ON myschema.jobs (kind, channel_id)
+    WHERE status = 'queued'
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS jobs_queued ON myschema.jobs (priority DESC, job_id)
+    WHERE status = 'queued'
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS jobs_running_channel ON myschema.jobs (kind, channel_id)
+    WHERE status = 'running'
+    ''',
+)
+
+JOB_COLUMNS = (
+    'job_id', 'kind', 'channel_id', 'options', 'priority', 'status', 'progress', 'message',
+    'result', 'attempts', 'worker', 'created_at', 'started_at', 'heartbeat_at', 'finished_at',
+)
+
+def enqueue_job(connection, kind: str, channel_id: str, priority: int = 0, options: dict = None) -> int:
+    """
+        Queues a job for a channel. When the channel already has a queued job of the same
+        kind, that job is kept instead, with its priority raised and the new options
+        merged over its own. A running job does not absorb the new one, as it may have
+        read the data before the latest changes.
+
+        Args:
+            connection: psycopg2 connection object
+            kind: string, one of JOB_KINDS
+            channel_id: string, youtube channel id
+            priority: int, jobs with a higher priority are claimed first
+            options: dictionary, options of the job e.g. {'incremental': True}
+        Returns:
+            The id of the job
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError('Unknown job kind {}, expected one of {}'.format(kind, ', '.join(JOB_KINDS)))
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            INSERT INTO myschema.jobs (kind, channel_id, priority, options) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (kind, channel_id) WHERE status = 'queued'
+            DO UPDATE SET priority = GREATEST(myschema.jobs.priority, EXCLUDED.priority),
+                options = myschema.jobs.options || EXCLUDED.options
+            RETURNING job_id
+        ''', (kind, channel_id, priority, json.dumps(options or {})))
+        job_id = cursor.fetchone()[0]
+    connection.commit()
+    return job_id
+
+def claim_job(connection, worker: str, kinds: tuple = JOB_KINDS) -> dict:
+    """
+        Claims the queued job with the highest priority. Jobs locked by other workers
+        are skipped, so any number of workers can claim concurrently, and a job waits
+        while another job of the same kind runs for its channel.
+
+        Args:
+            connection: psycopg2 connection object
+            worker: string, name of the claiming worker
+            kinds: tuple of the job kinds the worker runs
+        Returns:
+            The claimed job as a dictionary, None when no job is queued
+    """
+    with connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute('''
+            UPDATE myschema.jobs SET status = 'running', worker = %s, attempts = attempts + 1,
+                started_at = now(), heartbeat_at = now(), progress = 0, message = NULL
+            WHERE job_id = (
+                SELECT job_id FROM myschema.jobs queued
+                WHERE status = 'queued' AND kind = ANY(%s) AND NOT EXISTS (
+                    SELECT 1 FROM myschema.jobs running
+                    WHERE running.status = 'running' AND running.kind = queued.kind
+                        AND running.channel_id = queued.channel_id
+                )
+                ORDER BY priority DESC, job_id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {}
+        '''.format(', '.join(JOB_COLUMNS)), (worker, list(kinds)))
+        job = cursor.fetchone()
+    connection.commit()
+    return dict(job) if job else None
+
+def update_job_progress(connection, job_id: int, progress: float, message: str = None):
+    """
+        Records the progress of a running job, which also serves as its heartbeat
+
+        Args:
+            connection: psycopg2 connection object
+            job_id: int, id of the job
+            progress: float, fraction of the job done between 0 and 1
+            message: string, what the job is doing
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            UPDATE myschema.jobs SET progress = %s, message = COALESCE(%s, message), heartbeat_at = now()
+            WHERE job_id = %s AND status = 'running'
+        ''', (progress, message, job_id))
+    connection.commit()
+
+def heartbeat_job(connection, job_id: int):
+    """Marks a running job as still alive"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE myschema.jobs SET heartbeat_at = now() WHERE job_id = %s AND status = 'running'", (job_id,)
+        )
+    connection.commit()
+
+def finish_job(connection, job_id: int, worker: str, status: str, message: str = None, result: dict = None) -> bool:
+    """
+        Records the outcome of a job run by a worker. Nothing is recorded when the job
+        is no longer running on that worker, e.g. after it was requeued as stale and
+        claimed again by another worker.
+
+        Args:
+            connection: psycopg2 connection object
+            job_id: int, id of the job
+            worker: string, name of the worker that claimed the job
+            status: string, 'done' or 'failed'
+            message: string, outcome or error message
+            result: dictionary, json serializable result of the job
+        Returns:
+            Whether the outcome was recorded
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            UPDATE myschema.jobs SET status = %(status)s, message = %(message)s, result = %(result)s,
+                finished_at = now(), progress = CASE WHEN %(status)s = 'done' THEN 1 ELSE progress END
+            WHERE job_id = %(job_id)s AND status = 'running' AND worker = %(worker)s
+        ''', {
+            'status': status, 'message': message, 'job_id': job_id, 'worker': worker,
+            'result': json.dumps(result, default=str) if result is not None else None,
+        })
+        recorded = cursor.rowcount == 1
+    connection.commit()
+    return recorded
+
+def requeue_stale_jobs(connection, timeout: float, max_attempts: int = 3) -> int:
+    """
+        Gives the running jobs of workers that stopped sending heartbeats back to the
+        queue, or fails them once they used up their attempts or when the channel got
+        queued again in the meantime
+
+        Args:
+            connection: psycopg2 connection object
+            timeout: float, seconds without a heartbeat after which a worker is considered gone
+            max_attempts: int, claims of a job before it is failed
+        Returns:
+            The number of jobs requeued or failed
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            UPDATE myschema.jobs stale SET
+                status = CASE WHEN stale.attempts >= %s OR EXISTS (
+                    SELECT 1 FROM myschema.jobs queued
+                    WHERE queued.status = 'queued' AND queued.kind = stale.kind AND queued.channel_id = stale.channel_id
+                ) THEN 'failed' ELSE 'queued' END,
+                message = 'worker stopped responding', worker = NULL
+            WHERE stale.status = 'running' AND stale.heartbeat_at < now() - %s * interval '1 second'
+        ''', (max_attempts, timeout))
+        count = cursor.rowcount
+    connection.commit()
+    if count:
+        logger.warning('Requeued %d jobs of unresponsive workers', count)
+    return count
+
+def get_jobs(connection, job_ids: list = None, limit: int = 50) -> list:
+    """
+        Gets jobs to poll their status
+
+        Args:
+            connection: psycopg2 connection object
+            job_ids: list of job ids, None for the most recent jobs
+            limit: int, maximum number of jobs returned
+        Returns:
+            A list of job dictionaries, most recent first
+    """
+    with connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute('''
+            SELECT {} FROM myschema.jobs
+            WHERE %(job_ids)s::BIGINT[] IS NULL OR job_id = ANY(%(job_ids)s::BIGINT[])
+            ORDER BY job_id DESC
+            LIMIT %(limit)s
+        '''.format(', '.join(JOB_COLUMNS)), {'job_ids': list(job_ids) if job_ids is not None else None, 'limit': limit})
+        jobs = [dict(job) for job in cursor.fetchall()]
+    connection.rollback()
+    return jobs
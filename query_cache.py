@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+# Single row table counting the commits that changed the warehouse, created by warehouse_schema
+WAREHOUSE_VERSION_DDL = '''
+    CREATE TABLE IF NOT EXISTS myschema.warehouse_version (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        version BIGINT NOT NULL
+    )
+'''
+
+def bump_warehouse_version(cursor) -> int:
+    """
+        Increments the warehouse data version in the transaction of cursor, so the new
+        version becomes visible together with the data it describes
+
+        Args:
+            cursor: psycopg2 cursor of the loading transaction
+        Returns:
+            The new data version
+    """
+    cursor.execute('''
+        INSERT INTO myschema.warehouse_version (id, version) VALUES (TRUE, 1)
+        ON CONFLICT (id) DO UPDATE SET version = myschema.warehouse_version.version + 1
+        RETURNING version
+    ''')
+    return cursor.fetchone()[0]
+
+def get_warehouse_version(connection) -> int:
+    """
+        Reads the warehouse data version
+
+        Args:
+            connection: psycopg2 connection object
+        Returns:
+            The data version, 0 when nothing was loaded yet
+    """
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT version FROM myschema.warehouse_version')
+            row = cursor.fetchone()
+        return row[0] if row else 0
+    except psycopg2.errors.UndefinedTable:
+        return 0
+    finally:
+        connection.rollback()
+
+class QueryResultCache:
+    """
+        In-process cache of warehouse query results keyed by the query text and the
+        warehouse data version. The version is read from the database at most once per
+        version_ttl seconds, loads made by this process update it immediately, and
+        results of older versions are dropped as soon as a newer version is seen.
+
+        Args:
+            max_entries: int, results kept before the least recently used one is evicted
+            version_ttl: float, seconds the data version is trusted without reading it again
+    """
+
+    def __init__(self, max_entries: int = 256, version_ttl: float = 10, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.version_ttl = version_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._version = None
+        self._version_read_at = None
+        self._hits = 0
+        self._misses = 0
+
+    def set_version(self, version: int):
+        """Records a data version, dropping the results of older versions"""
+        with self._lock:
+            if self._version is None or version > self._version:
+                self._results = OrderedDict(
+                    (key, results) for key, results in self._results.items() if key[-1] >= version
+                )
+                self._version = version
+            self._version_read_at = self._clock()
+
+    def _get_version(self, connection_factory) -> int:
+        with self._lock:
+            if self._version is not None and self._clock() - self._version_read_at < self.version_ttl:
+                return self._version
+        with connection_factory() as connection:
+            self.set_version(get_warehouse_version(connection))
+        return self._version
+
+    def get_results(self, query: str, connection_factory, run, parameters: tuple = None):
+        """
+            Gets the results of a query, running it only when the cache has no result
+            for the current data version
+
+            Args:
+                query: string, sql query
+                connection_factory: callable returning a context manager that yields a connection
+                run: callable taking a connection and returning the results
+                parameters: tuple, hashable values that change the results besides the query text
+            Returns:
+                The results returned by run
+        """
+        key = (query, parameters, self._get_version(connection_factory))
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                self._hits += 1
+                return self._results[key]
+            self._misses += 1
+        with connection_factory() as connection:
+            results = run(connection)
+        with self._lock:
+            if self._version is None or key[-1] >= self._version:
+                self._results[key] = results
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        return results
+
+    def clear(self):
+        """Drops every cached result"""
+        with self._lock:
+            self._results.clear()
+
+    def stats(self) -> dict:
+        """Hits, misses and number of cached results"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'version': self._version,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+                'entries': len(self._results),
+            }
+
+_query_cache = None
+_query_cache_lock = threading.Lock()
+
+def get_query_cache() -> QueryResultCache:
+    """
+        Gets the query result cache shared by the process, configured from
+        warehouse_query_cache_size and warehouse_version_ttl
+    """
+    global _query_cache
+    with _query_cache_lock:
+        if _query_cache is None:
+            _query_cache = QueryResultCache(
+                max_entries=int(os.getenv('warehouse_query_cache_size', 256)),
+                version_ttl=float(os.getenv('warehouse_version_ttl', 10)),
+            )
+        return _query_cache
+
+def set_query_cache(cache: QueryResultCache):
+    """Replaces the shared query result cache"""
+    global _query_cache
+    with _query_cache_lock:
+        _query_cache = cache
@@ -0,0 +1,241 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+from youtube_scheduler import get_endpoint
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached response stays fresh, per endpoint
+CACHE_TTLS = {
+    'channels.list': 15 * 60,
+    'playlists.list': 60 * 60,
+    'playlistItems.list': 60 * 60,
+    'videos.list': 15 * 60,
+    'commentThreads.list': 60 * 60,
+    'comments.list': 60 * 60,
+}
+DEFAULT_CACHE_TTL = 15 * 60
+
+# off: always use the network, on: serve fresh cached responses and store new ones,
+# record: always use the network and store the responses, replay: only serve stored responses
+CACHE_MODES = ('off', 'on', 'record', 'replay')
+
+# Query parameters that do not change the response
+IGNORED_PARAMETERS = {'key', 'alt', 'prettyPrint'}
+
+class CacheMissError(Exception):
+    """Raised in replay mode when a request has no recorded response"""
+
+def get_cache_key(request: any) -> tuple:
+    """
+        Gets the cache key of a google api request
+
+        Args:
+            request: googleapiclient HttpRequest object
+        Returns:
+            A tuple of the endpoint name and the normalized query string
+    """
+    parameters = sorted(
+        (name, value) for name, value in parse_qsl(urlsplit(request.uri).query, keep_blank_values=True)
+        if name not in IGNORED_PARAMETERS
+    )
+    return get_endpoint(request), json.dumps(parameters, separators=(',', ':'))
+
+class ResponseCache:
+    """
+        On-disk cache of YouTube Data API responses stored in a sqlite file. Entries
+        expire after a per-endpoint TTL and the least recently used ones are evicted
+        once the cache grows over max_bytes.
+
+        Args:
+            path: string, path of the sqlite file
+            mode: string, one of CACHE_MODES
+            max_bytes: int, maximum total size of the cached response bodies
+            ttls: dictionary, seconds a response stays fresh per endpoint
+    """
+
+    def __init__(self, path: str, mode: str = 'on', max_bytes: int = 200 * 1024 * 1024,
+                 ttls: dict = None, clock=time.time):
+        if mode not in CACHE_MODES:
+            raise ValueError('Unknown cache mode {}, expected one of {}'.format(mode, ', '.join(CACHE_MODES)))
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.ttls = dict(CACHE_TTLS, **(ttls or {}))
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._hits = {}
+        self._misses = {}
+        self._evictions = 0
+        self._connection = None
+        if mode != 'off':
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.executescript('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    endpoint TEXT NOT NULL,
+                    parameters TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (endpoint, parameters)
+                );
+                CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+            ''')
+            self._size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def _count(self, counter: dict, endpoint: str):
+        counter[endpoint] = counter.get(endpoint, 0) + 1
+
+    def get(self, key: tuple, fresh_only: bool = True):
+        """
+            Gets a cached response
+
+            Args:
+                key: tuple, cache key returned by get_cache_key
+                fresh_only: bool, ignore responses older than the endpoint TTL
+            Returns:
+                The response dictionary, None when there is no usable entry
+        """
+        endpoint, parameters = key
+        now = self._clock()
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT body, stored_at FROM responses WHERE endpoint = ? AND parameters = ?', key
+            ).fetchone()
+            if row is None or (fresh_only and now - row[1] > self.ttls.get(endpoint, DEFAULT_CACHE_TTL)):
+                self._count(self._misses, endpoint)
+                return None
+            self._connection.execute(
+                'UPDATE responses SET accessed_at = ? WHERE endpoint = ? AND parameters = ?', (now,) + key
+            )
+            self._connection.commit()
+            self._count(self._hits, endpoint)
+            return json.loads(row[0])
+
+    def put(self, key: tuple, response: dict):
+        """
+            Stores a response and evicts the least recently used entries over max_bytes
+
+            Args:
+                key: tuple, cache key returned by get_cache_key
+                response: dictionary, decoded api response
+        """
+        body = json.dumps(response, separators=(',', ':'))
+        now = self._clock()
+        with self._lock:
+            previous = self._connection.execute(
+                'SELECT size FROM responses WHERE endpoint = ? AND parameters = ?', key
+            ).fetchone()
+            self._connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                key + (body, len(body), now, now)
+            )
+            self._size += len(body) - (previous[0] if previous else 0)
+            while self._size > self.max_bytes:
+                oldest = self._connection.execute(
+                    'SELECT endpoint, parameters, size FROM responses ORDER BY accessed_at LIMIT 1'
+                ).fetchone()
+                if oldest is None:
+                    break
+                self._connection.execute(
+                    'DELETE FROM responses WHERE endpoint = ? AND parameters = ?', oldest[:2]
+                )
+                self._size -= oldest[2]
+                self._evictions += 1
+            self._connection.commit()
+
+    def execute(self, request: any, send, etag: str = None) -> dict:
+        """
+            Executes a request through the cache
+
+            Args:
+                request: googleapiclient HttpRequest object
+                send: callable sending the request over the network and returning the response,
+                      None when it is unchanged since etag
+                etag: string, etag of a conditional request. Conditional requests always go to
+                      the network except in replay mode, where a recorded response with the
+                      same etag is answered as unchanged
+            Returns:
+                The decoded response of the request, None when it is unchanged since etag
+        """
+        if self.mode == 'off':
+            return send()
+        key = get_cache_key(request)
+        if self.mode == 'replay':
+            response = self.get(key, fresh_only=False)
+            if response is None:
+                raise CacheMissError('No recorded response for {} {}'.format(*key))
+            return None if etag and response.get('etag') == etag else response
+        if self.mode == 'on' and not etag:
+            response = self.get(key)
+            if response is not None:
+                return response
+        response = send()
+        if response is not None:
+            self.put(key, response)
+        return response
+
+    def clear(self):
+        """Deletes every cached response"""
+        if self._connection is None:
+            return
+        with self._lock:
+            self._connection.execute('DELETE FROM responses')
+            self._connection.commit()
+            self._size = 0
+
+    def stats(self) -> dict:
+        """Hits and misses per endpoint, evictions and the size of the cache"""
+        with self._lock:
+            hits = sum(self._hits.values())
+            lookups = hits + sum(self._misses.values())
+            return {
+                'mode': self.mode,
+                'hits': dict(self._hits),
+                'misses': dict(self._misses),
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'size_bytes': self._size if self._connection is not None else 0,
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def _configured_response_cache(mode: str) -> ResponseCache:
+    return ResponseCache(
+        os.getenv('youtube_cache_path', '.youtube_cache.sqlite'),
+        mode=mode,
+        max_bytes=int(os.getenv('youtube_cache_max_mb', 200)) * 1024 * 1024,
+    )
+
+def get_response_cache() -> ResponseCache:
+    """
+        Gets the response cache shared by the process, configured from
+        youtube_cache_mode, youtube_cache_path and youtube_cache_max_mb. The cache is
+        off unless youtube_cache_mode turns it on, so normal syncs always see fresh data.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = _configured_response_cache(os.getenv('youtube_cache_mode', 'off'))
+        return _cache
+
+def set_response_cache_mode(mode: str):
+    """
+        Replaces the shared response cache by one in the given mode, configured from
+        youtube_cache_path and youtube_cache_max_mb e.g. for a --cache-mode flag
+
+        Args:
+            mode: string, one of CACHE_MODES
+    """
+    set_response_cache(_configured_response_cache(mode))
+
+def set_response_cache(cache: ResponseCache):
+    """Replaces the shared response cache e.g. to switch to replay mode"""
+    global _cache
+    with _cache_lock:
+        _cache = cache
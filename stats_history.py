@@ -0,0 +1,180 @@
+import logging
+import os
+import time
+from itertools import islice
+import psycopg2.extras
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_ENTITY_TYPES = ('channel', 'video')
+SNAPSHOT_METRICS = ('view_count', 'like_count', 'comment_count', 'subscriber_count', 'video_count')
+
+# Metrics of each entity type whose growth the Analyze page ranks
+GROWTH_METRICS = {
+    'channel': ('view_count', 'subscriber_count', 'video_count'),
+    'video': ('view_count', 'like_count', 'comment_count'),
+}
+
+# Snapshots younger than this many days are all kept, older ones are downsampled to the
+# last snapshot of each day, and the ones older than the retention are deleted
+SNAPSHOT_FULL_DAYS = int(os.getenv('stats_snapshot_full_days', 30))
+_retention_days = os.getenv('stats_snapshot_retention_days')
+SNAPSHOT_RETENTION_DAYS = int(_retention_days) if _retention_days else None
+
+# Snapshots appended per INSERT page
+SNAPSHOT_PAGE_SIZE = 1000
+
+# Append-only statistics snapshots created by warehouse_schema, one row per entity each
+# time its statistics were read from the API
+SNAPSHOTS_DDL = (
+    '''
+    CREATE TABLE IF NOT EXISTS myschema.stats_snapshots (
+        entity_id VARCHAR(255) NOT NULL,
+        captured_at TIMESTAMPTZ NOT NULL,
+        entity_type VARCHAR(16) NOT NULL,
+        channel_id VARCHAR(255) NOT NULL,
+        view_count BIGINT,
+        like_count BIGINT,
+        comment_count BIGINT,
+        subscriber_count BIGINT,
+        video_count BIGINT,
+        PRIMARY KEY (entity_id, captured_at)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS stats_snapshots_channel ON myschema.stats_snapshots (channel_id, captured_at)',
+)
+
+# Daily rollup of the snapshots, refreshed along with the warehouse summaries
+STATS_ROLLUPS = (
+    ('stats_daily', """
+        SELECT DISTINCT ON (entity_id, (captured_at AT TIME ZONE 'UTC')::date)
+            entity_id, entity_type, channel_id, (captured_at AT TIME ZONE 'UTC')::date AS day,
+            view_count, like_count, comment_count, subscriber_count, video_count
+        FROM myschema.stats_snapshots
+        ORDER BY entity_id, (captured_at AT TIME ZONE 'UTC')::date, captured_at DESC
+    """, (
+        'CREATE UNIQUE INDEX IF NOT EXISTS stats_daily_key ON myschema.stats_daily (entity_id, day)',
+        'CREATE INDEX IF NOT EXISTS stats_daily_type_day ON myschema.stats_daily (entity_type, day)',
+    )),
+)
+
+def get_snapshot_watermark(connection, channel_id: str):
+    """
+        Gets the capture time from which the lake snapshots of a channel still need to be
+        appended to the warehouse. It trails the newest snapshot by a day so snapshots
+        saved out of order by concurrent ingests are not missed.
+
+        Args:
+            connection: psycopg2 connection object
+            channel_id: string, youtube channel id
+        Returns:
+            An ISO 8601 string, None when the channel has no snapshot in the warehouse
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT to_char((max(captured_at) - interval '1 day') AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"Z"')
+            FROM myschema.stats_snapshots WHERE channel_id = %s
+        ''', (channel_id,))
+        return cursor.fetchone()[0]
+
+def append_snapshots(cursor, snapshots) -> dict:
+    """
+        Appends snapshots to the warehouse, snapshots already there are skipped
+
+        Args:
+            cursor: psycopg2 cursor of the loading transaction
+            snapshots: iterable of snapshot documents of the data lake, consumed lazily
+        Returns:
+            A dictionary of the snapshots read, the snapshots appended and the seconds it took
+    """
+    started_at = time.perf_counter()
+    stats = {'rows': 0, 'changed': 0}
+    rows = (
+        (snapshot['entity_id'], snapshot['captured_at'], snapshot['entity_type'], snapshot['channel_id'])
+        + tuple(snapshot['metrics'].get(metric) for metric in SNAPSHOT_METRICS)
+        for snapshot in snapshots
+    )
+    while True:
+        page = list(islice(rows, SNAPSHOT_PAGE_SIZE))
+        if not page:
+            break
+        psycopg2.extras.execute_values(cursor, '''
+            INSERT INTO myschema.stats_snapshots (entity_id, captured_at, entity_type, channel_id, {})
+            VALUES %s ON CONFLICT DO NOTHING
+        '''.format(', '.join(SNAPSHOT_METRICS)), page, page_size=len(page))
+        stats['rows'] += len(page)
+        stats['changed'] += cursor.rowcount
+    stats['seconds'] = time.perf_counter() - started_at
+    return stats
+
+def compact_snapshots(connection, full_days: int = SNAPSHOT_FULL_DAYS,
+                      retention_days: int = SNAPSHOT_RETENTION_DAYS) -> int:
+    """
+        Downsamples the warehouse snapshots older than full_days to the last one of each
+        entity per day, and deletes the ones older than retention_days
+
+        Args:
+            connection: psycopg2 connection object
+            full_days: int, days during which every snapshot is kept
+            retention_days: int, days after which snapshots are deleted, None to keep them forever
+        Returns:
+            The number of snapshots deleted
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            DELETE FROM myschema.stats_snapshots s
+            WHERE s.captured_at < now() - %s * interval '1 day' AND EXISTS (
+                SELECT 1 FROM myschema.stats_snapshots later
+                WHERE later.entity_id = s.entity_id AND later.captured_at > s.captured_at
+                    AND later.captured_at < date_trunc('day', s.captured_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'
+                        + interval '1 day'
+            )
+        ''', (full_days,))
+        deleted = cursor.rowcount
+        if retention_days is not None:
+            cursor.execute('DELETE FROM myschema.stats_snapshots WHERE captured_at < now() - %s * interval \'1 day\'',
+                           (retention_days,))
+            deleted += cursor.rowcount
+    connection.commit()
+    logger.info('Compacted the warehouse statistics snapshots, %d deleted', deleted)
+    return deleted
+
+def fastest_growing_query(entity_type: str, metric: str, days: int = 30, limit: int = 10) -> str:
+    """
+        Builds the query ranking the videos or channels whose metric grew the most over
+        the last days, from the first to the last day they were captured in that window
+
+        Args:
+            entity_type: string, 'video' or 'channel'
+            metric: string, one of the GROWTH_METRICS of the entity type
+            days: int, length of the window in days
+            limit: int, number of entities returned
+        Returns:
+            A sql query returning the video and channel names, or the channel name, the growth
+            and the growth per day of each entity
+    """
+    if metric not in GROWTH_METRICS.get(entity_type, ()):
+        raise ValueError('Unknown {} metric {}'.format(entity_type, metric))
+    names = {
+        'video': 'LEFT JOIN myschema.video_summary n ON n.video_id = newest.entity_id',
+        'channel': 'LEFT JOIN myschema.channel_summary n ON n.channel_id = newest.entity_id',
+    }[entity_type]
+    window = '''
+        SELECT DISTINCT ON (entity_id) entity_id, day, {metric} AS value
+        FROM myschema.stats_daily
+        WHERE entity_type = '{entity_type}' AND day >= current_date - {days} AND {metric} IS NOT NULL
+        ORDER BY entity_id, day {{}}
+    '''.format(metric=metric, entity_type=entity_type, days=int(days))
+    return '''
+        WITH oldest AS ({oldest}), newest AS ({newest})
+        SELECT {names_columns}, newest.value - oldest.value AS growth,
+            round((newest.value - oldest.value)::numeric / (newest.day - oldest.day), 1) AS growth_per_day
+        FROM newest
+        INNER JOIN oldest ON oldest.entity_id = newest.entity_id AND oldest.day < newest.day
+        {names}
+        ORDER BY growth DESC
+        LIMIT {limit}
+    '''.format(
+        oldest=window.format('ASC'), newest=window.format('DESC'), names=names, limit=int(limit),
+        names_columns='n.video_name, n.channel_name' if entity_type == 'video' else 'n.channel_name',
+    )
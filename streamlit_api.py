@@ -1,15 +1,346 @@
 import isodate
+import logging
 import pymongo
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 import pandas as pd
 import os
+import random
+import re
+import time
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import islice
 from googleapiclient.discovery import build
 from dotenv import load_dotenv
+from googleapiclient.errors import HttpError
+from youtube_scheduler import get_endpoint, get_error_reason, get_request_scheduler
+from instrumentation import get_metrics, instrumented_stage, query_label
+from response_cache import get_response_cache
+from query_cache import bump_warehouse_version, get_query_cache
+from stats_history import (SNAPSHOT_FULL_DAYS, SNAPSHOT_RETENTION_DAYS, STATS_ROLLUPS, append_snapshots,
+                           get_snapshot_watermark)
+from warehouse_schema import WAREHOUSE_SUMMARIES, migrate_warehouse_schema
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# The videos endpoint accepts at most 50 ids per request
+VIDEO_BATCH_SIZE = 50
+
+# Maximum number of api requests in flight when ingesting channels concurrently
+YOUTUBE_MAX_WORKERS = int(os.getenv('youtube_max_workers', 8))
+
+# List endpoints return at most 50 items per page
+PAGE_SIZE = 50
+
+def _optional_int(value):
+    return int(value) if value else None
+
+# Ingestion budgets, unset means no limit
+MAX_PLAYLISTS_PER_CHANNEL = _optional_int(os.getenv('youtube_max_playlists'))
+MAX_VIDEOS_PER_PLAYLIST = _optional_int(os.getenv('youtube_max_videos_per_playlist'))
+MAX_COMMENTS_PER_VIDEO = _optional_int(os.getenv('youtube_max_comments_per_video', 100))
+
+# Largest page of the commentThreads and comments endpoints
+COMMENT_PAGE_SIZE = 100
+# Comments are streamed into the data lake and the warehouse staging tables this many rows at a time
+STREAM_CHUNK_SIZE = int(os.getenv('stream_chunk_size', 1000))
+
+# Incremental syncs refresh the statistics of videos published in this many days
+SYNC_RECENT_DAYS = int(os.getenv('youtube_sync_recent_days', 30))
+
+# Collections of the normalized data lake, documents are keyed by their youtube ids
+LAKE_CHANNELS = 'channels'
+LAKE_PLAYLISTS = 'playlists'
+LAKE_VIDEOS = 'videos'
+LAKE_COMMENTS = 'comments'
+LAKE_SNAPSHOTS = 'stats_snapshots'
+SYNC_STATE_COLLECTION = 'sync_state'
+LEGACY_CHANNELS_COLLECTION = 'channels_data'
+LAKE_BULK_WRITE_SIZE = 1000
+# Warehouse columns of the bulk loaded tables and the data lake keys they are read from
+WAREHOUSE_COLUMNS = {
+    'channel_details': (
+        ('channel_id', 'channel_id'), ('channel_name', 'channel_name'), ('channel_views', 'channel_views'),
+        ('channel_description', 'channel_description'), ('channel_status', 'status'),
+        ('channel_subscribers', 'channel_subscribers'), ('channel_video_count', 'channel_video_count'),
+    ),
+    'playlist': (
+        ('playlist_id', 'playlist_id'), ('channel_id', 'channel_id'),
+        ('playlist_name', 'playlist_name'), ('playlist_description', 'playlist_description'),
+    ),
+    'Video': (
+        ('video_id', 'video_id'), ('playlist_id', 'playlist_id'), ('video_name', 'video_name'),
+        ('video_description', 'video_description'), ('published_date', 'video_published_date'),
+        ('view_count', 'view_count'), ('like_count', 'like_count'), ('dislike_count', 'dislike_count'),
+        ('favourite_count', 'favourite_count'), ('comment_count', 'comment_count'),
+        ('duration', 'video_duration'), ('thumbnail_url', 'thumbnail_url'), ('caption_status', 'caption_status'),
+    ),
+    'Comment': (
+        ('comment_id', 'comment_id'), ('video_id', 'video_id'), ('comment_text', 'comment_text'),
+        ('comment_author', 'comment_author'), ('comment_published_date', 'comment_published_date'),
+        ('parent_id', 'parent_id'), ('reply_count', 'reply_count'),
+    ),
+}
+WAREHOUSE_PRIMARY_KEYS = {
+    'channel_details': 'channel_id',
+    'playlist': 'playlist_id',
+    'Video': 'video_id',
+    'Comment': 'comment_id',
+}
+# Rows of a channel that are no longer in the data lake, scoped by %(channel_id)s
+WAREHOUSE_STALE_ROWS_DELETES = (
+    ('Comment', """
+        DELETE FROM myschema."Comment" c
+        USING myschema."Video" v, myschema."playlist" p
+        WHERE c.video_id = v.video_id AND v.playlist_id = p.playlist_id AND p.channel_id = %(channel_id)s
+            AND NOT EXISTS (SELECT 1 FROM "Comment_staging" s WHERE s.comment_id = c.comment_id)
+    """),
+    ('Video', """
+        DELETE FROM myschema."Video" v
+        USING myschema."playlist" p
+        WHERE v.playlist_id = p.playlist_id AND p.channel_id = %(channel_id)s
+            AND NOT EXISTS (SELECT 1 FROM "Video_staging" s WHERE s.video_id = v.video_id)
+    """),
+    ('playlist', """
+        DELETE FROM myschema."playlist" p
+        WHERE p.channel_id = %(channel_id)s
+            AND NOT EXISTS (SELECT 1 FROM "playlist_staging" s WHERE s.playlist_id = p.playlist_id)
+    """),
+)
+# Every row of a channel, scoped by %(channel_id)s
+WAREHOUSE_CHANNEL_DELETES = (
+    ('Comment', """
+        DELETE FROM myschema."Comment"
+        WHERE video_id IN (
+            SELECT a.video_id FROM myschema."Video" a
+            INNER JOIN myschema.playlist b on a.playlist_id = b.playlist_id
+                AND b.channel_id = %(channel_id)s
+        )
+    """),
+    ('Video', """
+        DELETE FROM myschema."Video"
+        WHERE playlist_id IN (
+            select playlist_id FROM myschema.playlist WHERE channel_id = %(channel_id)s
+        )
+    """),
+    ('playlist', 'DELETE FROM myschema."playlist" WHERE channel_id = %(channel_id)s'),
+    ('channel_details', 'DELETE FROM myschema."channel_details" WHERE channel_id = %(channel_id)s'),
+)
+COPY_BUFFER_SIZE = 64 * 1024
+INSERT_PAGE_SIZE = 1000
+
+# Channels migrated to the warehouse concurrently, each on its own pooled connection
+WAREHOUSE_MAX_WORKERS = int(os.getenv('warehouse_max_workers', 4))
+# Attempts of a channel migration aborted by a serialization failure or a deadlock
+WAREHOUSE_MAX_ATTEMPTS = 3
+
+# Rows fetched per round trip from server-side cursors
+SQL_FETCH_SIZE = 1000
+
+CHANNEL_CATALOG_PROJECTION = {
+    '_id': 0, 'channel_id': 1, 'channel_name': 1, 'channel_video_count': 1, 'lake_video_count': 1, 'last_synced_at': 1
+}
+
+def parse_channel_ids(text: str) -> list:
+    """
+        Parses channel ids separated by commas, whitespace or new lines. Surrounding
+        spaces, empty entries, duplicates and # comments are dropped.
+
+        Args:
+            text: string, channel ids as typed in the sidebar or read from a file
+        Returns:
+            The list of channel ids in the order they first appear
+    """
+    channel_ids = []
+    for line in text.splitlines():
+        channel_ids.extend(channel_id for channel_id in re.split(r'[\s,]+', line.split('#', 1)[0]) if channel_id)
+    return list(dict.fromkeys(channel_ids))
+
+_api_objects = threading.local()
+
 def get_youtube_api_object():
-    return build('youtube', 'v3', developerKey=os.getenv('api_key'))
+    # Building the client is expensive and it is not thread safe, so keep one per thread
+    if not hasattr(_api_objects, 'youtube'):
+        _api_objects.youtube = build('youtube', 'v3', developerKey=os.getenv('api_key'), cache_discovery=False)
+    return _api_objects.youtube
+
+def execute_request(request: any, etag: str = None) -> dict:
+    """
+        Executes a google api request through the shared response cache and, on a miss,
+        the shared quota aware scheduler
+
+        Args:
+            request: googleapiclient HttpRequest object
+            etag: string, etag of a previous response to make the request conditional
+        Returns:
+            The decoded response of the request, None when it is unchanged since etag
+    """
+    started_at = time.perf_counter()
+    try:
+        return get_response_cache().execute(
+            request, lambda: get_request_scheduler().execute(request, etag=etag), etag=etag
+        )
+    finally:
+        get_metrics().observe('youtube_request_seconds', time.perf_counter() - started_at,
+                              endpoint=get_endpoint(request))
+
+def paginate(list_method, max_items: int = None, max_pages: int = None, **params):
+    """
+        Iterates over the items of a youtube list endpoint, requesting the next page
+        only once the items of the previous one have been consumed
+
+        Args:
+            list_method: list method of a youtube resource e.g. youtube.playlists().list
+            max_items: int, stop after yielding this many items, None for no limit
+            max_pages: int, stop after requesting this many pages, None for no limit
+            params: keyword arguments of the list request
+        Returns:
+            A generator of the raw items of every page
+    """
+    if max_items is not None and max_items <= 0:
+        return
+    items_yielded = 0
+    pages_requested = 0
+    page_token = None
+    while True:
+        if page_token:
+            params['pageToken'] = page_token
+        response = execute_request(list_method(**params))
+        pages_requested += 1
+        for item in response.get('items', []):
+            yield item
+            items_yielded += 1
+            if max_items is not None and items_yielded >= max_items:
+                return
+        page_token = response.get('nextPageToken')
+        if not page_token or (max_pages is not None and pages_requested >= max_pages):
+            return
+
+def _parse_comment(item: dict, video_id: str, parent_id: str = None) -> dict:
+    """
+        Converts a raw comment into the comment dictionary stored in the data lake
+
+        Args:
+            item: dictionary, raw comment returned by the comments endpoint or inside a thread
+            video_id: string, Video Id the comment belongs to
+            parent_id: string, id of the top level comment a reply answers, None for top level comments
+        Returns:
+            A dictionary of the comment along with when it was published
+    """
+    comment = {}
+    comment['video_id'] = video_id
+    comment['comment_id'] = item['id']
+    comment['parent_id'] = parent_id
+    comment['comment_text'] = item['snippet']['textOriginal']
+    comment['comment_author'] = item['snippet']['authorDisplayName']
+    comment['comment_published_date'] = item['snippet']['publishedAt']
+    return comment
+
+def _parse_comment_thread(item: dict, video_id: str) -> dict:
+    """
+        Converts a raw comment thread into the dictionary of its top level comment
+
+        Args:
+            item: dictionary, raw comment thread returned by the commentThreads endpoint
+            video_id: string, Video Id the comment belongs to
+        Returns:
+            A dictionary of the top level comment along with its number of replies
+    """
+    comment = _parse_comment(item['snippet']['topLevelComment'], video_id)
+    comment['reply_count'] = item['snippet'].get('totalReplyCount', 0)
+    return comment
+
+def iter_comment_replies(comment_id: str, video_id: str, youtube: any):
+    """
+        Iterates over every reply to a top level comment page by page
+
+        Args:
+            comment_id: string, id of the top level comment
+            video_id: string, Video Id the comment belongs to
+            youtube: google api build object for interacting with the service
+        Returns:
+            A generator of dictionary of replies along with when they were published
+    """
+    replies = paginate(
+        youtube.comments().list,
+        part='snippet',
+        parentId=comment_id,
+        maxResults=COMMENT_PAGE_SIZE
+    )
+    for item in replies:
+        yield _parse_comment(item, video_id, comment_id)
+
+def iter_video_comments(video_id: str, youtube: any, max_comments: int = MAX_COMMENTS_PER_VIDEO,
+                        with_replies: bool = True, since: str = None, reply_counts: dict = None,
+                        unchanged_threads: set = None):
+    """
+        Iterates over the comment threads of a particular video page by page, newest
+        first, each top level comment followed by its replies. Threads carry their first
+        few replies, longer reply chains are paged from the comments endpoint.
+
+        Args:
+            video_id: string, Video Id of the data that we are trying to retrieve
+            youtube: google api build object for interacting with the service
+            max_comments: int, maximum number of comments and replies to fetch, None for all of them
+            with_replies: bool, fetch the replies along with the top level comments
+            since: string, ISO 8601 publish date of the newest thread already stored, paging
+                   stops at the first thread that is not newer, None for every thread
+            reply_counts: dictionary, reply count stored per thread id. The replies of threads
+                          whose totalReplyCount did not change are not fetched again, and count
+                          against max_comments as if they were
+            unchanged_threads: set, ids of the threads whose replies were not fetched again are added to it
+        Returns:
+            A generator of dictionary of comments along with when it was published
+    """
+    def comments():
+        remaining = max_comments if max_comments is not None else float('inf')
+        comment_threads = paginate(
+            youtube.commentThreads().list,
+            part='snippet,replies' if with_replies else 'snippet',
+            videoId=video_id,
+            order='time',
+            maxResults=COMMENT_PAGE_SIZE
+        )
+        for item in comment_threads:
+            comment = _parse_comment_thread(item, video_id)
+            if since is not None and comment['comment_published_date'] <= since:
+                return
+            yield comment
+            remaining -= 1
+            if remaining > 0 and with_replies and comment['reply_count']:
+                if reply_counts is not None and reply_counts.get(comment['comment_id']) == comment['reply_count']:
+                    if unchanged_threads is not None:
+                        unchanged_threads.add(comment['comment_id'])
+                    remaining -= comment['reply_count']
+                else:
+                    replies = item.get('replies', {}).get('comments', [])
+                    if len(replies) >= comment['reply_count']:
+                        replies = (_parse_comment(reply, video_id, comment['comment_id']) for reply in replies)
+                    else:
+                        replies = iter_comment_replies(comment['comment_id'], video_id, youtube)
+                    for reply in replies:
+                        yield reply
+                        remaining -= 1
+                        if remaining <= 0:
+                            return
+            if remaining <= 0:
+                return
+
+    if max_comments is not None and max_comments <= 0:
+        return
+    try:
+        yield from comments()
+    except HttpError as e:
+        # Videos with comments turned off answer with 403 commentsDisabled
+        if get_error_reason(e) != 'commentsDisabled':
+            raise
 
 def get_video_comments(video_id: str, youtube: any) -> list:
     """
@@ -21,76 +352,150 @@ def get_video_comments(video_id: str, youtube: any) -> list:
         Returns:
             A list containing dictionary of comments along with when it was published
     """
-    comments_data = []
-    comments_raw_data = []
-    comments = youtube.commentThreads().list(
-        part="snippet",
-        videoId=video_id,
-        maxResults=50
-    ).execute()
-    if comments['pageInfo']['totalResults'] == 0:
-        return comments_data
-    comments_raw_data.extend(comments['items'])
-    # while 'nextPageToken' in comments:
-    #     comments = youtube.commentThreads().list(
-    #         part='snippet',
-    #         videoId=videoId,
-    #         maxResults=50,
-    #         pageToken=comments['nextPageToken']
-    #     ).execute()
-    #     comments_raw_data.extend(comments['items'])
-    for item in comments_raw_data:
-        comment = {}
-        comment['video_id'] = video_id
-        comment['comment_id'] = item['snippet']['topLevelComment']['id']
-        comment['comment_text'] = item['snippet']['topLevelComment']['snippet']['textOriginal']
-        comment['comment_author'] = item['snippet']['topLevelComment']['snippet']['authorDisplayName']
-        comment['comment_published_date'] = item['snippet']['topLevelComment']['snippet']['publishedAt']
-        comments_data.append(comment)
-
-    return comments_data
+    return list(iter_video_comments(video_id, youtube))
+
+def _chunks(items, size: int):
+    """
+        Splits any iterable into lists of at most size items
+
+        Args:
+            items: iterable, items to split
+            size: int, maximum number of items per chunk
+        Returns:
+            A generator of lists
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_video_details(videoids, youtube: any, missing_ids: list = None):
+    """
+        Iterates over the raw video resources for video ids using batched requests.
+        The videos endpoint accepts up to 50 comma separated ids per call for the
+        same quota cost as a single id, so only one batch is held at a time.
+
+        Args:
+            videoids: iterable, Video Ids of the data that we are trying to retrieve
+            youtube: google api build object for interacting with the service
+            missing_ids: list, ids that were not returned (deleted or private videos) are appended to it
+        Returns:
+            A generator of raw video resources in the same order as videoids
+    """
+    for batch in _chunks(videoids, VIDEO_BATCH_SIZE):
+        batch = list(dict.fromkeys(batch))
+        video_details = execute_request(youtube.videos().list(
+            part="snippet,statistics,contentDetails",
+            id=','.join(batch),
+            maxResults=VIDEO_BATCH_SIZE
+        ))
+        videos_by_id = {item['id']: item for item in video_details.get('items', [])}
+        for id in batch:
+            if id in videos_by_id:
+                yield videos_by_id[id]
+            elif missing_ids is not None:
+                missing_ids.append(id)
+
+def get_video_details_batch(videoids: list, youtube: any) -> tuple:
+    """
+        Gets the raw video resources for a list of video ids with batched requests
+
+        Args:
+            videoids: list, Video Ids of the data that we are trying to retrieve
+            youtube: google api build object for interacting with the service
+        Returns:
+            A tuple of the raw video resources in the same order as videoids and
+            the list of ids that were not returned (deleted or private videos)
+    """
+    missing_ids = []
+    videos_raw_data = list(iter_video_details(dict.fromkeys(videoids), youtube, missing_ids))
+    return videos_raw_data, missing_ids
+
+def _parse_video_item(item: dict, playlist_id: str) -> dict:
+    """
+        Converts a raw video resource into the video dictionary stored in the data lake
+
+        Args:
+            item: dictionary, raw video resource returned by the videos endpoint
+            playlist_id: string, playlist id for the current video
+        Returns:
+            A dictionary of video statistics without the comments
+    """
+    video = {}
+    video['playlist_id'] = playlist_id
+    video['video_id'] = item['id']
+    video['video_name'] = item['snippet']['title']
+    video['video_description'] = item['snippet']['description']
+    video['video_published_date'] = item['snippet']['publishedAt']
+    video['view_count'] = int(item['statistics']['viewCount'])
+    video['like_count'] = int(item['statistics']['likeCount']) if 'likeCount' in item['statistics'] else 0
+    video['dislike_count'] = int(item['statistics']['dislikeCount']) if 'dislikeCount' in item['statistics'] else 0
+    video['favourite_count'] = int(item['statistics']['favoriteCount'])
+    video['comment_count'] = int(item['statistics']['commentCount'])
+    video['video_duration'] = isodate.parse_duration(item['contentDetails']['duration']).seconds
+    video['thumbnail_url'] = item['snippet']['thumbnails']['default']['url']
+    video['caption_status'] = item['contentDetails']['caption']
+    video['statistics_fetched_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return video
 
 def get_video_information(videoids: list, youtube: any, playlist_id: str) -> list:
     """
         Gets Information about all the video statistics
 
         Args:
-            id: list, Video Ids of the data that we are trying to retrieve
+            videoids: iterable, Video Ids of the data that we are trying to retrieve
             youtube: google api build object for interacting with the service
             playlist_id: string, playlist id for the current videos
         Returns:
-            A list containing dictionary of video statistics along with the comments
+            A list containing dictionary of video statistics, comments are fetched by sync_channel_comments
     """
     videos_data = []
-    videos_raw_data = []
-    for id in videoids:
-        video_details = youtube.videos().list(
-            part="snippet,statistics,contentDetails",
-            id=id
-        ).execute()
-        if video_details['pageInfo']['totalResults'] == 0:
-            continue
-        videos_raw_data.extend(video_details['items'])
-    for item in videos_raw_data:
-        video = {}
-        video['playlist_id'] = playlist_id
-        video['video_id'] = item['id']
-        video['video_name'] = item['snippet']['title']
-        video['video_description'] = item['snippet']['description']
-        video['video_published_date'] = item['snippet']['publishedAt']
-        video['view_count'] = int(item['statistics']['viewCount'])
-        video['like_count'] = int(item['statistics']['likeCount']) if 'likeCount' in item['statistics'] else 0
-        video['dislike_count'] = int(item['statistics']['dislikeCount']) if 'dislikeCount' in item['statistics'] else 0
-        video['favourite_count'] = int(item['statistics']['favoriteCount'])
-        video['comment_count'] = int(item['statistics']['commentCount'])
-        video['video_duration'] = isodate.parse_duration(item['contentDetails']['duration']).seconds
-        video['thumbnail_url'] = item['snippet']['thumbnails']['default']['url']
-        video['caption_status'] = item['contentDetails']['caption']
-        video['comments'] = get_video_comments(item['id'], youtube)
-        videos_data.append(video)
+    missing_ids = []
+    for item in iter_video_details(videoids, youtube, missing_ids):
+        videos_data.append(_parse_video_item(item, playlist_id))
+    if missing_ids:
+        logger.info('Skipping %d missing or deleted videos in playlist %s: %s',
+                    len(missing_ids), playlist_id, ', '.join(missing_ids))
 
     return videos_data
 
+def iter_playlist_video_ids(playlist_id: str, youtube: any, max_videos: int = MAX_VIDEOS_PER_PLAYLIST):
+    """
+        Iterates over the ids of the videos associated with a particular playlist page by page
+
+        Args:
+            playlist_id: string, Playlist Id of a specific youtube channel
+            youtube: google api build object for interacting with the service
+            max_videos: int, maximum number of videos to fetch, None for all of them
+        Returns:
+            A generator of video ids in playlist order
+    """
+    playlist_items = paginate(
+        youtube.playlistItems().list,
+        max_items=max_videos,
+        part='snippet',
+        playlistId=playlist_id,
+        maxResults=PAGE_SIZE
+    )
+    for item in playlist_items:
+        yield item['snippet']['resourceId']['videoId']
+
+def get_playlist_video_ids(playlist_id: str, youtube: any) -> list:
+    """
+        Gets the ids of the videos associated with a particular playlist
+
+        Args:
+            playlist_id: string, Playlist Id of a specific youtube channel
+            youtube: google api build object for interacting with the service
+        Returns:
+            A list of video ids in playlist order
+    """
+    return list(iter_playlist_video_ids(playlist_id, youtube))
+
 def get_playlist_videos(playlist_id: str, youtube: any) -> list:
     """
         Gets Information about all the videos associated with a particular playlist
@@ -101,29 +506,57 @@ def get_playlist_videos(playlist_id: str, youtube: any) -> list:
         Returns:
             A list containing dictionary of playlists along with videos and its statistics
     """
-    video_ids = []
-    playlist_items_raw_data = []
-    channel_playlist_items = youtube.playlistItems().list(
-        part = 'snippet',
-        playlistId=playlist_id,
-        maxResults=50
-    ).execute()
-
-    if channel_playlist_items['pageInfo']['totalResults'] == 0:
-        return video_ids
-    playlist_items_raw_data.extend(channel_playlist_items['items'])
-    # while 'nextPageToken' in channel_playlist_items:
-    #     channel_playlist_items = youtube.playlistItems().list(
-    #         part='snippet',
-    #         playlistId=playlist_id,
-    #         maxResults=50,
-    #         pageToken=channel_playlist_items['nextPageToken']
-    #     ).execute()
-    #     playlist_items_raw_data.extend(channel_playlist_items['items'])
-    for item in playlist_items_raw_data:
-        video_ids.append(item['snippet']['resourceId']['videoId'])
-    
-    return get_video_information(video_ids, youtube, playlist_id)
+    return get_video_information(iter_playlist_video_ids(playlist_id, youtube), youtube, playlist_id)
+
+def _parse_playlist_item(item: dict, channel_id: str) -> dict:
+    """
+        Converts a raw playlist resource into the playlist dictionary stored in the data lake
+
+        Args:
+            item: dictionary, raw playlist resource returned by the playlists endpoint
+            channel_id: string, youtube channel id the playlist belongs to
+        Returns:
+            A dictionary of the playlist without its videos
+    """
+    playlist_dict = {}
+    playlist_dict['playlist_id'] = item['id']
+    playlist_dict['channel_id'] = channel_id
+    playlist_dict['playlist_name'] = item['snippet']['title']
+    playlist_dict['playlist_description'] = item['snippet']['description']
+    return playlist_dict
+
+def iter_channel_playlist_details(id: str, youtube: any, max_playlists: int = MAX_PLAYLISTS_PER_CHANNEL):
+    """
+        Iterates over the details of the playlists of a particular channel page by page
+
+        Args:
+            id: string, youtube channel id
+            youtube: google api build object for interacting with the service
+            max_playlists: int, maximum number of playlists to fetch, None for all of them
+        Returns:
+            A generator of dictionary of playlists without their videos
+    """
+    channel_playlists = paginate(
+        youtube.playlists().list,
+        max_items=max_playlists,
+        part='snippet',
+        channelId=id,
+        maxResults=PAGE_SIZE
+    )
+    for item in channel_playlists:
+        yield _parse_playlist_item(item, id)
+
+def get_channel_playlist_details(id: str, youtube: any) -> list:
+    """
+        Gets the details of the playlists of a particular channel without their videos
+
+        Args:
+            id: string, youtube channel id
+            youtube: google api build object for interacting with the service
+        Returns:
+            A list containing dictionary of playlists
+    """
+    return list(iter_channel_playlist_details(id, youtube))
 
 def get_channel_playlists(id: str, youtube: any) -> list:
     """
@@ -136,228 +569,1586 @@ def get_channel_playlists(id: str, youtube: any) -> list:
             A list containing dictionary of playlists along with videos and its statistics
     """
     playlists = []
-    playlist_raw_data = []
-    channel_playlists = youtube.playlists().list(
-        part='snippet',
-        channelId=id,
-        maxResults=50
-    ).execute()
-
-    if channel_playlists['pageInfo']['totalResults'] == 0:
-        return playlists
-
-    playlist_raw_data.extend(channel_playlists['items'])
-    # while 'nextPageToken' in channel_playlists:
-    #     channel_playlists = youtube.playlists().list(
-    #         part='snippet',
-    #         channelid=id,
-    #         maxResults=50,
-    #         pageToken=channel_playlists['nextPageToken']
-    #     ).execute()
-    #     playlist_raw_data.extend(channel_playlists['items'])
-    
-    for item in playlist_raw_data[:5]:
-        playlist_dict = {}
-        playlist_dict['playlist_id'] = item['id']
-        playlist_dict['channel_id'] = id
-        playlist_dict['playlist_name'] = item['snippet']['title']
-        playlist_dict['playlist_description'] = item['snippet']['description']
-        playlist_dict['videos'] = get_playlist_videos(item['id'], youtube)
+    for playlist_dict in iter_channel_playlist_details(id, youtube):
+        playlist_dict['videos'] = get_playlist_videos(playlist_dict['playlist_id'], youtube)
         playlists.append(playlist_dict)
 
     return playlists
 
-def get_youtube_channel_information(id: str, youtube: any) -> dict:
+def _parse_channel_item(item: dict) -> dict:
+    """
+        Converts a raw channel resource into the channel dictionary stored in the data lake
+
+        Args:
+            item: dictionary, raw channel resource returned by the channels endpoint
+        Returns:
+            A dictionary of channel details without the playlists
+    """
+    channel_data_dict = {}
+    channel_data_dict['channel_id'] = item['id']
+    channel_data_dict['channel_name'] = item['snippet']['title']
+    channel_data_dict['channel_views'] = int(item['statistics']['viewCount'])
+    channel_data_dict['channel_description'] = item['snippet']['description']
+    channel_data_dict['status'] = item['status']['privacyStatus']
+    channel_data_dict['channel_subscribers'] = int(item['statistics']['subscriberCount'])
+    channel_data_dict['channel_video_count'] = int(item['statistics']['videoCount'])
+    channel_data_dict['statistics_fetched_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    return channel_data_dict
+
+def get_channel_details(id: str, youtube: any) -> dict:
     """
-        Gets Information about a channel playlists, videos and comments to the videos
+        Gets the details and statistics of a channel without its playlists
 
         Args:
             id: string, youtube channel id
             youtube: google api build object for interacting with the service
         Returns:
-            A dictionary of channel, its playlists videos and comments associated with them
+            A dictionary of channel details
             Returns empty dictionary if no channel found
     """
     channel_data_dict = {}
-    channel_details = youtube.channels().list(
+    channel_details = execute_request(youtube.channels().list(
         part='snippet,statistics,status,contentDetails',
         id=id
-    ).execute()
+    ))
 
     if channel_details['pageInfo']['totalResults'] != 1:
         return channel_data_dict
-    
-    item = channel_details['items'][0]
-    channel_data_dict['channel_id'] = item['id']
-    channel_data_dict['channel_name'] = item['snippet']['title']
-    channel_data_dict['channel_views'] = int(item['statistics']['viewCount'])
-    channel_data_dict['channel_description'] = item['snippet']['description']
-    channel_data_dict['status'] = item['status']['privacyStatus']
-    channel_data_dict['channel_subscribers'] = int(item['statistics']['subscriberCount'])
-    channel_data_dict['channel_video_count'] = int(item['statistics']['videoCount'])
-    channel_data_dict['playlists'] = get_channel_playlists(item['id'], youtube)
+
+    return _parse_channel_item(channel_details['items'][0])
+
+def get_youtube_channel_information(id: str, youtube: any) -> dict:
+    """
+        Gets Information about a channel playlists and videos, comments are fetched
+        once the channel is saved with sync_channel_comments
+
+        Args:
+            id: string, youtube channel id
+            youtube: google api build object for interacting with the service
+        Returns:
+            A dictionary of channel, its playlists and the videos associated with them
+            Returns empty dictionary if no channel found
+    """
+    channel_data_dict = get_channel_details(id, youtube)
+    if not channel_data_dict:
+        return channel_data_dict
+
+    channel_data_dict['playlists'] = get_channel_playlists(channel_data_dict['channel_id'], youtube)
 
     return channel_data_dict
-    
-def save_data_to_mongo_db(data,mongo_collection):
 
-    #First delete the existing data from the mongo
-    result = mongo_collection.delete_one({"channel_id": data['channel_id']})
+def _get_video_batch(batch: tuple, youtube: any) -> list:
+    """
+        Gets the video statistics for one batch of at most 50 videos of a playlist
 
-    # Insert the data into mongo
-    result = mongo_collection.insert_one(data)
+        Args:
+            batch: tuple, playlist id and a tuple of the video ids in the batch
+            youtube: google api build object for interacting with the service
+        Returns:
+            A list containing dictionary of video statistics without the comments
+    """
+    playlist_id, video_ids = batch
+    videos_raw_data, missing_ids = get_video_details_batch(video_ids, youtube)
+    if missing_ids:
+        logger.info('Skipping %d missing or deleted videos in playlist %s: %s',
+                    len(missing_ids), playlist_id, ', '.join(missing_ids))
+    return [_parse_video_item(item, playlist_id) for item in videos_raw_data]
 
-def get_channel_names_datalake(query, mongo_collection):
-    cursor = mongo_collection.find(query)
-    channel_names = []
-    for document in cursor:
-        channel_names.append(document['channel_name'])
-    return channel_names
+def _map_concurrently(executor: ThreadPoolExecutor, call, function, keys, failed: dict = None, owners=None) -> dict:
+    """
+        Runs function once per key on the executor and waits for all of them
 
-def get_channel_details_datalake(query, mongo_collection):
+        Args:
+            executor: ThreadPoolExecutor running the requests
+            call: callable that invokes function with a key and the worker's api object
+            function: callable taking a key and a youtube api object
+            keys: iterable of hashable arguments for function
+            failed: dictionary, when given the exception of a failed key is recorded against
+                    every channel id returned by owners(key) instead of being raised
+            owners: callable returning the channel ids a key belongs to
+        Returns:
+            A dictionary mapping every successful key to its result, in the order of keys
+    """
+    futures = {key: executor.submit(call, function, key) for key in keys}
+    results = {}
+    for key, future in futures.items():
+        try:
+            results[key] = future.result()
+        except Exception as e:
+            if failed is None:
+                for pending in futures.values():
+                    pending.cancel()
+                raise
+            for channel_id in owners(key):
+                failed.setdefault(channel_id, e)
+    return results
 
-    cursor = mongo_collection.find(query)
-    for document in cursor:
-        return document
-    return []
+@instrumented_stage('fetch_channels', 'channel_ids')
+def get_youtube_channels_information(channel_ids: list, youtube_factory=get_youtube_api_object,
+                                     max_workers: int = YOUTUBE_MAX_WORKERS, errors: dict = None) -> dict:
+    """
+        Gets Information about several channels concurrently. The channel, playlist and
+        video batch requests of all the channels are fanned out level by level over a pool
+        of worker threads. googleapiclient objects are not thread safe so every worker
+        builds its own api object with youtube_factory. Comments are fetched once the
+        channels are saved, with sync_channel_comments.
 
-def connect_to_postgre():
+        Args:
+            channel_ids: list, youtube channel ids
+            youtube_factory: callable returning a new google api build object
+            max_workers: int, maximum number of requests in flight at the same time
+            errors: dictionary, when given a channel whose requests fail is left out of the
+                    result and its exception is stored here under the channel id instead
+                    of aborting every other channel
+        Returns:
+            A dictionary mapping each found channel id to the same dictionary that
+            get_youtube_channel_information returns, in the order of channel_ids
     """
-        Connects to a PostgreSQL database running on GCP.
+    worker_state = threading.local()
+    failed = {} if errors is not None else None
+
+    def call(function, key):
+        if not hasattr(worker_state, 'youtube'):
+            worker_state.youtube = youtube_factory()
+        return function(key, worker_state.youtube)
+
+    def alive(channel_id):
+        return failed is None or channel_id not in failed
+
+    def playlist_owner(playlist_id):
+        return [playlists[playlist_id]['channel_id']]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        channels = _map_concurrently(executor, call, get_channel_details, dict.fromkeys(channel_ids),
+                                     failed, lambda id: [id])
+        channels = {id: data for id, data in channels.items() if data}
+
+        channel_playlists = _map_concurrently(executor, call, get_channel_playlist_details, channels,
+                                              failed, lambda id: [id])
+        playlists = {}
+        for id, channel_playlist_list in channel_playlists.items():
+            channels[id]['playlists'] = channel_playlist_list
+            for playlist in channel_playlist_list:
+                playlist['videos'] = []
+                playlists[playlist['playlist_id']] = playlist
+
+        playlist_video_ids = _map_concurrently(executor, call, get_playlist_video_ids, playlists,
+                                               failed, playlist_owner)
+        batches = [
+            (playlist_id, tuple(batch))
+            for playlist_id, video_ids in playlist_video_ids.items()
+            if alive(playlists[playlist_id]['channel_id'])
+            for batch in _chunks(video_ids, VIDEO_BATCH_SIZE)
+        ]
+        video_batches = _map_concurrently(executor, call, _get_video_batch, batches,
+                                          failed, lambda batch: playlist_owner(batch[0]))
+        for (playlist_id, _), batch_videos in video_batches.items():
+            playlists[playlist_id]['videos'].extend(batch_videos)
+
+    if failed:
+        errors.update(failed)
+        for channel_id, error in failed.items():
+            logger.warning('Failed to get channel %s: %r', channel_id, error)
+    return {id: data for id, data in channels.items() if alive(id)}
+
+def _get_if_changed(list_method, etag: str, **params) -> tuple:
+    """
+        Requests the first page of a list endpoint conditionally on the etag of the previous sync
+
         Args:
-            host: The host of the PostgreSQL database instance.
-            port: The port of the PostgreSQL database instance.
-            database: The name of the PostgreSQL database.
-            username: The username to use to connect to the PostgreSQL database.
-            password: The password to use to connect to the PostgreSQL database.
+            list_method: list method of a youtube resource e.g. youtube.playlists().list
+            etag: string, etag of the first page at the previous sync, None to always fetch
+            params: keyword arguments of the list request
         Returns:
-            A psycopg2 connection object.
+            A tuple of a generator over the items of every page, None when the first page
+            is unchanged, the etag of the first page and the total number of items, None
+            when it is unchanged or unknown
+    """
+    first_page = execute_request(list_method(**params), etag=etag)
+    if first_page is None:
+        return None, etag, None
+
+    def items():
+        yield from first_page.get('items', [])
+        if 'nextPageToken' in first_page:
+            yield from paginate(list_method, pageToken=first_page['nextPageToken'], **params)
+
+    return items(), first_page.get('etag'), first_page.get('pageInfo', {}).get('totalResults')
+
+def _newest_first_watermark(items: list) -> str:
+    # publishedAt of the first playlist item when the items were added newest first, else None
+    added = [item['snippet'].get('publishedAt') for item in items]
+    if not added or None in added or any(newer < older for newer, older in zip(added, added[1:])):
+        return None
+    return added[0]
+
+def _sync_playlist_video_ids(playlist_id: str, youtube: any, etag: str, previous_ids: list,
+                             watermark: str, max_videos: int = MAX_VIDEOS_PER_PLAYLIST) -> tuple:
     """
+        Syncs the video ids of a playlist against the previous sync. An unchanged first page
+        keeps previous_ids. When the items were in newest first order at the previous sync,
+        paging stops at the first item added at or before the watermark and the newer ids
+        are merged with previous_ids. The rest of the playlist is paged anyway when the
+        merged ids do not add up to the size of the playlist, e.g. after a removal.
 
-    return psycopg2.connect(
-        host=os.getenv('postgre_host'),
-        port=5432,
-        database='youtube_data',
-        user='postgres',
-        password=os.getenv('postgres_db_password')
+        Args:
+            playlist_id: string, Playlist Id of a specific youtube channel
+            youtube: google api build object for interacting with the service
+            etag: string, etag of the first page at the previous sync, None to always fetch
+            previous_ids: list of the video ids of the playlist at the previous sync
+            watermark: string, publishedAt of the newest item at the previous sync when the
+                       items were newest first, None to page every item
+            max_videos: int, maximum number of video ids kept, None for all of them
+        Returns:
+            A tuple of the video ids in playlist order, the etag of the first page and the
+            watermark to pass to the next sync
+    """
+    video_items, etag, total = _get_if_changed(
+        youtube.playlistItems().list,
+        etag,
+        part='snippet',
+        playlistId=playlist_id,
+        maxResults=PAGE_SIZE
     )
-    
-def insert_data_into_postgre(data, connection):
+    if video_items is None:
+        return list(previous_ids), etag, watermark
+
+    newer = []
+    if watermark and total is not None:
+        for item in video_items:
+            if (item['snippet'].get('publishedAt') or '') <= watermark:
+                newer_ids = [newer_item['snippet']['resourceId']['videoId'] for newer_item in newer]
+                merged = list(dict.fromkeys(newer_ids + list(previous_ids)))[:max_videos]
+                if len(merged) == (total if max_videos is None else min(total, max_videos)):
+                    return merged, etag, _newest_first_watermark(newer) if newer else watermark
+                newer.append(item)
+                break
+            newer.append(item)
+    items = newer + list(islice(video_items, None if max_videos is None else max(0, max_videos - len(newer))))
+    items = items[:max_videos]
+    return [item['snippet']['resourceId']['videoId'] for item in items], etag, _newest_first_watermark(items)
+
+def sync_youtube_channel_information(id: str, youtube: any, previous: dict = None, state: dict = None,
+                                     recent_days: int = SYNC_RECENT_DAYS) -> tuple:
     """
-        Inserts data into a postgre running on GCP.
+        Incrementally syncs a channel against the result of the previous sync. Channel,
+        playlist and playlist item pages are requested with If-None-Match so unchanged ones
+        cost a 304, changed playlists added to newest first are only paged down to the newest
+        item of the previous sync, only videos not seen before are fetched in full and statistics
+        are refreshed for videos published in the last recent_days. Comments are left to
+        sync_channel_comments.
+
         Args:
-            data: dictionary of the data
-            connection: psycopg2 connection object
+            id: string, youtube channel id
+            youtube: google api build object for interacting with the service
+            previous: dictionary, channel returned by the previous sync, None for a full sync
+            state: dictionary, sync state returned by the previous sync
+            recent_days: int, statistics of videos published in this many days are refreshed
         Returns:
-            A psycopg2 connection object.
+            A tuple of the same dictionary get_youtube_channel_information returns, empty if
+            no channel found, and the sync state to pass to the next sync
     """
-    cursor = connection.cursor()
+    previous = previous or {}
+    state = state if previous and state else {}
+    new_state = {'channel_id': id, 'playlist_etags': {}, 'playlist_watermarks': {}, 'video_etags': {}}
 
-    delete_query = """
-                        DELETE FROM myschema."Comment"
-                        WHERE video_id IN (
-                            SELECT a.video_id FROM myschema."Video" a
-                            INNER JOIN myschema.playlist b on a.playlist_id = b.playlist_id
-                                AND b.channel_id = '{}'
-                        );
-
-                        DELETE FROM myschema."Video"
-                        WHERE playlist_id IN (
-                            select playlist_id FROM myschema.playlist WHERE channel_id = '{}'
-                        );
-
-                        DELETE FROM myschema."playlist"
-                        WHERE channel_id = '{}';
-
-                        DELETE FROM myschema."channel_details" WHERE channel_id = '{}';
-                    """.format(data['channel_id'], data['channel_id'], data['channel_id'], data['channel_id'])
-    
-    cursor.execute(delete_query)
-
-    insert_query = """
-                        INSERT INTO myschema."channel_details"
-                        (channel_id, channel_name, channel_views, 
-                        channel_description, channel_status, channel_subscribers, channel_video_count)
-                        VALUES
-                        (
-                            %(channel_id)s, %(channel_name)s, %(channel_views)s, %(channel_description)s,
-                            %(status)s, %(channel_subscribers)s, %(channel_video_count)s
-                        )
-                    """
-    channel_data = [
-        {
-            'channel_id': data['channel_id'],
-            'channel_name': data['channel_name'],
-            'channel_views': data['channel_views'],
-            'channel_description': data['channel_description'],
-            'status': data['status'],
-            'channel_subscribers': data['channel_subscribers'],
-            'channel_video_count': data['channel_video_count'],
-        }
-    ]
-    cursor.executemany(insert_query, channel_data)
+    channel_details = execute_request(youtube.channels().list(
+        part='snippet,statistics,status,contentDetails',
+        id=id
+    ), etag=state.get('channel_etag'))
+    if channel_details is None:
+        channel_data_dict = {key: value for key, value in previous.items() if key not in ('_id', 'playlists')}
+        new_state['channel_etag'] = state['channel_etag']
+    elif channel_details['pageInfo']['totalResults'] != 1:
+        return {}, state
+    else:
+        channel_data_dict = _parse_channel_item(channel_details['items'][0])
+        new_state['channel_etag'] = channel_details.get('etag')
 
-    insert_query_playlist = """
-                        INSERT INTO myschema."playlist"
-                        (playlist_id, channel_id, playlist_name, playlist_description)
-                        VALUES
-                        (
-                            %(playlist_id)s, %(channel_id)s, %(playlist_name)s, %(playlist_description)s
-                        )
-                    """
+    previous_playlists = {playlist['playlist_id']: playlist for playlist in previous.get('playlists', [])}
+    previous_videos = {
+        video['video_id']: video for playlist in previous_playlists.values() for video in playlist['videos']
+    }
 
-    cursor.executemany(insert_query_playlist, data['playlists'])
+    playlist_items, new_state['playlists_etag'], _ = _get_if_changed(
+        youtube.playlists().list,
+        state.get('playlists_etag'),
+        part='snippet',
+        channelId=id,
+        maxResults=PAGE_SIZE
+    )
+    if playlist_items is None:
+        playlists = [
+            {key: value for key, value in playlist.items() if key != 'videos'}
+            for playlist in previous_playlists.values()
+        ]
+    else:
+        playlists = [_parse_playlist_item(item, id) for item in islice(playlist_items, MAX_PLAYLISTS_PER_CHANNEL)]
 
-    video_data = []
-    for playlist in data['playlists']:
-        for video in playlist['videos']:
-            if not any(d['video_id'] == video['video_id'] for d in video_data):
-                video_data.append(video)
-
-    insert_query_video = """
-                            INSERT INTO myschema."Video"(
-	                        video_id, playlist_id, video_name, video_description, 
-                            published_date, view_count, like_count, dislike_count, 
-                            favourite_count, comment_count, duration, thumbnail_url, 
-                            caption_status)
-                            VALUES
-                            (
-                                %(video_id)s, %(playlist_id)s, %(video_name)s, %(video_description)s,
-                                %(video_published_date)s, %(view_count)s, %(like_count)s, 
-                                %(dislike_count)s, %(favourite_count)s, %(comment_count)s,
-                                %(video_duration)s, %(thumbnail_url)s, %(caption_status)s
-                            )
-                        """
-    cursor.executemany(insert_query_video, video_data)
-
-    comment_data = []
-    for video in video_data:
-        comment_data.extend(video['comments'][:2])
-    insert_query_comments = """
-                                INSERT INTO myschema."Comment"(
-	                            comment_id, video_id, comment_text, comment_author, 
-                                comment_published_date)
-                                VALUES
-                                (
-                                    %(comment_id)s, %(video_id)s, %(comment_text)s,
-                                    %(comment_author)s, %(comment_published_date)s
-                                )
-                            """
-    cursor.executemany(insert_query_comments, comment_data)
-    connection.commit()
+    playlist_video_ids = {}
+    for playlist in playlists:
+        playlist_id = playlist['playlist_id']
+        known = playlist_id in previous_playlists
+        (
+            playlist_video_ids[playlist_id],
+            new_state['playlist_etags'][playlist_id],
+            new_state['playlist_watermarks'][playlist_id],
+        ) = _sync_playlist_video_ids(
+            playlist_id,
+            youtube,
+            state.get('playlist_etags', {}).get(playlist_id) if known else None,
+            [video['video_id'] for video in previous_playlists[playlist_id]['videos']] if known else [],
+            state.get('playlist_watermarks', {}).get(playlist_id) if known else None,
+        )
 
-    cursor.close()
+    recent_cutoff = (datetime.now(timezone.utc) - timedelta(days=recent_days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    video_ids = dict.fromkeys(video_id for ids in playlist_video_ids.values() for video_id in ids)
+    videos = {}
+    ids_to_fetch = []
+    for video_id in video_ids:
+        previous_video = previous_videos.get(video_id)
+        if previous_video is None or previous_video['video_published_date'] >= recent_cutoff:
+            ids_to_fetch.append(video_id)
+        else:
+            videos[video_id] = previous_video
+            if video_id in state.get('video_etags', {}):
+                new_state['video_etags'][video_id] = state['video_etags'][video_id]
 
-def get_mongo_client():
-    client = pymongo.MongoClient(os.getenv('mongo_uri'))
-    mongo_db = client["youtube_import"]
-    return mongo_db["channels_data"]
+    for item in iter_video_details(ids_to_fetch, youtube):
+        video_id = item['id']
+        previous_video = previous_videos.get(video_id)
+        new_state['video_etags'][video_id] = item.get('etag')
+        if previous_video is not None and state.get('video_etags', {}).get(video_id) == item.get('etag'):
+            videos[video_id] = previous_video
+            continue
+        videos[video_id] = _parse_video_item(item, None)
 
-def get_sql_query_results(query, connection):
-    try:
-        cursor = connection.cursor()
-        cursor.execute(query)
+    for playlist in playlists:
+        playlist_id = playlist['playlist_id']
+        playlist['videos'] = [
+            dict(videos[video_id], playlist_id=playlist_id)
+            for video_id in playlist_video_ids[playlist_id] if video_id in videos
+        ]
+    channel_data_dict['playlists'] = playlists
 
-        return cursor.fetchall()
-    finally:
-        cursor.close()
\ No newline at end of file
+    new_state['last_synced_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    logger.info('Synced channel %s: %d new videos, %d statistics refreshed',
+                id, sum(video_id not in previous_videos for video_id in videos), len(ids_to_fetch))
+
+    return channel_data_dict, new_state
+
+@instrumented_stage('sync_channels', 'channel_ids')
+def sync_youtube_channels_information(channel_ids: list, mongo_db, youtube_factory=get_youtube_api_object,
+                                      max_workers: int = YOUTUBE_MAX_WORKERS, errors: dict = None,
+                                      comments: bool = True) -> dict:
+    """
+        Incrementally syncs several channels concurrently against the data lake and
+        saves every synced channel to the data lake along with its new sync state
+
+        Args:
+            channel_ids: list, youtube channel ids
+            mongo_db: pymongo database of the data lake
+            youtube_factory: callable returning a new google api build object
+            max_workers: int, number of channels synced at the same time
+            errors: dictionary, when given failed channels are left out of the result and
+                    their exception is stored here under the channel id. Channels saved
+                    before their comments failed to sync are kept in the result.
+            comments: bool, sync the comments of the saved channels with sync_channel_comments
+        Returns:
+            A dictionary mapping each found channel id to its synced channel dictionary
+    """
+    worker_state = threading.local()
+
+    def sync(channel_id):
+        if not hasattr(worker_state, 'youtube'):
+            worker_state.youtube = youtube_factory()
+        previous = get_channel_details_datalake({'channel_id': channel_id}, mongo_db, with_comments=False)
+        state = get_sync_state(channel_id, mongo_db)
+        return sync_youtube_channel_information(channel_id, worker_state.youtube, previous, state)
+
+    channels = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {channel_id: executor.submit(sync, channel_id) for channel_id in dict.fromkeys(channel_ids)}
+        for channel_id, future in futures.items():
+            try:
+                data, state = future.result()
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors[channel_id] = e
+                logger.warning('Failed to sync channel %s: %r', channel_id, e)
+                continue
+            if data:
+                channels[channel_id] = data
+                save_data_to_mongo_db(data, mongo_db)
+                save_sync_state(state, mongo_db)
+                if not comments:
+                    continue
+                try:
+                    sync_channel_comments(channel_id, mongo_db, youtube_factory, max_workers)
+                except Exception as e:
+                    if errors is None:
+                        raise
+                    errors[channel_id] = e
+                    logger.warning('Failed to sync the comments of channel %s: %r', channel_id, e)
+
+    return channels
+
+def _bulk_upsert(collection, operations, size: int = LAKE_BULK_WRITE_SIZE) -> int:
+    """
+        Sends write operations to a collection as unordered bulk writes
+
+        Args:
+            collection: pymongo collection
+            operations: iterable of pymongo write operations, consumed lazily
+            size: int, operations sent per bulk write
+        Returns:
+            The number of documents inserted or modified
+    """
+    written = 0
+    for chunk in _chunks(operations, size):
+        started_at = time.perf_counter()
+        result = collection.bulk_write(chunk, ordered=False)
+        get_metrics().observe_db('mongo', 'bulk_write', collection.name, time.perf_counter() - started_at, len(chunk))
+        written += result.upserted_count + result.modified_count
+    return written
+
+def ensure_datalake_indexes(mongo_db):
+    """
+        Creates the indexes the data lake readers and writers rely on
+
+        Args:
+            mongo_db: pymongo database of the data lake
+    """
+    mongo_db[LAKE_CHANNELS].create_index('channel_id', unique=True)
+    mongo_db[LAKE_CHANNELS].create_index('channel_name')
+    mongo_db[LAKE_PLAYLISTS].create_index('channel_id')
+    mongo_db[LAKE_VIDEOS].create_index('channel_id')
+    mongo_db[LAKE_VIDEOS].create_index('playlist_ids')
+    mongo_db[LAKE_COMMENTS].create_index('video_id')
+    mongo_db[LAKE_COMMENTS].create_index('channel_id')
+    mongo_db[LAKE_SNAPSHOTS].create_index([('channel_id', pymongo.ASCENDING), ('captured_at', pymongo.ASCENDING)])
+    mongo_db[LAKE_SNAPSHOTS].create_index([('entity_id', pymongo.ASCENDING), ('captured_at', pymongo.DESCENDING)])
+    mongo_db[LAKE_SNAPSHOTS].create_index('captured_at')
+
+def _stats_snapshot(entity_type: str, entity_id: str, channel_id: str, captured_at: str, metrics: dict) -> dict:
+    return {
+        '_id': '{}@{}'.format(entity_id, captured_at),
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'channel_id': channel_id,
+        'captured_at': captured_at,
+        'metrics': metrics,
+    }
+
+def save_stats_snapshots_to_datalake(snapshots, mongo_db) -> int:
+    """
+        Appends statistics snapshots to the data lake. A snapshot is keyed by its entity
+        and the time its statistics were read from the API, so saving statistics that were
+        not read again, e.g. videos an incremental sync left untouched, adds nothing.
+
+        Args:
+            snapshots: iterable of snapshot documents, consumed lazily
+            mongo_db: pymongo database of the data lake
+        Returns:
+            The number of snapshots appended
+    """
+    operations = (
+        pymongo.UpdateOne({'_id': snapshot['_id']}, {'$setOnInsert': snapshot}, upsert=True)
+        for snapshot in snapshots
+    )
+    return _bulk_upsert(mongo_db[LAKE_SNAPSHOTS], operations)
+
+def save_channel_details_to_datalake(data: dict, mongo_db):
+    """
+        Upserts the channel details, without the playlists, into the channels collection
+        and appends a snapshot of the channel statistics
+
+        Args:
+            data: dictionary, channel returned by get_youtube_channel_information
+            mongo_db: pymongo database of the data lake
+    """
+    channel = {key: value for key, value in data.items() if key not in ('_id', 'playlists')}
+    channel['last_synced_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    mongo_db[LAKE_CHANNELS].update_one({'_id': data['channel_id']}, {'$set': channel}, upsert=True)
+    if data.get('statistics_fetched_at'):
+        save_stats_snapshots_to_datalake([_stats_snapshot('channel', data['channel_id'], data['channel_id'],
+                                                          data['statistics_fetched_at'], {
+            'view_count': data['channel_views'],
+            'subscriber_count': data['channel_subscribers'],
+            'video_count': data['channel_video_count'],
+        })], mongo_db)
+
+def save_playlist_to_datalake(playlist: dict, mongo_db):
+    """
+        Upserts a playlist, its videos and their comments into their own collections, and
+        appends a snapshot of the video statistics. Videos that are no longer in the
+        playlist are detached from it.
+
+        Args:
+            playlist: dictionary, playlist with its videos as returned by get_channel_playlists
+            mongo_db: pymongo database of the data lake
+    """
+    playlist_id = playlist['playlist_id']
+    channel_id = playlist['channel_id']
+    playlist_document = {key: value for key, value in playlist.items() if key != 'videos'}
+    mongo_db[LAKE_PLAYLISTS].update_one({'_id': playlist_id}, {'$set': playlist_document}, upsert=True)
+
+    video_operations = (
+        pymongo.UpdateOne(
+            {'_id': video['video_id']},
+            {
+                '$set': dict(
+                    {key: value for key, value in video.items() if key not in ('playlist_id', 'comments')},
+                    channel_id=channel_id
+                ),
+                '$addToSet': {'playlist_ids': playlist_id},
+            },
+            upsert=True
+        )
+        for video in playlist['videos']
+    )
+    _bulk_upsert(mongo_db[LAKE_VIDEOS], video_operations)
+
+    comment_operations = (
+        pymongo.UpdateOne(
+            {'_id': comment['comment_id']},
+            {'$set': dict(comment, channel_id=channel_id)},
+            upsert=True
+        )
+        for video in playlist['videos']
+        for comment in video.get('comments', [])
+    )
+    _bulk_upsert(mongo_db[LAKE_COMMENTS], comment_operations)
+
+    save_stats_snapshots_to_datalake((
+        _stats_snapshot('video', video['video_id'], channel_id, video['statistics_fetched_at'], {
+            'view_count': video['view_count'],
+            'like_count': video['like_count'],
+            'comment_count': video['comment_count'],
+        })
+        for video in playlist['videos'] if video.get('statistics_fetched_at')
+    ), mongo_db)
+
+    mongo_db[LAKE_VIDEOS].update_many(
+        {'playlist_ids': playlist_id, '_id': {'$nin': [video['video_id'] for video in playlist['videos']]}},
+        {'$pull': {'playlist_ids': playlist_id}}
+    )
+
+def _remove_orphans_from_datalake(channel_id: str, playlist_ids: list, mongo_db):
+    """
+        Deletes the playlists of a channel that are not in playlist_ids, and the videos
+        and comments that are no longer in any playlist of the channel
+
+        Args:
+            channel_id: string, youtube channel id
+            playlist_ids: list, ids of the playlists the channel still has
+            mongo_db: pymongo database of the data lake
+    """
+    removed_playlists = [
+        playlist['_id'] for playlist in mongo_db[LAKE_PLAYLISTS].find(
+            {'channel_id': channel_id, '_id': {'$nin': playlist_ids}}, {'_id': 1}
+        )
+    ]
+    if removed_playlists:
+        mongo_db[LAKE_PLAYLISTS].delete_many({'_id': {'$in': removed_playlists}})
+        mongo_db[LAKE_VIDEOS].update_many(
+            {'playlist_ids': {'$in': removed_playlists}}, {'$pull': {'playlist_ids': {'$in': removed_playlists}}}
+        )
+    orphan_videos = [
+        video['_id'] for video in mongo_db[LAKE_VIDEOS].find(
+            {'channel_id': channel_id, 'playlist_ids': {'$size': 0}}, {'_id': 1}
+        )
+    ]
+    for chunk in _chunks(orphan_videos, LAKE_BULK_WRITE_SIZE):
+        mongo_db[LAKE_COMMENTS].delete_many({'video_id': {'$in': chunk}})
+        mongo_db[LAKE_VIDEOS].delete_many({'_id': {'$in': chunk}})
+
+def finish_channel_in_datalake(data: dict, playlist_ids: list, mongo_db):
+    """
+        Completes saving a channel whose playlists were saved with save_playlist_to_datalake:
+        removes what the channel no longer has and saves the channel details
+
+        Args:
+            data: dictionary, channel details as returned by get_channel_details
+            playlist_ids: list, ids of every playlist the channel has
+            mongo_db: pymongo database of the data lake
+    """
+    _remove_orphans_from_datalake(data['channel_id'], playlist_ids, mongo_db)
+    lake_video_count = mongo_db[LAKE_VIDEOS].count_documents({'channel_id': data['channel_id']})
+    save_channel_details_to_datalake(dict(data, lake_video_count=lake_video_count), mongo_db)
+
+@instrumented_stage('save_to_lake')
+def save_data_to_mongo_db(data, mongo_db):
+    """
+        Saves a channel into the normalized data lake. The channel, its playlists, videos and
+        comments are upserted by their ids into separate collections with chunked unordered
+        bulk writes, so no document grows with the size of the channel.
+
+        Args:
+            data: dictionary, channel returned by get_youtube_channel_information
+            mongo_db: pymongo database of the data lake
+    """
+    for playlist in data['playlists']:
+        save_playlist_to_datalake(playlist, mongo_db)
+    finish_channel_in_datalake(data, [playlist['playlist_id'] for playlist in data['playlists']], mongo_db)
+
+def sync_video_comments(video: dict, youtube: any, mongo_db, max_comments: int = MAX_COMMENTS_PER_VIDEO) -> int:
+    """
+        Streams the comment threads and replies of a video into the data lake in chunks
+        of STREAM_CHUNK_SIZE, without holding them in memory. A video synced before only
+        gets the threads newer than its newest stored thread. When they do not account for
+        the change of its comment_count, every thread is read again, but only the threads
+        whose reply count changed get their replies fetched. Comments no longer on YouTube
+        are deleted when the video was read in full rather than cut at max_comments.
+
+        Args:
+            video: dictionary, data lake video with its video_id, channel_id, comment_count
+                   and comments_synced_count
+            youtube: google api build object for interacting with the service
+            mongo_db: pymongo database of the data lake
+            max_comments: int, maximum number of comments and replies stored, None for all of them
+        Returns:
+            The number of comments fetched
+    """
+    reply_counts = {}
+    since = None
+    for thread in mongo_db[LAKE_COMMENTS].find(
+        {'video_id': video['video_id'], 'parent_id': None}, {'reply_count': 1, 'comment_published_date': 1}
+    ):
+        reply_counts[thread['_id']] = thread.get('reply_count')
+        if since is None or thread['comment_published_date'] > since:
+            since = thread['comment_published_date']
+    sync_id = uuid.uuid4().hex
+    fetched = 0
+
+    def save(comments) -> int:
+        nonlocal fetched
+        saved = 0
+
+        def operations():
+            nonlocal saved
+            for comment in comments:
+                saved += 1
+                yield pymongo.UpdateOne(
+                    {'_id': comment['comment_id']},
+                    {'$set': dict(comment, channel_id=video['channel_id'], comment_sync_id=sync_id)},
+                    upsert=True
+                )
+
+        _bulk_upsert(mongo_db[LAKE_COMMENTS], operations(), STREAM_CHUNK_SIZE)
+        fetched += saved
+        return saved
+
+    up_to_date = False
+    if since is not None and isinstance(video.get('comments_synced_count'), int) \
+            and isinstance(video.get('comment_count'), int):
+        new_comments = save(iter_video_comments(video['video_id'], youtube, max_comments, since=since))
+        up_to_date = new_comments == video['comment_count'] - video['comments_synced_count'] or (
+            max_comments is not None and new_comments >= max_comments
+        )
+    if not up_to_date:
+        unchanged_threads = set()
+        read = save(iter_video_comments(
+            video['video_id'], youtube, max_comments, reply_counts=reply_counts, unchanged_threads=unchanged_threads
+        ))
+        read += sum(reply_counts[thread_id] for thread_id in unchanged_threads)
+        if max_comments is None or read < max_comments:
+            # The replies of the threads whose replies were not fetched again are kept
+            mongo_db[LAKE_COMMENTS].delete_many({
+                'video_id': video['video_id'], 'comment_sync_id': {'$ne': sync_id},
+                'parent_id': {'$nin': list(unchanged_threads)},
+            })
+    mongo_db[LAKE_VIDEOS].update_one(
+        {'_id': video['video_id']}, {'$set': {'comments_synced_count': video.get('comment_count')}}
+    )
+    return fetched
+
+@instrumented_stage('sync_comments', 'channel_id')
+def sync_channel_comments(channel_id: str, mongo_db, youtube_factory=get_youtube_api_object,
+                          max_workers: int = YOUTUBE_MAX_WORKERS, max_comments: int = MAX_COMMENTS_PER_VIDEO) -> dict:
+    """
+        Syncs the comments of the data lake videos of a channel concurrently with
+        sync_video_comments. Videos whose comment_count did not change since their
+        comments were last synced are skipped without any request, the others only
+        fetch what changed.
+
+        Args:
+            channel_id: string, youtube channel id
+            mongo_db: pymongo database of the data lake
+            youtube_factory: callable returning a new google api build object
+            max_workers: int, number of videos synced at the same time
+            max_comments: int, maximum number of comments and replies stored per video, None for all of them
+        Returns:
+            A dictionary of the number of videos synced and skipped and of comments fetched
+    """
+    worker_state = threading.local()
+
+    def sync(video):
+        if not hasattr(worker_state, 'youtube'):
+            worker_state.youtube = youtube_factory()
+        return sync_video_comments(video, worker_state.youtube, mongo_db, max_comments)
+
+    stats = {'videos': 0, 'skipped': 0, 'comments': 0}
+    videos = mongo_db[LAKE_VIDEOS].find(
+        {'channel_id': channel_id}, {'video_id': 1, 'channel_id': 1, 'comment_count': 1, 'comments_synced_count': 1}
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for video in videos:
+            # Videos never synced count as synced with no comments
+            if video.get('comments_synced_count', 0) == video.get('comment_count'):
+                stats['skipped'] += 1
+                continue
+            futures.append(executor.submit(sync, video))
+        try:
+            for future in as_completed(futures):
+                stats['comments'] += future.result()
+                stats['videos'] += 1
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    logger.info('Synced the comments of channel %s: %d comments of %d videos, %d videos unchanged',
+                channel_id, stats['comments'], stats['videos'], stats['skipped'])
+    return stats
+
+def get_channel_names_datalake(query, mongo_db):
+    cursor = mongo_db[LAKE_CHANNELS].find(query, {'_id': 0, 'channel_name': 1}).sort('channel_name')
+    channel_names = []
+    for document in cursor:
+        channel_names.append(document['channel_name'])
+    return channel_names
+
+def get_channel_catalog(mongo_db, query: dict = None) -> list:
+    """
+        Lists lightweight summaries of the channels in the data lake. Only the summary
+        fields are read, through the channel_name index, so the cost does not depend
+        on how many videos or comments the channels have.
+
+        Args:
+            mongo_db: pymongo database of the data lake
+            query: dictionary, optional filter on the channels collection
+        Returns:
+            A list of dictionaries of channel_id, channel_name, channel_video_count,
+            lake_video_count and last_synced_at sorted by channel name
+    """
+    cursor = mongo_db[LAKE_CHANNELS].find(query or {}, CHANNEL_CATALOG_PROJECTION).sort('channel_name')
+    return list(cursor)
+
+def iter_playlist_videos_datalake(playlist_id: str, mongo_db, with_comments: bool = True):
+    """
+        Streams the videos of a playlist from the data lake, reading their comments
+        one batch of videos at a time
+
+        Args:
+            playlist_id: string, Playlist Id of a specific youtube channel
+            mongo_db: pymongo database of the data lake
+            with_comments: bool, attach the comments of every video
+        Returns:
+            A generator of video dictionaries as returned by get_video_information
+    """
+    videos = mongo_db[LAKE_VIDEOS].find({'playlist_ids': playlist_id}, {'channel_id': 0, 'playlist_ids': 0}).sort('_id')
+    for batch in _chunks(videos, LAKE_BULK_WRITE_SIZE):
+        comments = {}
+        if with_comments:
+            video_ids = [video['_id'] for video in batch]
+            comments_cursor = mongo_db[LAKE_COMMENTS].find(
+                {'video_id': {'$in': video_ids}}, {'_id': 0, 'channel_id': 0, 'comment_sync_id': 0}
+            )
+            for comment in comments_cursor:
+                comments.setdefault(comment['video_id'], []).append(comment)
+        for video in batch:
+            video.pop('_id')
+            video['playlist_id'] = playlist_id
+            if with_comments:
+                video['comments'] = comments.get(video['video_id'], [])
+            yield video
+
+def iter_channel_videos_datalake(channel_id: str, mongo_db, with_comments: bool = True):
+    """
+        Streams the videos of every playlist of a channel from the data lake
+
+        Args:
+            channel_id: string, youtube channel id
+            mongo_db: pymongo database of the data lake
+            with_comments: bool, attach the comments of every video
+        Returns:
+            A generator of video dictionaries, a video in several playlists is yielded once per playlist
+    """
+    for playlist in mongo_db[LAKE_PLAYLISTS].find({'channel_id': channel_id}, {'_id': 1}).sort('_id'):
+        yield from iter_playlist_videos_datalake(playlist['_id'], mongo_db, with_comments)
+
+def iter_channel_comments_datalake(channel_id: str, mongo_db):
+    """
+        Streams the comments and replies of the videos of a channel from the data lake
+
+        Args:
+            channel_id: string, youtube channel id
+            mongo_db: pymongo database of the data lake
+        Returns:
+            A generator of comment dictionaries, read STREAM_CHUNK_SIZE at a time
+    """
+    yield from mongo_db[LAKE_COMMENTS].find(
+        {'channel_id': channel_id}, {'_id': 0, 'channel_id': 0, 'comment_sync_id': 0}, batch_size=STREAM_CHUNK_SIZE
+    )
+
+def iter_stats_snapshots_datalake(channel_id: str, mongo_db, since: str = None):
+    """
+        Streams the statistics snapshots of a channel and its videos from the data lake
+
+        Args:
+            channel_id: string, youtube channel id
+            mongo_db: pymongo database of the data lake
+            since: string, ISO 8601 time of the oldest snapshot returned, None for all of them
+        Returns:
+            A generator of snapshot documents in capture order
+    """
+    query = {'channel_id': channel_id}
+    if since:
+        query['captured_at'] = {'$gte': since}
+    yield from mongo_db[LAKE_SNAPSHOTS].find(query, {'_id': 0}, batch_size=STREAM_CHUNK_SIZE).sort('captured_at')
+
+def compact_stats_snapshots_datalake(mongo_db, full_days: int = SNAPSHOT_FULL_DAYS,
+                                     retention_days: int = SNAPSHOT_RETENTION_DAYS) -> int:
+    """
+        Downsamples the data lake snapshots older than full_days to the last one of each
+        entity per day, and deletes the ones older than retention_days
+
+        Args:
+            mongo_db: pymongo database of the data lake
+            full_days: int, days during which every snapshot is kept
+            retention_days: int, days after which snapshots are deleted, None to keep them forever
+        Returns:
+            The number of snapshots deleted
+    """
+    now = datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=full_days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    deleted = 0
+    if retention_days is not None:
+        retention_cutoff = (now - timedelta(days=retention_days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        deleted += mongo_db[LAKE_SNAPSHOTS].delete_many({'captured_at': {'$lt': retention_cutoff}}).deleted_count
+    snapshots = mongo_db[LAKE_SNAPSHOTS].find(
+        {'captured_at': {'$lt': cutoff}}, {'entity_id': 1, 'captured_at': 1}, batch_size=STREAM_CHUNK_SIZE
+    ).sort([('entity_id', pymongo.ASCENDING), ('captured_at', pymongo.DESCENDING)])
+
+    def superseded():
+        previous = None
+        for snapshot in snapshots:
+            # Newest first, so the first snapshot of an entity and day is the last one taken that day
+            day = (snapshot['entity_id'], snapshot['captured_at'][:10])
+            if day == previous:
+                yield snapshot['_id']
+            previous = day
+
+    for chunk in _chunks(superseded(), STREAM_CHUNK_SIZE):
+        deleted += mongo_db[LAKE_SNAPSHOTS].delete_many({'_id': {'$in': chunk}}).deleted_count
+    logger.info('Compacted the data lake statistics snapshots, %d deleted', deleted)
+    return deleted
+
+def get_channel_details_datalake(query, mongo_db, with_comments: bool = True):
+    """
+        Reassembles a channel with its playlists, videos and comments from the data lake
+
+        Args:
+            query: dictionary, filter on the channels collection e.g. {'channel_id': id}
+            mongo_db: pymongo database of the data lake
+            with_comments: bool, attach the comments of every video
+        Returns:
+            The same dictionary get_youtube_channel_information returns, empty list if no channel found
+    """
+    document = mongo_db[LAKE_CHANNELS].find_one(query, {'_id': 0})
+    if document is None:
+        return []
+    document['playlists'] = []
+    for playlist in mongo_db[LAKE_PLAYLISTS].find({'channel_id': document['channel_id']}, {'_id': 0}).sort('_id'):
+        playlist['videos'] = list(iter_playlist_videos_datalake(playlist['playlist_id'], mongo_db, with_comments))
+        document['playlists'].append(playlist)
+    return document
+
+def migrate_legacy_datalake(mongo_db) -> int:
+    """
+        Copies the nested channel documents of the legacy channels_data collection
+        into the normalized data lake
+
+        Args:
+            mongo_db: pymongo database of the data lake
+        Returns:
+            The number of channels copied
+    """
+    migrated = 0
+    for document in mongo_db[LEGACY_CHANNELS_COLLECTION].find({}, {'_id': 0}):
+        save_data_to_mongo_db(document, mongo_db)
+        migrated += 1
+    return migrated
+
+def get_sync_state(channel_id: str, mongo_db) -> dict:
+    """
+        Gets the etags and playlist watermarks stored by the previous sync of a channel
+
+        Args:
+            channel_id: string, youtube channel id
+            mongo_db: pymongo database of the data lake
+        Returns:
+            The sync state dictionary, None if the channel was never synced
+    """
+    return mongo_db[SYNC_STATE_COLLECTION].find_one({'channel_id': channel_id}, {'_id': 0})
+
+def save_sync_state(state: dict, mongo_db):
+    """
+        Stores the sync state of a channel next to the channels in the data lake
+
+        Args:
+            state: dictionary, sync state returned by sync_youtube_channel_information
+            mongo_db: pymongo database of the data lake
+    """
+    mongo_db[SYNC_STATE_COLLECTION].replace_one(
+        {'channel_id': state['channel_id']}, state, upsert=True
+    )
+
+def connect_to_postgre():
+    """
+        Connects to a PostgreSQL database running on GCP.
+        Args:
+            host: The host of the PostgreSQL database instance.
+            port: The port of the PostgreSQL database instance.
+            database: The name of the PostgreSQL database.
+            username: The username to use to connect to the PostgreSQL database.
+            password: The password to use to connect to the PostgreSQL database.
+        Returns:
+            A psycopg2 connection object.
+    """
+
+    return psycopg2.connect(**_postgre_connection_parameters())
+
+def _postgre_connection_parameters() -> dict:
+    return {
+        'host': os.getenv('postgre_host'),
+        'port': 5432,
+        'database': 'youtube_data',
+        'user': 'postgres',
+        'password': os.getenv('postgres_db_password'),
+    }
+
+class PostgrePool:
+    """
+        Process wide pool of PostgreSQL connections shared by every Streamlit session and
+        worker thread. Checking out blocks while all max_connections are in use, and
+        connections are validated on checkout and replaced when they are broken.
+
+        Args:
+            min_connections: int, connections kept open while idle
+            max_connections: int, upper bound of open connections
+            connect_parameters: dictionary, keyword arguments of psycopg2.connect
+    """
+
+    def __init__(self, min_connections: int, max_connections: int, **connect_parameters):
+        self._pool = psycopg2.pool.ThreadedConnectionPool(min_connections, max_connections, **connect_parameters)
+        self._available = threading.BoundedSemaphore(max_connections)
+        self.max_connections = max_connections
+
+    def _is_healthy(self, connection) -> bool:
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout: float = None):
+        """
+            Checks a healthy connection out of the pool
+
+            Args:
+                timeout: float, seconds to wait for a free connection, None to wait forever
+            Returns:
+                A psycopg2 connection object that must be given back with putconn
+        """
+        if not self._available.acquire(timeout=timeout):
+            raise psycopg2.pool.PoolError('No PostgreSQL connection available after {}s'.format(timeout))
+        try:
+            for _ in range(self.max_connections + 1):
+                connection = self._pool.getconn()
+                if self._is_healthy(connection):
+                    return connection
+                logger.warning('Discarding broken PostgreSQL connection')
+                self._pool.putconn(connection, close=True)
+            raise psycopg2.OperationalError('Unable to get a healthy PostgreSQL connection')
+        except Exception:
+            self._available.release()
+            raise
+
+    def putconn(self, connection, close: bool = False):
+        """
+            Gives a connection back to the pool, rolling back any open transaction
+
+            Args:
+                connection: psycopg2 connection object from getconn
+                close: bool, close the connection instead of keeping it for reuse
+        """
+        try:
+            self._pool.putconn(connection, close=close or connection.closed != 0)
+        finally:
+            self._available.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+_postgre_pool = None
+_mongo_client = None
+# Separate locks, so migrating the warehouse while the pool is created does not hold up the data lake
+_postgre_pool_lock = threading.Lock()
+_mongo_client_lock = threading.Lock()
+
+def get_postgre_pool() -> PostgrePool:
+    """
+        Gets the PostgreSQL pool shared by the process, sized by postgre_pool_min
+        and postgre_pool_max. The warehouse schema is migrated when the pool is created.
+    """
+    global _postgre_pool
+    with _postgre_pool_lock:
+        if _postgre_pool is None:
+            pool = PostgrePool(
+                int(os.getenv('postgre_pool_min', 1)),
+                int(os.getenv('postgre_pool_max', 10)),
+                **_postgre_connection_parameters()
+            )
+            connection = pool.getconn()
+            try:
+                migrate_warehouse_schema(connection)
+            finally:
+                pool.putconn(connection)
+            _postgre_pool = pool
+        return _postgre_pool
+
+@contextmanager
+def postgre_connection(timeout: float = None):
+    """
+        Checks a connection out of the shared pool for the duration of one operation.
+        Connections that failed with a connection level error are closed instead of
+        being reused.
+
+        Args:
+            timeout: float, seconds to wait for a free connection, None to wait forever
+        Returns:
+            A context manager yielding a psycopg2 connection object
+    """
+    pool = get_postgre_pool()
+    connection = pool.getconn(timeout)
+    broken = False
+    try:
+        yield connection
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(connection, close=broken)
+
+def _csv_field(value) -> str:
+    # Unquoted empty fields are NULL in COPY's csv format, quoted ones are empty strings
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+class _CsvRowStream:
+    """
+        Read-only file object encoding rows as CSV on demand, so COPY can stream
+        rows without building the whole payload in memory
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._pending = ''
+
+    def read(self, size: int = -1) -> str:
+        lines = [self._pending]
+        buffered = len(self._pending)
+        while size < 0 or buffered < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = ','.join(_csv_field(value) for value in row) + '\n'
+            lines.append(line)
+            buffered += len(line)
+        data = ''.join(lines)
+        if size < 0:
+            size = len(data)
+        self._pending = data[size:]
+        return data[:size]
+
+def _staging_table(table: str) -> str:
+    return '"{}_staging"'.format(table)
+
+def _create_staging_table(cursor, table: str):
+    """
+        Creates an empty temporary table shaped like a warehouse table, dropped on commit
+
+        Args:
+            cursor: psycopg2 cursor
+            table: string, warehouse table name in myschema
+    """
+    cursor.execute('DROP TABLE IF EXISTS pg_temp.{}'.format(_staging_table(table)))
+    cursor.execute('CREATE TEMP TABLE {} (LIKE myschema."{}" INCLUDING DEFAULTS) ON COMMIT DROP'.format(
+        _staging_table(table), table
+    ))
+
+def _copy_into_staging(cursor, table: str, rows: list) -> None:
+    """
+        Streams rows into the staging table of a warehouse table with COPY FROM STDIN,
+        falling back to paged multi-row INSERTs when COPY is not available
+
+        Args:
+            cursor: psycopg2 cursor
+            table: string, warehouse table name in myschema
+            rows: list of dictionaries keyed like the data lake documents
+    """
+    columns = WAREHOUSE_COLUMNS[table]
+    column_list = ', '.join(column for column, _ in columns)
+
+    def values():
+        for row in rows:
+            yield tuple(row.get(key) for _, key in columns)
+
+    cursor.execute('SAVEPOINT bulk_load')
+    try:
+        cursor.copy_expert(
+            'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(_staging_table(table), column_list),
+            _CsvRowStream(values()),
+            size=COPY_BUFFER_SIZE
+        )
+    except (psycopg2.NotSupportedError, psycopg2.ProgrammingError, psycopg2.InternalError) as e:
+        logger.warning('COPY into %s failed, falling back to INSERT pages: %r', table, e)
+        cursor.execute('ROLLBACK TO SAVEPOINT bulk_load')
+        psycopg2.extras.execute_values(
+            cursor,
+            'INSERT INTO {} ({}) VALUES %s'.format(_staging_table(table), column_list),
+            values(),
+            page_size=INSERT_PAGE_SIZE
+        )
+    cursor.execute('RELEASE SAVEPOINT bulk_load')
+
+def _get_primary_key(cursor, table: str) -> list:
+    """
+        Gets the primary key columns of a warehouse table, a partitioned table's primary
+        key also holds its partition key
+
+        Args:
+            cursor: psycopg2 cursor
+            table: string, warehouse table name in myschema
+        Returns:
+            The list of column names, empty when the table has no primary key
+    """
+    cursor.execute("""
+        SELECT a.attname
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        ORDER BY array_position(i.indkey::int2[], a.attnum)
+    """, ('myschema."{}"'.format(table),))
+    return [row[0] for row in cursor.fetchall()]
+
+def _merge_from_staging(cursor, table: str, merge: bool) -> int:
+    """
+        Moves the rows of a staging table into its warehouse table
+
+        Args:
+            cursor: psycopg2 cursor
+            table: string, warehouse table name in myschema
+            merge: bool, upsert on the primary key and only rewrite rows whose values changed,
+                   otherwise plainly insert the rows
+        Returns:
+            The number of rows inserted or updated
+    """
+    columns = [column for column, _ in WAREHOUSE_COLUMNS[table]]
+    column_list = ', '.join(columns)
+    if not merge:
+        cursor.execute('INSERT INTO myschema."{}" ({}) SELECT {} FROM {}'.format(
+            table, column_list, column_list, _staging_table(table)
+        ))
+        return cursor.rowcount
+    key = WAREHOUSE_PRIMARY_KEYS[table]
+    conflict_key = _get_primary_key(cursor, table) or [key]
+    partition_key = [column for column in conflict_key if column != key]
+    if partition_key:
+        # A row whose partition key changed would be inserted next to its old version
+        cursor.execute("""
+            DELETE FROM myschema."{table}" target USING {staging} s
+            WHERE target.{key} = s.{key} AND ({target_columns}) IS DISTINCT FROM ({staging_columns})
+        """.format(
+            table=table,
+            key=key,
+            staging=_staging_table(table),
+            target_columns=', '.join('target.' + column for column in partition_key),
+            staging_columns=', '.join('s.' + column for column in partition_key),
+        ))
+    updated_columns = [column for column in columns if column not in conflict_key]
+    cursor.execute("""
+        INSERT INTO myschema."{table}" AS target ({columns})
+        SELECT DISTINCT ON ({key}) {columns} FROM {staging}
+        ON CONFLICT ({conflict_key}) DO UPDATE SET {assignments}
+        WHERE ({target_columns}) IS DISTINCT FROM ({excluded_columns})
+    """.format(
+        table=table,
+        columns=column_list,
+        key=key,
+        conflict_key=', '.join(conflict_key),
+        staging=_staging_table(table),
+        assignments=', '.join('{0} = EXCLUDED.{0}'.format(column) for column in updated_columns),
+        target_columns=', '.join('target.' + column for column in updated_columns),
+        excluded_columns=', '.join('EXCLUDED.' + column for column in updated_columns),
+    ))
+    return cursor.rowcount
+
+def _stage_rows(cursor, table: str, rows) -> dict:
+    """
+        Loads rows into the staging table of a warehouse table, STREAM_CHUNK_SIZE rows at a time
+
+        Args:
+            cursor: psycopg2 cursor
+            table: string, warehouse table name in myschema
+            rows: iterable of dictionaries keyed like the data lake documents, consumed lazily
+        Returns:
+            A dictionary of the rows staged and the seconds it took
+    """
+    started_at = time.perf_counter()
+    _create_staging_table(cursor, table)
+    staged = 0
+    for chunk in _chunks(rows, STREAM_CHUNK_SIZE):
+        copy_started_at = time.perf_counter()
+        _copy_into_staging(cursor, table, chunk)
+        get_metrics().observe_db('postgres', 'copy', table, time.perf_counter() - copy_started_at, len(chunk))
+        staged += len(chunk)
+    return {'rows': staged, 'seconds': time.perf_counter() - started_at, 'changed': 0}
+
+@instrumented_stage('load_warehouse')
+def insert_data_into_postgre(data, connection, mode: str = 'merge', comments=None, snapshots=None):
+    """
+        Inserts data into a postgre running on GCP.
+        Args:
+            data: dictionary of the data
+            connection: psycopg2 connection object
+            mode: string, 'merge' upserts the rows on their primary keys, rewriting only the rows
+                  whose values changed, and deletes the rows of the channel that disappeared.
+                  'replace' deletes every row of the channel and inserts them again
+            comments: iterable of every comment of the channel e.g. iter_channel_comments_datalake,
+                      streamed in chunks. None for the comments attached to the videos of data
+            snapshots: iterable of statistics snapshots to append e.g. iter_stats_snapshots_datalake
+        Returns:
+            A dictionary of the rows loaded, rows changed, seconds and rows per second of each table
+    """
+    if mode not in ('merge', 'replace'):
+        raise ValueError("mode must be 'merge' or 'replace'")
+    cursor = connection.cursor()
+    parameters = {'channel_id': data['channel_id']}
+
+    video_data = {}
+    for playlist in data['playlists']:
+        for video in playlist['videos']:
+            video_data.setdefault(video['video_id'], video)
+    video_data = list(video_data.values())
+
+    if comments is None:
+        comments = (comment for video in video_data for comment in video.get('comments', []))
+
+    table_rows = (
+        ('channel_details', [data]), ('playlist', data['playlists']), ('Video', video_data), ('Comment', comments)
+    )
+    load_stats = {}
+    for table, rows in table_rows:
+        load_stats[table] = _stage_rows(cursor, table, rows)
+
+    if mode == 'replace':
+        for table, delete_query in WAREHOUSE_CHANNEL_DELETES:
+            cursor.execute(delete_query, parameters)
+    for table, _ in table_rows:
+        started_at = time.perf_counter()
+        changed = _merge_from_staging(cursor, table, merge=mode == 'merge')
+        load_stats[table]['changed'] += changed
+        load_stats[table]['seconds'] += time.perf_counter() - started_at
+        get_metrics().observe_db('postgres', 'merge', table, time.perf_counter() - started_at, changed)
+    if mode == 'merge':
+        for table, delete_query in WAREHOUSE_STALE_ROWS_DELETES:
+            started_at = time.perf_counter()
+            cursor.execute(delete_query, parameters)
+            load_stats[table]['changed'] += cursor.rowcount
+            load_stats[table]['seconds'] += time.perf_counter() - started_at
+            get_metrics().observe_db('postgres', 'delete', table, time.perf_counter() - started_at, cursor.rowcount)
+    if snapshots is not None:
+        load_stats['stats_snapshots'] = append_snapshots(cursor, snapshots)
+    version = bump_warehouse_version(cursor)
+    connection.commit()
+    get_query_cache().set_version(version)
+
+    for stats in load_stats.values():
+        stats['rows_per_sec'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+    cursor.close()
+    for table, stats in load_stats.items():
+        logger.info('Loaded %d rows into %s in %.2fs (%.0f rows/sec), %d rows changed',
+                    stats['rows'], table, stats['seconds'], stats['rows_per_sec'], stats['changed'])
+    return load_stats
+
+@instrumented_stage('refresh_summaries')
+def refresh_warehouse_summaries(connection, concurrently: bool = True) -> dict:
+    """
+        Refreshes the summary views and the statistics rollups of the warehouse.
+        Concurrent refreshes keep the views readable while they are rebuilt.
+
+        Args:
+            connection: psycopg2 connection object
+            concurrently: bool, refresh without locking out readers
+        Returns:
+            A dictionary of the seconds spent refreshing each view
+    """
+    refresh_seconds = {}
+    cursor = connection.cursor()
+    try:
+        for view, _, _ in WAREHOUSE_SUMMARIES + STATS_ROLLUPS:
+            started_at = time.perf_counter()
+            cursor.execute('REFRESH MATERIALIZED VIEW {}myschema.{}'.format(
+                'CONCURRENTLY ' if concurrently else '', view
+            ))
+            refresh_seconds[view] = time.perf_counter() - started_at
+        # Results cached before the refresh were computed from the previous summaries
+        version = bump_warehouse_version(cursor)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    get_query_cache().set_version(version)
+    for view, seconds in refresh_seconds.items():
+        logger.info('Refreshed %s in %.2fs', view, seconds)
+    return refresh_seconds
+
+@instrumented_stage('migrate_channel', 'channel_id')
+def migrate_channel_to_warehouse(channel_id: str, mongo_db, connection_factory=postgre_connection,
+                                 mode: str = 'merge', max_attempts: int = WAREHOUSE_MAX_ATTEMPTS) -> dict:
+    """
+        Migrates one channel of the data lake to the warehouse in its own transaction,
+        retrying it when it is aborted by a serialization failure or a deadlock
+
+        Args:
+            channel_id: string, id of the channel in the data lake
+            mongo_db: mongo database object
+            connection_factory: callable returning a context manager that yields a connection
+            mode: string, load mode of insert_data_into_postgre
+            max_attempts: int, attempts before a transient failure is reported
+        Returns:
+            A dictionary of the channel id, status ('migrated', 'not found' or 'failed'), attempts,
+            seconds, the error message and the load statistics of each table
+    """
+    started_at = time.perf_counter()
+    result = {'channel_id': channel_id, 'status': 'failed', 'attempts': 0, 'error': None, 'load_stats': {}}
+    data = get_channel_details_datalake({'channel_id': channel_id}, mongo_db, with_comments=False)
+    if not data:
+        result['status'] = 'not found'
+    while data and result['attempts'] < max_attempts:
+        result['attempts'] += 1
+        try:
+            with connection_factory() as connection:
+                try:
+                    snapshots = iter_stats_snapshots_datalake(
+                        channel_id, mongo_db, get_snapshot_watermark(connection, channel_id)
+                    )
+                    result['load_stats'] = insert_data_into_postgre(
+                        data, connection, mode=mode, comments=iter_channel_comments_datalake(channel_id, mongo_db),
+                        snapshots=snapshots
+                    )
+                except Exception:
+                    connection.rollback()
+                    raise
+            result['status'] = 'migrated'
+            result['error'] = None
+            break
+        except (psycopg2.errors.SerializationFailure, psycopg2.errors.DeadlockDetected) as e:
+            result['error'] = str(e)
+            logger.warning('Migrating channel %s aborted (attempt %d): %r', channel_id, result['attempts'], e)
+            time.sleep(random.uniform(0, 0.1 * 2 ** result['attempts']))
+        except Exception as e:
+            result['error'] = str(e)
+            logger.exception('Unable to migrate channel %s', channel_id)
+            break
+    result['seconds'] = time.perf_counter() - started_at
+    return result
+
+def migrate_channels_to_warehouse(channel_ids: list, mongo_db, connection_factory=postgre_connection,
+                                  max_workers: int = WAREHOUSE_MAX_WORKERS, mode: str = 'merge',
+                                  refresh: bool = True) -> list:
+    """
+        Migrates channels of the data lake to the warehouse concurrently. Every channel
+        runs in its own transaction on its own connection, so a failing channel does not
+        abort the others, and the summary views are refreshed once at the end.
+
+        Args:
+            channel_ids: list of channel ids in the data lake
+            mongo_db: mongo database object
+            connection_factory: callable returning a context manager that yields a connection
+            max_workers: int, channels migrated at the same time, bounded by the connection pool size
+            mode: string, load mode of insert_data_into_postgre
+            refresh: bool, refresh the summary views when a channel was migrated
+        Returns:
+            The list of the results of migrate_channel_to_warehouse, in the order of channel_ids,
+            with the error of the summary refresh under refresh_error, None when it succeeded
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(channel_ids) or 1))) as executor:
+        futures = {
+            executor.submit(migrate_channel_to_warehouse, channel_id, mongo_db, connection_factory, mode): channel_id
+            for channel_id in dict.fromkeys(channel_ids)
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    refresh_error = None
+    if refresh and any(result['status'] == 'migrated' for result in results.values()):
+        # The channels are committed already, a failed refresh must not hide their results
+        try:
+            with connection_factory() as connection:
+                refresh_warehouse_summaries(connection)
+        except Exception as e:
+            logger.exception('Refreshing the warehouse summaries failed')
+            refresh_error = str(e) or repr(e)
+    for result in results.values():
+        result['refresh_error'] = refresh_error
+    return [results[channel_id] for channel_id in dict.fromkeys(channel_ids)]
+
+def get_mongo_client():
+    # MongoClient pools its own connections and is thread safe, so the process shares one
+    global _mongo_client
+    with _mongo_client_lock:
+        if _mongo_client is None:
+            client = pymongo.MongoClient(os.getenv('mongo_uri'))
+            ensure_datalake_indexes(client["youtube_import"])
+            _mongo_client = client
+    return _mongo_client["youtube_import"]
+
+def get_sql_query_results(query, connection):
+    try:
+        started_at = time.perf_counter()
+        cursor = connection.cursor()
+        cursor.execute(query)
+
+        rows = cursor.fetchall()
+        get_metrics().observe_db('postgres', 'query', query_label(query), time.perf_counter() - started_at, len(rows))
+        return rows
+    finally:
+        cursor.close()
+
+def iter_sql_query_results(query: str, connection, parameters: tuple = None, batch_size: int = SQL_FETCH_SIZE):
+    """
+        Streams the results of a query through a named server-side cursor, so only
+        batch_size rows are held in memory at a time
+
+        Args:
+            query: string, sql query
+            connection: psycopg2 connection object, kept busy until the generator is exhausted or closed
+            parameters: tuple, values bound to the placeholders of the query
+            batch_size: int, rows fetched per round trip
+        Returns:
+            A generator of result rows
+    """
+    cursor = connection.cursor(name='stream_{}'.format(uuid.uuid4().hex))
+    # Only the time waiting on the database is measured, not the time the consumer takes
+    seconds = 0.0
+    fetched = 0
+    try:
+        cursor.itersize = batch_size
+        started_at = time.perf_counter()
+        cursor.execute(query, parameters)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            seconds += time.perf_counter() - started_at
+            if not rows:
+                break
+            fetched += len(rows)
+            yield from rows
+            started_at = time.perf_counter()
+    finally:
+        cursor.close()
+        get_metrics().observe_db('postgres', 'stream', query_label(query), seconds, fetched)
+
+def get_sql_query_page(query: str, connection, key_columns: tuple, page_size: int = 100, after: tuple = None,
+                       descending: bool = False, parameters: tuple = None) -> tuple:
+    """
+        Gets one page of the results of a query with keyset pagination. Pages are
+        ordered by key_columns, which must be output columns of the query that are
+        never null and unique together, so a page costs the same wherever it is.
+
+        Args:
+            query: string, sql query without ORDER BY or LIMIT
+            connection: psycopg2 connection object
+            key_columns: tuple of the column names ordering the pages
+            page_size: int, rows per page
+            after: tuple, key of the last row of the previous page, None for the first page
+            descending: bool, order the pages from the largest key
+            parameters: tuple, values bound to the placeholders of the query
+        Returns:
+            A tuple of the rows of the page and the key to pass as after to get the next
+            page, None on the last page
+    """
+    keys = ', '.join(key_columns)
+    where = ''
+    parameters = tuple(parameters or ())
+    if after is not None:
+        where = 'WHERE ({}) {} ({})'.format(keys, '<' if descending else '>', ', '.join(['%s'] * len(key_columns)))
+        parameters += tuple(after)
+    order = ', '.join(column + (' DESC' if descending else '') for column in key_columns)
+    started_at = time.perf_counter()
+    cursor = connection.cursor(name='page_{}'.format(uuid.uuid4().hex))
+    try:
+        cursor.execute('SELECT * FROM ({}) page {} ORDER BY {} LIMIT %s'.format(
+            query.strip().rstrip(';'), where, order
+        ), parameters + (page_size + 1,))
+        rows = cursor.fetchmany(page_size + 1)
+        names = [column[0] for column in cursor.description]
+    finally:
+        cursor.close()
+    get_metrics().observe_db('postgres', 'page', query_label(query), time.perf_counter() - started_at, len(rows))
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, tuple(rows[-1][names.index(column)] for column in key_columns)
+
+def get_cached_sql_query_page(query: str, key_columns: tuple, page_size: int = 100, after: tuple = None,
+                              descending: bool = False, connection_factory=postgre_connection) -> tuple:
+    """
+        Gets one page of the results of a query from the query result cache, see get_sql_query_page
+
+        Args:
+            query: string, sql query without ORDER BY or LIMIT
+            key_columns: tuple of the column names ordering the pages
+            page_size: int, rows per page
+            after: tuple, key of the last row of the previous page, None for the first page
+            descending: bool, order the pages from the largest key
+            connection_factory: callable returning a context manager that yields a connection
+        Returns:
+            A tuple of the rows of the page and the key of the next page
+    """
+    return get_query_cache().get_results(
+        query, connection_factory,
+        lambda connection: get_sql_query_page(query, connection, key_columns, page_size, after, descending),
+        parameters=(tuple(key_columns), page_size, after, descending)
+    )
+
+def get_cached_sql_query_results(query: str, connection_factory=postgre_connection) -> list:
+    """
+        Gets the results of a warehouse query from the query result cache, running it
+        only when the warehouse changed since it was cached
+
+        Args:
+            query: string, sql query
+            connection_factory: callable returning a context manager that yields a connection
+        Returns:
+            The list of result rows
+    """
+    return get_query_cache().get_results(
+        query, connection_factory, lambda connection: get_sql_query_results(query, connection)
+    )
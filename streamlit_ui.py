@@ -1,20 +1,42 @@
 import streamlit as st
 import streamlit_api as yt
+import job_queue
 import pandas as pd
+from instrumentation import STAGE_NAMES, get_metrics
+from stats_history import fastest_growing_query
 
-if 'mongo_collection' not in st.session_state:
-    st.session_state.mongo_collection = yt.get_mongo_client()
+# Every session shares the process wide MongoDB client and PostgreSQL pool
+mongo_db = yt.get_mongo_client()
 
-if 'sql_client' not in st.session_state:
-    st.session_state.sql_client = yt.connect_to_postgre()
+if 'job_ids' not in st.session_state:
+    st.session_state.job_ids = []
+
+def enqueue_jobs(kind: str, channel_ids: list, options: dict = None):
+    with yt.postgre_connection() as connection:
+        for channel_id in channel_ids:
+            job_id = job_queue.enqueue_job(connection, kind, channel_id, options=options)
+            if job_id not in st.session_state.job_ids:
+                st.session_state.job_ids.append(job_id)
+    st.success('Queued {} {} jobs, run `python worker.py` to process them'.format(len(channel_ids), kind))
+
+@st.fragment(run_every=3)
+def show_jobs():
+    # Polls the status of the jobs queued by this session
+    with yt.postgre_connection() as connection:
+        jobs = job_queue.get_jobs(connection, st.session_state.job_ids)
+    st.subheader('Background jobs')
+    st.dataframe(pd.DataFrame(jobs, columns=('job_id', 'kind', 'channel_id', 'status', 'progress', 'message',
+                                             'attempts', 'created_at', 'finished_at')))
 
 selection = st.sidebar.selectbox(
     "Select an option from the below options",
-    ("GetData", "Migrate Dara to Warehouse", "Analyze data")
+    ("GetData", "Migrate Dara to Warehouse", "Analyze data", "Diagnostics")
 )
 
 st.title("Youtube Data Analysis")
 
+st.sidebar.caption('Estimated YouTube API quota left today: {}'.format(yt.get_request_scheduler().remaining_quota()))
+
 if selection == 'GetData':
 
     channel_ids = st.sidebar.text_input("Please Enter a channel Id or comma seperated Ids")
@@ -67,162 +89,258 @@ if selection == 'GetData':
     )
 
 
-    if st.sidebar.button('Search'):
+    incremental_sync = st.sidebar.checkbox('Incremental sync', value=True,
+                                           help='Only fetch what changed since the channel was last saved')
+
+    run_in_background = st.sidebar.checkbox('Run in background', key='ingest_in_background',
+                                            help='Queue the channels for the background worker')
+    migrate_when_fetched = run_in_background and st.sidebar.checkbox('Migrate when fetched')
+
+    search = st.sidebar.button('Search')
+    if search and run_in_background:
+        enqueue_jobs('ingest', yt.parse_channel_ids(channel_ids),
+                     {'incremental': incremental_sync, 'migrate': migrate_when_fetched})
+    elif search:
         try:
             with st.spinner('searching.....'):
                 channel_info = []
                 channel_display_data = []
-                for id in channel_ids.split(','):
-                    data = yt.get_youtube_channel_information(id, yt.get_youtube_api_object())
-                    if data != {}:
-                        channel_info.append(data)
-                        channel_display_data.append({
-                            'channel_id': data['channel_id'],
-                            'channel_name': data['channel_name'],
-                            'channel_description': data['channel_description'],
-                            'channel_subscribers': data['channel_subscribers'],
-                            'channel_video_count': data['channel_video_count']
-                        })
+                errors = {}
+                if incremental_sync:
+                    channels = yt.sync_youtube_channels_information(yt.parse_channel_ids(channel_ids),
+                                                                    mongo_db,
+                                                                    errors=errors)
+                else:
+                    channels = yt.get_youtube_channels_information(yt.parse_channel_ids(channel_ids), errors=errors)
+                    # Saved one channel at a time like the incremental sync, a failing channel
+                    # is reported and does not stop the others
+                    for channel_id in list(channels):
+                        try:
+                            yt.save_data_to_mongo_db(channels[channel_id], mongo_db)
+                        except Exception as e:
+                            errors[channel_id] = e
+                            del channels[channel_id]
+                            continue
+                        try:
+                            yt.sync_channel_comments(channel_id, mongo_db)
+                        except Exception as e:
+                            errors[channel_id] = e
+                for channel_id, error in errors.items():
+                    st.warning('Unable to get channel {}: {}'.format(channel_id, error))
+                for data in channels.values():
+                    channel_info.append(data)
+                    channel_display_data.append({
+                        'channel_id': data['channel_id'],
+                        'channel_name': data['channel_name'],
+                        'channel_description': data['channel_description'],
+                        'channel_subscribers': data['channel_subscribers'],
+                        'channel_video_count': data['channel_video_count']
+                    })
                 if len(channel_info) > 0:
-                    for channel in channel_info:
-                        yt.save_data_to_mongo_db(channel, st.session_state.mongo_collection)
                     st.success('successfully found the channel and saved to data lake')
                     st.write(channel_display_data)
-                else:
+                elif not errors:
                     st.info('Unable to find the channel please try again')
         except Exception as e:
             st.write(e)
 
 elif selection == 'Migrate Dara to Warehouse':
-    channels_to_migrate = yt.get_channel_names_datalake({}, st.session_state.mongo_collection)
+    channel_catalog = {channel['channel_id']: channel for channel in yt.get_channel_catalog(mongo_db)}
+
+    selected_channels_for_migration = st.sidebar.multiselect(
+        'Select channels you want to migrate to data warehouse',
+        list(channel_catalog),
+        format_func=lambda channel_id: channel_catalog[channel_id]['channel_name']
+    )
 
-    selected_channels_for_migration = st.sidebar.multiselect('Select channels you want to migrate to data warehouse', channels_to_migrate)
+    st.dataframe(pd.DataFrame(list(channel_catalog.values()),
+                              columns=('channel_name', 'lake_video_count', 'channel_video_count', 'last_synced_at')))
 
-    if st.sidebar.button('Migrate to Data Warehouse'):
+    migrate_in_background = st.sidebar.checkbox('Run in background', key='migrate_in_background',
+                                                help='Queue the channels for the background worker')
+
+    migrate = st.sidebar.button('Migrate to Data Warehouse')
+    if migrate and migrate_in_background:
+        enqueue_jobs('migrate', selected_channels_for_migration)
+    elif migrate:
         try:
             with st.spinner('Migrating Data to warehouse........'):
-                for channel in selected_channels_for_migration:
-                    channel_info_lake = yt.get_channel_details_datalake({'channel_name': channel}, st.session_state.mongo_collection)
-                    yt.insert_data_into_postgre(channel_info_lake, st.session_state.sql_client )
-                st.success('Successfully migrated the below channels to data warehouse')
-                st.write(selected_channels_for_migration)
+                results = yt.migrate_channels_to_warehouse(selected_channels_for_migration, mongo_db)
+                load_stats = []
+                for result in results:
+                    result['channel'] = channel_catalog[result['channel_id']]['channel_name']
+                    for table, stats in result['load_stats'].items():
+                        load_stats.append(dict(stats, channel=result['channel'], table=table))
+                migrated = [result['channel'] for result in results if result['status'] == 'migrated']
+                if migrated:
+                    st.success('Successfully migrated the below channels to data warehouse')
+                    st.write(migrated)
+                for result in results:
+                    if result['status'] != 'migrated':
+                        st.warning('Unable to migrate channel {}: {}'.format(result['channel'], result['error'] or result['status']))
+                if results and results[0]['refresh_error']:
+                    st.warning('Unable to refresh the summary views: {}'.format(results[0]['refresh_error']))
+                st.dataframe(pd.DataFrame(results, columns=('channel', 'status', 'attempts', 'seconds')))
+                st.dataframe(pd.DataFrame(load_stats, columns=('channel', 'table', 'rows', 'changed', 'seconds', 'rows_per_sec')))
         except Exception as e:
             st.write(e)
 
-elif selection == 'Analyze data':
-    with st.expander('What are the names of all videos and their corresponding channels?'):
-        query = '''
-                    SELECT a.video_name, c.channel_name 
-                    FROM myschema."Video" a
-                    INNER JOIN myschema."playlist" b 
-                        ON a.playlist_id = b.playlist_id
-                    INNER JOIN myschema."channel_details" c
-                        ON b.channel_id = c.channel_id;
-                '''
-        df_results = pd.DataFrame(yt.get_sql_query_results(query, st.session_state.sql_client), 
-                                  columns=('Video Name', 'Channel Name'))
-        st.table(df_results)
-
-    with st.expander('Which channels have the most number of videos and how many videos do they have?'):
-        query1 = '''
-                    SELECT channel_name, channel_video_count 
-                    FROM myschema."channel_details"
-                    ORDER BY channel_video_count desc
-                    LIMIT 2;
-                '''
-        df_results1 = pd.DataFrame(yt.get_sql_query_results(query1, st.session_state.sql_client), 
-                                   columns=('Channel Name', 'Total Video Count'))
-        st.table(df_results1)
-    with st.expander('What are the top 10 most viewed videos and their respective channels?'):
-        query2 = '''
-                    SELECT a.video_name, a.view_count, c.channel_name
-                    FROM myschema."Video" a
-                    INNER JOIN myschema."playlist" b 
-                        ON a.playlist_id = b.playlist_id
-                    INNER JOIN myschema."channel_details" c
-                        ON b.channel_id = c.channel_id
-                    ORDER BY a.view_count DESC
-                    LIMIT 10;
-                '''
-        df_results2 = pd.DataFrame(yt.get_sql_query_results(query2, st.session_state.sql_client), 
-                                   columns=('Video Title', 'Total Views', 'Channel Name'))
-        st.table(df_results2)
-    with st.expander('How many comments were made on each video, and what are their corresponding video names?'):
-        query3 = '''
-                    SELECT video_name, comment_count
-                    FROM myschema."Video"
-                    ORDER BY comment_count desc;
-                '''
-        df_results3 = pd.DataFrame(yt.get_sql_query_results(query3, st.session_state.sql_client), 
-                                   columns=('Video Title', 'Total comments'))
-        st.table(df_results3)
-    with st.expander('Which videos have the highest number of likes and what are their corresponding channel names?'):
-        query4 = '''
-                    SELECT a.video_name, a.like_count, c.channel_name
-                    FROM myschema."Video" a
-                    INNER JOIN myschema."playlist" b 
-                        ON a.playlist_id = b.playlist_id
-                    INNER JOIN myschema."channel_details" c
-                        ON b.channel_id = c.channel_id
-                    ORDER BY a.like_count DESC
-                    LIMIT 100;
-                '''
-        df_results4 = pd.DataFrame(yt.get_sql_query_results(query4, st.session_state.sql_client), 
-                                   columns=('Video Title', 'Total Likes', 'Channel Name'))
-        st.table(df_results4)
-    with st.expander('What is the total number of likes and dislikes for each video, and what are their corresponding video names?'):
-        query5 = '''
-                    SELECT video_name, like_count, dislike_count
-                    FROM myschema."Video";
-                '''
-        df_results5 = pd.DataFrame(yt.get_sql_query_results(query5, st.session_state.sql_client), 
-                                   columns=('Video Title', 'Total Likes', 'Total dislikes'))
-        st.table(df_results5)
-    with st.expander('What are the total number of views for each channel and what are their corresponding channel names'):
-        query6 = '''
-                    SELECT channel_name, channel_views
-                    FROM myschema."channel_details";
-                '''
-        df_results6 = pd.DataFrame(yt.get_sql_query_results(query6, st.session_state.sql_client), 
-                                   columns=('Channel name', 'Total Views'))
-        st.table(df_results6)
-    with st.expander('What are the names of all the channels that have published videos in the year 2022?'):
-        query7 = '''
-                    SELECT DISTINCT c.channel_name 
-                    FROM myschema."Video" a
-                    INNER JOIN myschema."playlist" b 
-                        ON a.playlist_id = b.playlist_id
-                    INNER JOIN myschema."channel_details" c
-                        ON b.channel_id = c.channel_id
-                    WHERE a.published_date BETWEEN ('2022-01-01') AND ('2022-12-31');
-                '''
-        df_results7 = pd.DataFrame(yt.get_sql_query_results(query7, st.session_state.sql_client), 
-                                   columns=['Channel name'])
-        st.table(df_results7)
-    with st.expander('What is the average duration of all videos in each channel and what are their corresponding channel names'):
-        query8 = '''
-                    SELECT c.channel_name, AVG(a.duration)/60 AS average_duration
-                    FROM myschema."Video" a
-                    INNER JOIN myschema."playlist" b 
-                        ON a.playlist_id = b.playlist_id
-                    INNER JOIN myschema."channel_details" c
-                        ON b.channel_id = c.channel_id
-                    GROUP BY c.channel_name;
-                '''
-        df_results8 = pd.DataFrame(yt.get_sql_query_results(query8, st.session_state.sql_client), 
-                                   columns=('Channel name', 'Average Duration in mins'))
-        st.table(df_results8)
-    with st.expander('Which videos have the highest number of comments, and what are their corresponding channel names?'):
-        query9 = '''
-                    SELECT a.video_name, c.channel_name, a.comment_count
-                    FROM myschema."Video" a
-                    INNER JOIN myschema."playlist" b 
-                        ON a.playlist_id = b.playlist_id
-                    INNER JOIN myschema."channel_details" c
-                        ON b.channel_id = c.channel_id
-                    ORDER BY a.comment_count desc
-                    LIMIT 100;
-                '''
-        df_results9 = pd.DataFrame(yt.get_sql_query_results(query9, st.session_state.sql_client), 
-                                   columns=('Video Title', 'Channel Name', 'Comment Count'))
-        st.table(df_results9)
\ No newline at end of file
+if selection in ('GetData', 'Migrate Dara to Warehouse') and st.session_state.job_ids:
+    show_jobs()
+
+if selection == 'Analyze data':
+    # (question, query, result columns, paging), a query only runs once its section is opened.
+    # Unbounded queries are paged by (key columns, descending), the key columns follow the result columns
+    questions = [
+        ('What are the names of all videos and their corresponding channels?', '''
+            SELECT video_name, channel_name, video_id
+            FROM myschema.video_summary
+            WHERE channel_id IS NOT NULL
+        ''', ('Video Name', 'Channel Name'), (('video_id',), False)),
+        ('Which channels have the most number of videos and how many videos do they have?', '''
+            SELECT channel_name, channel_video_count 
+            FROM myschema.channel_summary
+            ORDER BY channel_video_count desc
+            LIMIT 2;
+        ''', ('Channel Name', 'Total Video Count'), None),
+        ('What are the top 10 most viewed videos and their respective channels?', '''
+            SELECT video_name, view_count, channel_name
+            FROM myschema.video_summary
+            WHERE channel_id IS NOT NULL
+            ORDER BY view_count DESC NULLS LAST
+            LIMIT 10;
+        ''', ('Video Title', 'Total Views', 'Channel Name'), None),
+        ('How many comments were made on each video, and what are their corresponding video names?', '''
+            SELECT video_name, COALESCE(comment_count, 0) AS comment_count, video_id
+            FROM myschema.video_summary
+        ''', ('Video Title', 'Total comments'), (('comment_count', 'video_id'), True)),
+        ('Which videos have the highest number of likes and what are their corresponding channel names?', '''
+            SELECT video_name, like_count, channel_name
+            FROM myschema.video_summary
+            WHERE channel_id IS NOT NULL
+            ORDER BY like_count DESC NULLS LAST
+            LIMIT 100;
+        ''', ('Video Title', 'Total Likes', 'Channel Name'), None),
+        ('What is the total number of likes and dislikes for each video, and what are their corresponding video names?', '''
+            SELECT video_name, like_count, dislike_count, video_id
+            FROM myschema.video_summary
+        ''', ('Video Title', 'Total Likes', 'Total dislikes'), (('video_id',), False)),
+        ('What are the total number of views for each channel and what are their corresponding channel names', '''
+            SELECT channel_name, channel_views
+            FROM myschema.channel_summary;
+        ''', ('Channel name', 'Total Views'), None),
+        ('What are the names of all the channels that have published videos in the year 2022?', '''
+            SELECT DISTINCT channel_name
+            FROM myschema.channel_year_summary
+            WHERE publish_year = 2022;
+        ''', ['Channel name'], None),
+        ('What is the average duration of all videos in each channel and what are their corresponding channel names', '''
+            SELECT channel_name, average_duration/60 AS average_duration
+            FROM myschema.channel_summary
+            WHERE video_count > 0;
+        ''', ('Channel name', 'Average Duration in mins'), None),
+        ('Which videos have the highest number of comments, and what are their corresponding channel names?', '''
+            SELECT video_name, channel_name, comment_count
+            FROM myschema.video_summary
+            WHERE channel_id IS NOT NULL
+            ORDER BY comment_count DESC NULLS LAST
+            LIMIT 100;
+        ''', ('Video Title', 'Channel Name', 'Comment Count'), None),
+        ('Which videos gained the most views over the last 30 days?',
+         fastest_growing_query('video', 'view_count', days=30),
+         ('Video Title', 'Channel Name', 'Views gained', 'Views per day'), None),
+        ('Which channels gained the most subscribers over the last 30 days?',
+         fastest_growing_query('channel', 'subscriber_count', days=30),
+         ('Channel name', 'Subscribers gained', 'Subscribers per day'), None),
+    ]
+
+    page_size = st.sidebar.selectbox('Rows per page', (25, 50, 100, 500), index=2)
+
+    for index, (question, query, columns, paging) in enumerate(questions):
+        # st.expander bodies run on every rerun, a toggle keeps closed sections from querying
+        if not st.toggle(question, key='question_{}'.format(index)):
+            continue
+        if paging is None:
+            df_results = pd.DataFrame(yt.get_cached_sql_query_results(query), columns=columns)
+            st.table(df_results)
+            continue
+        # Keys of the last row of every page before the shown one
+        pages_key = 'question_{}_pages'.format(index)
+        if st.session_state.get(pages_key + '_size') != page_size:
+            st.session_state[pages_key] = []
+            st.session_state[pages_key + '_size'] = page_size
+        pages = st.session_state[pages_key]
+        key_columns, descending = paging
+        rows, next_page = yt.get_cached_sql_query_page(query, key_columns, page_size,
+                                                       pages[-1] if pages else None, descending)
+        st.table(pd.DataFrame([row[:len(columns)] for row in rows], columns=columns))
+        previous_column, page_column, next_column = st.columns(3)
+        page_column.caption('Page {}'.format(len(pages) + 1))
+        if previous_column.button('Previous', key='question_{}_previous'.format(index), disabled=not pages):
+            pages.pop()
+            st.rerun()
+        if next_column.button('Next', key='question_{}_next'.format(index), disabled=next_page is None):
+            pages.append(next_page)
+            st.rerun()
+
+if selection == 'Diagnostics':
+    # Metrics are shared by every session of the process, since it started or was last reset
+    metrics = get_metrics()
+    scheduler_stats = yt.get_request_scheduler().stats()
+    response_cache_stats = yt.get_response_cache().stats()
+    query_cache_stats = yt.get_query_cache().stats()
+
+    quota_column, response_cache_column, query_cache_column = st.columns(3)
+    quota_column.metric('Quota used today', scheduler_stats['quota_used'],
+                        help='{} retries'.format(scheduler_stats['retries']))
+    response_cache_column.metric('API response cache hit rate', '{:.0%}'.format(response_cache_stats['hit_rate']))
+    query_cache_column.metric('Query cache hit rate', '{:.0%}'.format(query_cache_stats['hit_rate']),
+                              help='{} results cached'.format(query_cache_stats['entries']))
+
+    st.subheader('Stages')
+    errors = metrics.errors()
+    stages = [dict(row, errors=errors.get(row['stage'], 0)) for row in metrics.summary('stage_seconds')]
+    st.dataframe(pd.DataFrame(stages, columns=('stage', 'count', 'errors', 'sum', 'mean', 'p50', 'p95')))
+
+    st.subheader('YouTube API')
+    requests = {row['endpoint']: row for row in metrics.summary('youtube_request_seconds')}
+    endpoints = sorted(set(requests) | set(scheduler_stats['calls']))
+    st.dataframe(pd.DataFrame([{
+        'endpoint': endpoint,
+        'calls today': scheduler_stats['calls'].get(endpoint, 0),
+        'quota units today': scheduler_stats['units'].get(endpoint, 0),
+        'cache hits': response_cache_stats['hits'].get(endpoint, 0),
+        'cache misses': response_cache_stats['misses'].get(endpoint, 0),
+        'mean seconds': requests.get(endpoint, {}).get('mean'),
+        'p95 seconds': requests.get(endpoint, {}).get('p95'),
+    } for endpoint in endpoints]))
+
+    st.subheader('Databases')
+    db_rows = {(row['db'], row['operation'], row['target']): row['sum'] for row in metrics.summary('db_rows')}
+    db_operations = [dict(row, rows=db_rows.get((row['db'], row['operation'], row['target'])))
+                     for row in metrics.summary('db_seconds')]
+    st.dataframe(pd.DataFrame(db_operations,
+                              columns=('db', 'operation', 'target', 'count', 'rows', 'sum', 'mean', 'p95')))
+
+    st.subheader('Profiling')
+    stage_names = sorted(set(STAGE_NAMES) | {row['stage'] for row in stages})
+
+    def set_profiled_stages():
+        # Only a change made here replaces the stages, so other sessions do not undo it on rerun
+        metrics.profiled_stages = set(st.session_state.profiled_stages)
+
+    st.multiselect(
+        'Profile these stages with cProfile', stage_names, key='profiled_stages', on_change=set_profiled_stages,
+        default=sorted(metrics.profiled_stages & set(stage_names)),
+        help='Applies to every session of the app. Profiling slows the stages down, '
+             'profile only while looking for a hot spot'
+    )
+    for stage, profile in metrics.profiles().items():
+        with st.expander('Last profile of {}'.format(stage)):
+            st.code(profile['text'])
+
+    with st.expander('Prometheus metrics'):
+        st.code(metrics.prometheus_text())
+    if st.button('Reset metrics'):
+        metrics.reset()
+        st.rerun()
@@ -0,0 +1,79 @@
+import os
+import sys
+import psycopg2
+import pytest
+
+# The modules live at the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _make_channel(channel_id: str, videos_per_playlist: int = 2, comments_per_video: int = 2) -> dict:
+    playlists = []
+    for playlist_index in range(2):
+        playlist_id = '{}-p{}'.format(channel_id, playlist_index)
+        videos = []
+        for video_index in range(videos_per_playlist):
+            video_id = '{}-v{}'.format(playlist_id, video_index)
+            videos.append({
+                'video_id': video_id, 'playlist_id': playlist_id, 'video_name': 'Video ' + video_id,
+                'video_description': '', 'video_published_date': '2024-01-01T00:00:00Z', 'view_count': 10,
+                'like_count': 1, 'dislike_count': 0, 'favourite_count': 0, 'comment_count': comments_per_video,
+                'video_duration': 60, 'thumbnail_url': None, 'caption_status': 'false',
+                'comments': [{
+                    'comment_id': '{}-c{}'.format(video_id, comment_index), 'video_id': video_id,
+                    'comment_text': 'hi', 'comment_author': 'someone', 'parent_id': None, 'reply_count': 0,
+                    'comment_published_date': '2024-01-02T00:00:00Z',
+                } for comment_index in range(comments_per_video)],
+            })
+        playlists.append({'playlist_id': playlist_id, 'channel_id': channel_id, 'playlist_name': playlist_id,
+                          'playlist_description': '', 'videos': videos})
+    return {'channel_id': channel_id, 'channel_name': channel_id, 'channel_views': 100, 'channel_description': '',
+            'status': 'public', 'channel_subscribers': 5, 'channel_video_count': 4, 'playlists': playlists}
+
+@pytest.fixture
+def make_channel():
+    """
+        Builds a channel dictionary as returned by get_youtube_channel_information, with
+        two playlists of videos_per_playlist videos of comments_per_video comments each
+    """
+    return _make_channel
+
+@pytest.fixture
+def offline_youtube(monkeypatch):
+    """
+        Replaces the process wide request scheduler by an unthrottled one and turns the
+        response cache off, both are restored after the test
+    """
+    import response_cache
+    import youtube_scheduler
+    monkeypatch.setattr(youtube_scheduler, '_scheduler', youtube_scheduler.RequestScheduler(
+        daily_quota=10 ** 6, requests_per_second=10 ** 6, burst=10 ** 6
+    ))
+    monkeypatch.setattr(response_cache, '_cache', response_cache.ResponseCache('', mode='off'))
+
+@pytest.fixture
+def mongo_db():
+    """In-memory data lake database with its indexes"""
+    import mongomock
+    database = mongomock.MongoClient()['youtube_import']
+    import streamlit_api
+    streamlit_api.ensure_datalake_indexes(database)
+    return database
+
+@pytest.fixture
+def warehouse():
+    """
+        Connection to a scratch PostgreSQL database given by test_postgre_dsn, with
+        myschema dropped and migrated again. Tests using it are skipped without the dsn.
+    """
+    dsn = os.getenv('test_postgre_dsn')
+    if not dsn:
+        pytest.skip('test_postgre_dsn is not set')
+    from warehouse_schema import migrate_warehouse_schema
+    connection = psycopg2.connect(dsn)
+    with connection.cursor() as cursor:
+        cursor.execute('DROP SCHEMA IF EXISTS myschema CASCADE')
+    connection.commit()
+    migrate_warehouse_schema(connection)
+    yield connection
+    connection.rollback()
+    connection.close()
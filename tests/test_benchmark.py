@@ -0,0 +1,39 @@
+from benchmark import FakeYouTube, compare_with_baseline, median_stages, run_benchmark
+
+def measurements(seconds: float, api_calls: int = 10, peak_memory_mb: float = 5.0) -> dict:
+    return {'seconds': seconds, 'api_calls': api_calls, 'quota_units': api_calls, 'peak_memory_mb': peak_memory_mb,
+            'rows': 100, 'rows_per_sec': round(100 / seconds, 1)}
+
+def test_small_or_relative_slowdowns_are_not_regressions():
+    baseline = {'fetch': measurements(0.01), 'migrate': measurements(1.0)}
+    # Three times slower but only 20 ms more, and 10% slower
+    assert compare_with_baseline({'fetch': measurements(0.03), 'migrate': measurements(1.1)}, baseline) == []
+
+def test_slowdowns_above_the_tolerance_and_the_minimum_are_regressions():
+    baseline = {'fetch': measurements(0.1), 'migrate': measurements(1.0)}
+    regressions = compare_with_baseline({'fetch': measurements(0.16), 'migrate': measurements(1.3)}, baseline)
+    assert regressions == [
+        'fetch seconds: 0.16 against 0.1 in the baseline', 'migrate seconds: 1.3 against 1.0 in the baseline'
+    ]
+
+def test_any_extra_api_call_is_a_regression():
+    regressions = compare_with_baseline({'fetch': measurements(1.0, api_calls=11)}, {'fetch': measurements(1.0)})
+    assert regressions == ['fetch api_calls: 11 against 10 in the baseline',
+                           'fetch quota_units: 11 against 10 in the baseline']
+
+def test_missing_memory_and_stages_are_skipped():
+    stages = {'fetch': measurements(1.0, peak_memory_mb=None), 'migrate': measurements(9.0)}
+    assert compare_with_baseline(stages, {'fetch': measurements(1.0)}) == []
+
+def test_median_stages_takes_the_median_time():
+    runs = [{'fetch': measurements(seconds)} for seconds in (0.5, 0.1, 0.2)]
+    assert median_stages(runs)['fetch'] == dict(measurements(0.2), rows_per_sec=500.0)
+
+def test_incremental_stages_fetch_what_changed(offline_youtube, mongo_db):
+    fake = FakeYouTube(channels=1, playlists=1, videos=10, comments=2, replies=1, latency=0)
+    stages = run_benchmark(fake, mongo_db, max_workers=2)
+    assert stages['comments']['rows'] == 40
+    # The recent videos get their statistics refreshed, and the first one a new thread with its reply
+    assert fake.requests['videos'] == 2
+    assert stages['incremental_comments']['rows'] == 2
+    assert stages['incremental_comments']['api_calls'] == 1
@@ -0,0 +1,74 @@
+import pytest
+import streamlit_api as yt
+from benchmark import FakeYouTube
+
+class FakeThreads(FakeYouTube):
+    """Serves the comment threads of the single video v, given as thread id: (day published, reply ids)"""
+
+    def __init__(self, threads: dict):
+        super().__init__(channels=0, latency=0)
+        self.threads = threads
+
+    def _comment_threads(self, video_id: str) -> list:
+        by_day = sorted(self.threads.items(), key=lambda thread: thread[1][0], reverse=True)
+        return [(thread_id, day * 1440) for thread_id, (day, _) in by_day]
+
+    def _reply_ids(self, thread_id: str) -> list:
+        return self.threads[thread_id][1]
+
+    def requested(self, resource: str) -> list:
+        return [params for name, params in self.history if name == resource]
+
+def replies(thread_id: str, count: int) -> list:
+    return ['{}.r{}'.format(thread_id, reply) for reply in range(count)]
+
+@pytest.fixture(autouse=True)
+def small_pages(offline_youtube, monkeypatch):
+    monkeypatch.setattr(yt, 'COMMENT_PAGE_SIZE', 2)
+
+def sync(youtube: FakeThreads, mongo_db, max_comments: int = None) -> int:
+    video = mongo_db[yt.LAKE_VIDEOS].find_one({'_id': 'v'}) or {'_id': 'v', 'comments_synced_count': 0}
+    video.update(video_id='v', channel_id='ch', comment_count=youtube._comment_count('v'))
+    mongo_db[yt.LAKE_VIDEOS].replace_one({'_id': 'v'}, video, upsert=True)
+    youtube.history.clear()
+    return yt.sync_video_comments(video, youtube, mongo_db, max_comments)
+
+def stored(mongo_db) -> set:
+    return {document['_id'] for document in mongo_db[yt.LAKE_COMMENTS].find({'video_id': 'v'})}
+
+def test_new_threads_are_fetched_down_to_the_newest_stored_one(mongo_db):
+    youtube = FakeThreads({'t1': (1, ['t1.r1']), 't2': (2, []), 't3': (3, ['t3.r1', 't3.r2'])})
+    assert sync(youtube, mongo_db) == 6
+    assert stored(mongo_db) == {'t1', 't1.r1', 't2', 't3', 't3.r1', 't3.r2'}
+
+    youtube.threads.update({'t4': (4, ['t4.r1']), 't5': (5, [])})
+    assert sync(youtube, mongo_db) == 3
+    # The second page holds t3, where paging stops, the older threads are not requested
+    assert [params.get('pageToken') for params in youtube.requested('commentThreads')] == [None, '2']
+    assert all(params['order'] == 'time' for params in youtube.requested('commentThreads'))
+    assert len(stored(mongo_db)) == 9
+
+def test_only_threads_with_new_replies_page_their_replies(mongo_db):
+    # More replies than the five a thread carries, so they are paged from the comments endpoint
+    youtube = FakeThreads({'t1': (1, replies('t1', 6)), 't2': (2, replies('t2', 6))})
+    sync(youtube, mongo_db)
+    youtube.threads['t1'][1].append('t1.r6')
+    assert sync(youtube, mongo_db) == 9
+    assert {params['parentId'] for params in youtube.requested('comments')} == {'t1'}
+    assert stored(mongo_db) == {'t1', 't2'} | set(replies('t1', 7)) | set(replies('t2', 6))
+
+def test_removed_threads_and_replies_are_deleted(mongo_db):
+    youtube = FakeThreads({'t1': (1, ['t1.r1']), 't2': (2, ['t2.r1', 't2.r2']), 't3': (3, ['t3.r1'])})
+    sync(youtube, mongo_db)
+    del youtube.threads['t1']
+    youtube.threads['t2'] = (2, ['t2.r2'])
+    sync(youtube, mongo_db)
+    assert stored(mongo_db) == {'t2', 't2.r2', 't3', 't3.r1'}
+
+def test_unchanged_replies_count_against_max_comments(mongo_db):
+    youtube = FakeThreads({'t1': (1, []), 't2': (2, ['t2.r1', 't2.r2']), 't3': (3, [])})
+    sync(youtube, mongo_db)
+    youtube.threads['t3'] = (3, ['t3.r1'])
+    # t3 and its reply, then t2 and its two stored replies reach the limit before t1
+    assert sync(youtube, mongo_db, max_comments=5) == 3
+    assert stored(mongo_db) == {'t1', 't2', 't2.r1', 't2.r2', 't3', 't3.r1'}
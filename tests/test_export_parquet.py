@@ -0,0 +1,57 @@
+import pyarrow.dataset as ds
+import streamlit_api as yt
+from export_parquet import export_lake, export_warehouse
+
+def read(output_dir, name: str, column: str) -> list:
+    dataset = ds.dataset(str(output_dir / name), format='parquet', partitioning='hive')
+    return sorted(dataset.to_table(columns=[column]).column(column).to_pylist())
+
+def channel_over_two_months(make_channel, channel_id: str) -> dict:
+    channel = make_channel(channel_id)
+    channel['playlists'][0]['videos'][1]['video_published_date'] = '2024-02-01T00:00:00Z'
+    for comment in channel['playlists'][0]['videos'][1]['comments']:
+        comment['comment_published_date'] = '2024-02-02T00:00:00Z'
+    return channel
+
+def test_lake_export_round_trip(mongo_db, make_channel, tmp_path):
+    channel = channel_over_two_months(make_channel, 'ch1')
+    yt.save_data_to_mongo_db(channel, mongo_db)
+    counts = export_lake(mongo_db, str(tmp_path))
+    assert counts == {'channels': 1, 'playlists': 2, 'videos': 4, 'comments': 8}
+    assert read(tmp_path, 'videos', 'video_id') == sorted(
+        video['video_id'] for playlist in channel['playlists'] for video in playlist['videos']
+    )
+    assert read(tmp_path, 'videos', 'publish_month') == ['2024-01', '2024-01', '2024-01', '2024-02']
+    assert read(tmp_path, 'comments', 'comment_id')[0] == 'ch1-p0-v0-c0'
+
+def test_lake_reexport_drops_deleted_rows(mongo_db, make_channel, tmp_path):
+    yt.save_data_to_mongo_db(channel_over_two_months(make_channel, 'ch1'), mongo_db)
+    yt.save_data_to_mongo_db(make_channel('ch2'), mongo_db)
+    export_lake(mongo_db, str(tmp_path))
+
+    # The only video of the 2024-02 partition and every comment of the channel are deleted
+    mongo_db[yt.LAKE_VIDEOS].delete_one({'_id': 'ch1-p0-v1'})
+    mongo_db[yt.LAKE_COMMENTS].delete_many({'channel_id': 'ch1'})
+    mongo_db[yt.LAKE_PLAYLISTS].delete_one({'_id': 'ch1-p1'})
+    export_lake(mongo_db, str(tmp_path), channel_ids=['ch1'])
+
+    assert [video_id for video_id in read(tmp_path, 'videos', 'video_id') if video_id.startswith('ch1')] == [
+        'ch1-p0-v0', 'ch1-p1-v0', 'ch1-p1-v1'
+    ]
+    assert not any(comment_id.startswith('ch1') for comment_id in read(tmp_path, 'comments', 'comment_id'))
+    assert read(tmp_path, 'playlists', 'playlist_id') == ['ch1-p0', 'ch2-p0', 'ch2-p1']
+    # Channels that were not exported again keep their partitions
+    assert len([video_id for video_id in read(tmp_path, 'videos', 'video_id') if video_id.startswith('ch2')]) == 4
+
+def test_warehouse_export_round_trip_and_deletion(warehouse, make_channel, tmp_path):
+    channel = channel_over_two_months(make_channel, 'ch1')
+    yt.insert_data_into_postgre(channel, warehouse)
+    assert export_warehouse(warehouse, str(tmp_path)) == {'channels': 1, 'playlists': 2, 'videos': 4, 'comments': 8}
+    assert len(read(tmp_path, 'comments', 'comment_id')) == 8
+
+    del channel['playlists'][0]['videos'][1]
+    yt.insert_data_into_postgre(channel, warehouse)
+    export_warehouse(warehouse, str(tmp_path), channel_ids=['ch1'])
+    assert read(tmp_path, 'videos', 'video_id') == ['ch1-p0-v0', 'ch1-p1-v0', 'ch1-p1-v1']
+    assert read(tmp_path, 'videos', 'publish_month') == ['2024-01'] * 3
+    assert len(read(tmp_path, 'comments', 'comment_id')) == 6
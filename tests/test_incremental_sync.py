@@ -0,0 +1,66 @@
+import pytest
+import streamlit_api as yt
+from benchmark import FakeYouTube
+
+class FakePlaylist(FakeYouTube):
+    """Serves the single playlist PL with the given (video id, day added) items, in their order"""
+
+    def __init__(self, items: list):
+        super().__init__(channels=0, latency=0)
+        self.items = items
+
+    def _video_ids(self, playlist_id: str) -> list:
+        return [video_id for video_id, _ in self.items]
+
+    def _published_at(self, video_id: str) -> str:
+        return '2024-01-{:02d}T00:00:00Z'.format(dict(self.items)[video_id])
+
+@pytest.fixture(autouse=True)
+def small_pages(offline_youtube, monkeypatch):
+    monkeypatch.setattr(yt, 'PAGE_SIZE', 2)
+
+def test_first_sync_pages_everything_and_records_the_watermark():
+    youtube = FakePlaylist([('v{}'.format(day), day) for day in range(6, 0, -1)])
+    ids, etag, watermark = yt._sync_playlist_video_ids('PL', youtube, None, [], None, max_videos=None)
+    assert ids == ['v6', 'v5', 'v4', 'v3', 'v2', 'v1']
+    assert watermark == '2024-01-06T00:00:00Z'
+    assert youtube.requests['playlistItems'] == 3
+
+def test_unchanged_first_page_keeps_the_previous_ids():
+    youtube = FakePlaylist([('v2', 2), ('v1', 1)])
+    _, etag, watermark = yt._sync_playlist_video_ids('PL', youtube, None, [], None, max_videos=None)
+    ids, _, same_watermark = yt._sync_playlist_video_ids('PL', youtube, etag, ['v2', 'v1'], watermark,
+                                                        max_videos=None)
+    assert ids == ['v2', 'v1']
+    assert same_watermark == watermark
+
+def test_new_items_stop_paging_at_the_watermark():
+    previous = [('v{}'.format(day), day) for day in range(6, 0, -1)]
+    youtube = FakePlaylist([('v8', 8), ('v7', 7)] + previous)
+    ids, _, watermark = yt._sync_playlist_video_ids(
+        'PL', youtube, 'stale', ['v6', 'v5', 'v4', 'v3', 'v2', 'v1'], '2024-01-06T00:00:00Z', max_videos=None
+    )
+    assert ids == ['v8', 'v7', 'v6', 'v5', 'v4', 'v3', 'v2', 'v1']
+    assert watermark == '2024-01-08T00:00:00Z'
+    # The second page holds the first item at the watermark, the rest are not requested
+    assert youtube.requests['playlistItems'] == 2
+
+def test_removed_items_fall_back_to_paging_everything():
+    youtube = FakePlaylist([('v7', 7), ('v6', 6), ('v4', 4), ('v3', 3), ('v1', 1)])
+    ids, _, watermark = yt._sync_playlist_video_ids(
+        'PL', youtube, 'stale', ['v6', 'v5', 'v4', 'v3', 'v2', 'v1'], '2024-01-06T00:00:00Z', max_videos=None
+    )
+    assert ids == ['v7', 'v6', 'v4', 'v3', 'v1']
+    assert watermark == '2024-01-07T00:00:00Z'
+
+def test_playlists_not_in_newest_first_order_get_no_watermark():
+    youtube = FakePlaylist([('v1', 1), ('v3', 3), ('v2', 2)])
+    ids, _, watermark = yt._sync_playlist_video_ids('PL', youtube, None, [], None, max_videos=None)
+    assert ids == ['v1', 'v3', 'v2']
+    assert watermark is None
+
+def test_max_videos_caps_the_merged_ids():
+    youtube = FakePlaylist([('v{}'.format(day), day) for day in range(8, 0, -1)])
+    ids, _, _ = yt._sync_playlist_video_ids('PL', youtube, 'stale', ['v6', 'v5', 'v4'], '2024-01-06T00:00:00Z',
+                                            max_videos=3)
+    assert ids == ['v8', 'v7', 'v6']
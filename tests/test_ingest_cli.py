@@ -0,0 +1,81 @@
+import sys
+import threading
+import pytest
+import ingest_cli
+import streamlit_api as yt
+from benchmark import FakeYouTube
+from ingest_cli import IngestCheckpoint
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    return IngestCheckpoint(str(tmp_path / 'checkpoint.sqlite'))
+
+@pytest.fixture
+def fake_youtube(offline_youtube, monkeypatch):
+    youtube = FakeYouTube(channels=1, playlists=2, videos=3, comments=1, replies=0, latency=0)
+    monkeypatch.setattr(yt, '_api_objects', threading.local())
+    monkeypatch.setattr(yt, 'build', lambda *args, **kwargs: youtube)
+    return youtube
+
+def test_parse_channel_ids():
+    text = 'UC1, UC2  UC3\n\nUC2,,UC4 # a comment\n# UC5\n  UC1'
+    assert yt.parse_channel_ids(text) == ['UC1', 'UC2', 'UC3', 'UC4']
+    assert yt.parse_channel_ids(' \n, ') == []
+
+def test_checkpoint_persists_statuses_and_playlists(checkpoint, tmp_path):
+    checkpoint.set_channel_status('UC1', 'migrated')
+    checkpoint.set_channel_status('UC2', 'failed', 'quota exceeded')
+    checkpoint.set_playlist_saved('UC3', 'PL1')
+    reopened = IngestCheckpoint(str(tmp_path / 'checkpoint.sqlite'))
+    assert [reopened.channel_status(channel_id) for channel_id in ('UC1', 'UC2', 'UC3')] == ['migrated', 'failed', None]
+    assert reopened.saved_playlists('UC3') == {'PL1'}
+    assert reopened.counts() == {'migrated': 1, 'failed': 1}
+
+def test_resumed_ingest_skips_the_saved_playlists(fake_youtube, checkpoint, mongo_db):
+    channel_id = fake_youtube.channel_ids[0]
+    saved, pending = fake_youtube._playlist_ids(channel_id)
+    checkpoint.set_playlist_saved(channel_id, saved)
+    assert ingest_cli.ingest_channel(channel_id, mongo_db, checkpoint) == 'ingested'
+    paged = {params['playlistId'] for resource, params in fake_youtube.history if resource == 'playlistItems'}
+    assert paged == {pending}
+    assert checkpoint.saved_playlists(channel_id) == {saved, pending}
+    assert ingest_cli.ingest_channel('UCmissing', mongo_db, checkpoint) == 'not found'
+
+def run_main(monkeypatch, tmp_path, mongo_db, channel_ids, *args):
+    source = tmp_path / 'channels.txt'
+    source.write_text('\n'.join(channel_ids))
+    monkeypatch.setattr(yt, 'get_mongo_client', lambda: mongo_db)
+    monkeypatch.setattr(sys, 'argv', ['ingest_cli.py', str(source), '--checkpoint',
+                                      str(tmp_path / 'checkpoint.sqlite'), '--workers', '1', *args])
+    ingest_cli.main()
+
+def test_resumed_run_skips_the_finished_channels(checkpoint, tmp_path, mongo_db, monkeypatch):
+    for channel_id, status in [('UC1', 'ingested'), ('UC2', 'migrated'), ('UC3', 'not found'), ('UC4', 'failed')]:
+        checkpoint.set_channel_status(channel_id, status)
+    ingested = []
+
+    def ingest_channel(channel_id, mongo_db, checkpoint, incremental):
+        ingested.append(channel_id)
+        return 'ingested'
+
+    monkeypatch.setattr(ingest_cli, 'ingest_channel', ingest_channel)
+    run_main(monkeypatch, tmp_path, mongo_db, ['UC1', 'UC2', 'UC3', 'UC4', 'UC5'])
+    assert ingested == ['UC5']
+    run_main(monkeypatch, tmp_path, mongo_db, ['UC1', 'UC2', 'UC3', 'UC4', 'UC5'], '--retry-failed')
+    assert ingested == ['UC5', 'UC4']
+
+def test_failed_migrations_keep_their_error(checkpoint, tmp_path, mongo_db, monkeypatch):
+    checkpoint.set_channel_status('UC1', 'ingested')
+    checkpoint.set_channel_status('UC2', 'ingested')
+
+    def migrate_channels_to_warehouse(channel_ids, mongo_db):
+        assert channel_ids == ['UC1', 'UC2']
+        return [
+            {'channel_id': 'UC1', 'status': 'migrated', 'error': None, 'refresh_error': None},
+            {'channel_id': 'UC2', 'status': 'failed', 'error': 'deadlock detected', 'refresh_error': None},
+        ]
+
+    monkeypatch.setattr(yt, 'migrate_channels_to_warehouse', migrate_channels_to_warehouse)
+    run_main(monkeypatch, tmp_path, mongo_db, ['UC1', 'UC2'], '--migrate')
+    assert checkpoint.counts() == {'migrated': 1, 'ingested': 1}
+    assert checkpoint.channel_errors('ingested') == {'UC2': 'deadlock detected'}
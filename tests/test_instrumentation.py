@@ -0,0 +1,26 @@
+from datetime import date
+import youtube_scheduler
+from instrumentation import PipelineMetrics
+
+class FakeRequest:
+    methodId = 'youtube.videos.list'
+
+    def __init__(self):
+        self.headers = {}
+
+    def execute(self):
+        return {'items': []}
+
+def test_daily_api_gauges_restart_with_the_quota(offline_youtube, monkeypatch):
+    scheduler = youtube_scheduler.RequestScheduler(daily_quota=50, requests_per_second=10 ** 6, burst=10 ** 6)
+    monkeypatch.setattr(youtube_scheduler, '_scheduler', scheduler)
+    scheduler.execute(FakeRequest())
+    scheduler.execute(FakeRequest())
+    text = PipelineMetrics().prometheus_text()
+    assert 'youtube_api_calls_today{endpoint="videos.list"} 2' in text
+    assert 'youtube_quota_remaining 48' in text
+
+    scheduler._today = lambda: date(2099, 1, 1)
+    text = PipelineMetrics().prometheus_text()
+    assert 'youtube_api_calls_today{' not in text
+    assert 'youtube_quota_remaining 50' in text
@@ -0,0 +1,30 @@
+from job_queue import claim_job, enqueue_job, finish_job, get_jobs, requeue_stale_jobs
+
+def test_queued_job_absorbs_a_new_one_with_merged_options(warehouse):
+    job_id = enqueue_job(warehouse, 'ingest', 'ch1', priority=1, options={'incremental': True})
+    assert enqueue_job(warehouse, 'ingest', 'ch1', priority=5, options={'migrate': True}) == job_id
+    assert enqueue_job(warehouse, 'ingest', 'ch1', priority=0, options={'incremental': False}) == job_id
+    job, = get_jobs(warehouse, [job_id])
+    assert job['priority'] == 5
+    assert job['options'] == {'incremental': False, 'migrate': True}
+
+def test_running_job_does_not_absorb_a_new_one(warehouse):
+    job_id = enqueue_job(warehouse, 'ingest', 'ch1')
+    assert claim_job(warehouse, 'w1')['job_id'] == job_id
+    assert enqueue_job(warehouse, 'ingest', 'ch1') != job_id
+
+def test_only_the_claiming_worker_finishes_a_running_job(warehouse):
+    job_id = enqueue_job(warehouse, 'migrate', 'ch1')
+    claim_job(warehouse, 'w1')
+    # w1 stops sending heartbeats and its job is claimed again by w2
+    assert requeue_stale_jobs(warehouse, timeout=-1) == 1
+    assert claim_job(warehouse, 'w2')['job_id'] == job_id
+
+    assert not finish_job(warehouse, job_id, 'w1', 'failed', 'late outcome')
+    job, = get_jobs(warehouse, [job_id])
+    assert (job['status'], job['worker']) == ('running', 'w2')
+
+    assert finish_job(warehouse, job_id, 'w2', 'done', result={'rows': 3})
+    assert not finish_job(warehouse, job_id, 'w2', 'failed')
+    job, = get_jobs(warehouse, [job_id])
+    assert (job['status'], job['progress'], job['result']) == ('done', 1, {'rows': 3})
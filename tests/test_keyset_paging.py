@@ -0,0 +1,50 @@
+import streamlit_api as yt
+
+# Ties on score, so only (score, video_id) is unique
+ROWS_QUERY = """
+    SELECT * FROM (VALUES (3, 'a'), (1, 'b'), (3, 'c'), (2, 'd'), (1, 'e'), (3, 'f'), (2, 'g'))
+    AS rows (score, video_id)
+"""
+ORDERED = sorted([(3, 'a'), (1, 'b'), (3, 'c'), (2, 'd'), (1, 'e'), (3, 'f'), (2, 'g')])
+
+def read_all_pages(connection, page_size: int, descending: bool = False, query: str = ROWS_QUERY) -> list:
+    pages, after = [], None
+    while True:
+        rows, after = yt.get_sql_query_page(query, connection, ('score', 'video_id'), page_size, after, descending)
+        pages.append(rows)
+        if after is None:
+            return pages
+
+def test_first_page_returns_the_key_of_its_last_row(warehouse):
+    rows, after = yt.get_sql_query_page(ROWS_QUERY, warehouse, ('score', 'video_id'), 3)
+    assert rows == ORDERED[:3]
+    assert after == ORDERED[2]
+
+def test_pages_cover_every_row_once_across_ties(warehouse):
+    for page_size in (1, 2, 3, 6):
+        pages = read_all_pages(warehouse, page_size)
+        assert [row for page in pages for row in page] == ORDERED
+        assert all(len(page) == page_size for page in pages[:-1])
+
+def test_last_page_of_an_exact_multiple_is_full_and_has_no_next_key(warehouse):
+    pages = read_all_pages(warehouse, 7)
+    assert pages == [ORDERED]
+    query = ROWS_QUERY.replace(", (2, 'g')", '')
+    pages = read_all_pages(warehouse, 3, query=query)
+    assert [len(page) for page in pages] == [3, 3]
+
+def test_descending_pages(warehouse):
+    pages = read_all_pages(warehouse, 2, descending=True)
+    assert [row for page in pages for row in page] == ORDERED[::-1]
+    assert pages[0] == [(3, 'f'), (3, 'c')]
+
+def test_page_after_the_last_key_is_empty(warehouse):
+    rows, after = yt.get_sql_query_page(ROWS_QUERY, warehouse, ('score', 'video_id'), 3, after=ORDERED[-1])
+    assert (rows, after) == ([], None)
+
+def test_parameters_are_bound_before_the_key(warehouse):
+    query = 'SELECT * FROM ({}) filtered WHERE score >= %s'.format(ROWS_QUERY)
+    rows, after = yt.get_sql_query_page(query, warehouse, ('score', 'video_id'), 2, after=(2, 'd'),
+                                        parameters=(2,))
+    assert rows == [(2, 'g'), (3, 'a')]
+    assert after == (3, 'a')
@@ -0,0 +1,100 @@
+import pytest
+from response_cache import CacheMissError, ResponseCache
+
+class FakeRequest:
+    def __init__(self, resource: str, query: str):
+        self.methodId = 'youtube.{}.list'.format(resource)
+        self.uri = 'https://youtube.googleapis.com/youtube/v3/{}?{}&key=secret'.format(resource, query)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+class Network:
+    """send callable counting the requests that reached the network"""
+
+    def __init__(self, response):
+        self.response = response
+        self.sent = 0
+
+    def __call__(self):
+        self.sent += 1
+        return self.response
+
+def make_cache(tmp_path, **options) -> ResponseCache:
+    return ResponseCache(str(tmp_path / 'cache.sqlite'), clock=options.pop('clock', FakeClock()), **options)
+
+def test_responses_expire_after_the_ttl_of_their_endpoint(tmp_path):
+    clock = FakeClock()
+    cache = make_cache(tmp_path, clock=clock, ttls={'videos.list': 60, 'playlists.list': 600})
+    videos, playlists = FakeRequest('videos', 'id=v1'), FakeRequest('playlists', 'channelId=c')
+    network = Network({'items': [1]})
+    cache.execute(videos, network)
+    cache.execute(playlists, network)
+    clock.now += 61
+    assert cache.execute(videos, network) == {'items': [1]}
+    assert cache.execute(playlists, network) == {'items': [1]}
+    # videos.list expired and went to the network again, playlists.list was still fresh
+    assert network.sent == 3
+    assert cache.stats()['hits'] == {'playlists.list': 1}
+
+def test_key_and_parameter_order_do_not_change_the_cache_key(tmp_path):
+    cache = make_cache(tmp_path)
+    network = Network({'items': []})
+    cache.execute(FakeRequest('videos', 'id=v1&part=snippet'), network)
+    cache.execute(FakeRequest('videos', 'part=snippet&id=v1'), network)
+    assert network.sent == 1
+
+def test_least_recently_used_responses_are_evicted_over_max_bytes(tmp_path):
+    clock = FakeClock()
+    body = {'items': ['x' * 80]}
+    # Each response takes 94 bytes, three of them fit
+    cache = make_cache(tmp_path, clock=clock, max_bytes=300)
+    for video in ('v1', 'v2', 'v3'):
+        cache.execute(FakeRequest('videos', 'id=' + video), Network(body))
+        clock.now += 1
+    # v1 is read, so v2 is the least recently used one when v4 does not fit
+    cache.execute(FakeRequest('videos', 'id=v1'), Network(body))
+    clock.now += 1
+    cache.execute(FakeRequest('videos', 'id=v4'), Network(body))
+    assert (cache.stats()['evictions'], cache.stats()['size_bytes']) == (1, 282)
+    network = Network(body)
+    for video in ('v1', 'v3', 'v4'):
+        cache.execute(FakeRequest('videos', 'id=' + video), network)
+    assert network.sent == 0
+    cache.execute(FakeRequest('videos', 'id=v2'), network)
+    assert network.sent == 1
+
+def test_conditional_requests_bypass_the_cache_in_on_mode(tmp_path):
+    cache = make_cache(tmp_path)
+    request = FakeRequest('playlistItems', 'playlistId=PL')
+    cache.execute(request, Network({'etag': 'e1', 'items': []}))
+    unchanged = Network(None)
+    assert cache.execute(request, unchanged, etag='e1') is None
+    assert unchanged.sent == 1
+    # A 304 stores nothing, the cached response is still served to unconditional requests
+    assert cache.execute(request, Network({'etag': 'e2'})) == {'etag': 'e1', 'items': []}
+
+def test_replay_serves_recordings_only(tmp_path):
+    clock = FakeClock()
+    recorder = make_cache(tmp_path, mode='record', clock=clock)
+    request = FakeRequest('videos', 'id=v1')
+    recorder.execute(request, Network({'etag': 'e1', 'items': [1]}))
+    clock.now += 10 ** 6
+
+    replay = make_cache(tmp_path, mode='replay', clock=clock)
+    network = Network({'items': []})
+    # Stale recordings are still served, and nothing reaches the network
+    assert replay.execute(request, network) == {'etag': 'e1', 'items': [1]}
+    assert replay.execute(request, network, etag='e1') is None
+    assert replay.execute(request, network, etag='e0') == {'etag': 'e1', 'items': [1]}
+    with pytest.raises(CacheMissError):
+        replay.execute(FakeRequest('videos', 'id=v2'), network)
+    assert network.sent == 0
+
+def test_unknown_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        make_cache(tmp_path, mode='sometimes')
@@ -0,0 +1,52 @@
+import pytest
+import streamlit_api as yt
+
+TRICKY_TEXTS = ['', 'plain', 'comma, inside', 'quote " inside', '""', 'new\nline', 'back\\slash', 'ünïcödé ✓', 'NULL']
+
+def test_csv_field_distinguishes_null_from_empty_strings():
+    assert yt._csv_field(None) == ''
+    assert yt._csv_field('') == '""'
+    assert yt._csv_field('say "hi"') == '"say ""hi"""'
+    assert yt._csv_field(True) == 't'
+    assert yt._csv_field(False) == 'f'
+    assert yt._csv_field(42) == '42'
+    assert yt._csv_field(1.5) == '1.5'
+
+@pytest.mark.parametrize('size', [1, 3, 7, 64 * 1024, -1])
+def test_csv_row_stream_reads_the_same_payload_in_any_chunk_size(size):
+    rows = [(index, text, None) for index, text in enumerate(TRICKY_TEXTS)]
+    expected = ''.join(','.join(yt._csv_field(value) for value in row) + '\n' for row in rows)
+    stream = yt._CsvRowStream(iter(rows))
+    chunks = []
+    while True:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        assert size < 0 or len(chunk) <= size
+        chunks.append(chunk)
+    assert ''.join(chunks) == expected
+
+def test_copy_into_staging_round_trips_tricky_values(warehouse):
+    rows = [{
+        'comment_id': 'c{}'.format(index), 'video_id': 'v1', 'comment_text': text,
+        'comment_author': None if index % 2 else text, 'comment_published_date': '2024-01-02T03:04:05Z',
+        'parent_id': None, 'reply_count': index,
+    } for index, text in enumerate(TRICKY_TEXTS)]
+    with warehouse.cursor() as cursor:
+        yt._create_staging_table(cursor, 'Comment')
+        yt._copy_into_staging(cursor, 'Comment', rows)
+        cursor.execute('SELECT comment_id, comment_text, comment_author, reply_count FROM "Comment_staging"')
+        staged = {row[0]: row[1:] for row in cursor.fetchall()}
+    assert staged == {
+        row['comment_id']: (row['comment_text'], row['comment_author'], row['reply_count']) for row in rows
+    }
+
+def test_stage_rows_streams_in_chunks(warehouse, monkeypatch):
+    monkeypatch.setattr(yt, 'STREAM_CHUNK_SIZE', 3)
+    rows = ({'playlist_id': 'p{}'.format(index), 'channel_id': 'ch', 'playlist_name': str(index),
+             'playlist_description': None} for index in range(10))
+    with warehouse.cursor() as cursor:
+        stats = yt._stage_rows(cursor, 'playlist', rows)
+        cursor.execute('SELECT count(*), count(playlist_description) FROM "playlist_staging"')
+        assert cursor.fetchone() == (10, 0)
+    assert stats['rows'] == 10
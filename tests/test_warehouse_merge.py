@@ -0,0 +1,59 @@
+import copy
+import streamlit_api as yt
+
+def count(connection, table: str, channel_id: str) -> int:
+    queries = {
+        'playlist': 'SELECT count(*) FROM myschema.playlist WHERE channel_id = %s',
+        'Video': '''SELECT count(*) FROM myschema."Video" v JOIN myschema.playlist p USING (playlist_id)
+                    WHERE p.channel_id = %s''',
+        'Comment': '''SELECT count(*) FROM myschema."Comment" c JOIN myschema."Video" v USING (video_id)
+                      JOIN myschema.playlist p USING (playlist_id) WHERE p.channel_id = %s''',
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(queries[table], (channel_id,))
+        return cursor.fetchone()[0]
+
+def test_reloading_an_unchanged_channel_rewrites_nothing(warehouse, make_channel):
+    channel = make_channel('ch1')
+    first = yt.insert_data_into_postgre(copy.deepcopy(channel), warehouse)
+    assert first['Comment']['changed'] == 8
+    second = yt.insert_data_into_postgre(copy.deepcopy(channel), warehouse)
+    assert {table: stats['changed'] for table, stats in second.items()} == {
+        'channel_details': 0, 'playlist': 0, 'Video': 0, 'Comment': 0
+    }
+
+def test_merge_updates_changed_rows_and_deletes_stale_ones(warehouse, make_channel):
+    yt.insert_data_into_postgre(make_channel('ch1'), warehouse)
+    yt.insert_data_into_postgre(make_channel('ch2'), warehouse)
+
+    channel = make_channel('ch1')
+    channel['playlists'][0]['videos'][0]['view_count'] = 99
+    del channel['playlists'][0]['videos'][1]
+    channel['playlists'][1]['videos'][0]['comments'].pop()
+    del channel['playlists'][1]['videos'][1]['comments']
+    channel['playlists'][1]['videos'][1]['comments'] = []
+    stats = yt.insert_data_into_postgre(channel, warehouse)
+
+    assert stats['Video']['changed'] == 2  # one view count updated, one video deleted
+    assert count(warehouse, 'Video', 'ch1') == 3
+    assert count(warehouse, 'Comment', 'ch1') == 3
+    with warehouse.cursor() as cursor:
+        cursor.execute('SELECT view_count FROM myschema."Video" WHERE video_id = %s', ('ch1-p0-v0',))
+        assert cursor.fetchone()[0] == 99
+    # Stale deletes are scoped to the loaded channel
+    assert (count(warehouse, 'playlist', 'ch2'), count(warehouse, 'Video', 'ch2'),
+            count(warehouse, 'Comment', 'ch2')) == (2, 4, 8)
+
+def test_removed_playlist_is_deleted_with_its_videos(warehouse, make_channel):
+    yt.insert_data_into_postgre(make_channel('ch1'), warehouse)
+    channel = make_channel('ch1')
+    del channel['playlists'][1]
+    yt.insert_data_into_postgre(channel, warehouse)
+    assert (count(warehouse, 'playlist', 'ch1'), count(warehouse, 'Video', 'ch1'),
+            count(warehouse, 'Comment', 'ch1')) == (1, 2, 4)
+
+def test_replace_mode_reloads_every_row_of_the_channel(warehouse, make_channel):
+    yt.insert_data_into_postgre(make_channel('ch1'), warehouse)
+    stats = yt.insert_data_into_postgre(make_channel('ch1'), warehouse, mode='replace')
+    assert stats['Video']['changed'] == 4
+    assert count(warehouse, 'Comment', 'ch1') == 8
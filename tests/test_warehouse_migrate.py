@@ -0,0 +1,33 @@
+import os
+from contextlib import contextmanager
+import psycopg2
+import streamlit_api as yt
+
+@contextmanager
+def connect():
+    connection = psycopg2.connect(os.environ['test_postgre_dsn'])
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+def test_results_are_returned_when_the_summary_refresh_fails(warehouse, mongo_db, make_channel, monkeypatch):
+    yt.save_data_to_mongo_db(make_channel('ch1'), mongo_db)
+
+    def refresh(connection):
+        raise RuntimeError('refresh failed')
+
+    monkeypatch.setattr(yt, 'refresh_warehouse_summaries', refresh)
+    results = yt.migrate_channels_to_warehouse(['ch1', 'missing'], mongo_db, connect)
+    assert [(result['channel_id'], result['status']) for result in results] == [
+        ('ch1', 'migrated'), ('missing', 'not found')
+    ]
+    assert all(result['refresh_error'] == 'refresh failed' for result in results)
+    with warehouse.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM myschema."Video"')
+        assert cursor.fetchone()[0] == 4
+
+def test_refresh_error_is_none_when_the_refresh_succeeds(warehouse, mongo_db, make_channel):
+    yt.save_data_to_mongo_db(make_channel('ch1'), mongo_db)
+    result, = yt.migrate_channels_to_warehouse(['ch1'], mongo_db, connect)
+    assert (result['status'], result['refresh_error']) == ('migrated', None)
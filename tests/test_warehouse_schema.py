@@ -0,0 +1,29 @@
+from warehouse_schema import migrate_warehouse_schema
+
+def test_legacy_tables_are_deduplicated_before_their_primary_keys(warehouse):
+    with warehouse.cursor() as cursor:
+        cursor.execute('DROP SCHEMA myschema CASCADE')
+        cursor.execute('CREATE SCHEMA myschema')
+        # Older versions created the tables without keys and appended every load
+        cursor.execute("""
+            CREATE TABLE myschema."Video" (
+                video_id VARCHAR(255), playlist_id VARCHAR(255), video_name VARCHAR(255),
+                video_description TEXT, published_date TIMESTAMP, view_count BIGINT, like_count BIGINT,
+                dislike_count BIGINT, favourite_count BIGINT, comment_count BIGINT, duration INT,
+                thumbnail_url VARCHAR(255), caption_status VARCHAR(255)
+            )
+        """)
+        cursor.executemany(
+            'INSERT INTO myschema."Video" (video_id, view_count) VALUES (%s, %s)',
+            [('a', 1), ('b', 5), ('a', 2), (None, 7), ('a', 3)]
+        )
+    warehouse.commit()
+
+    assert 1 in migrate_warehouse_schema(warehouse)
+    with warehouse.cursor() as cursor:
+        cursor.execute('SELECT video_id, view_count FROM myschema."Video" ORDER BY video_id')
+        assert cursor.fetchall() == [('a', 3), ('b', 5)]
+        cursor.execute("""
+            SELECT 1 FROM pg_constraint WHERE conrelid = 'myschema."Video"'::regclass AND contype = 'p'
+        """)
+        assert cursor.fetchone() is not None
@@ -0,0 +1,136 @@
+import json
+from datetime import date
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+from youtube_scheduler import QuotaExceededError, RequestScheduler, TokenBucket
+
+class FakeClock:
+    """Clock whose sleep advances the time instead of waiting"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class FakeRequest:
+    """Request returning or raising the given outcomes in turn"""
+
+    def __init__(self, *outcomes, method_id='youtube.videos.list'):
+        self.methodId = method_id
+        self.headers = {}
+        self.outcomes = list(outcomes)
+        self.executed = 0
+
+    def execute(self):
+        self.executed += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+def http_error(status: int, reason: str = '') -> HttpError:
+    content = json.dumps({'error': {'errors': [{'reason': reason}]}}).encode('utf-8')
+    return HttpError(httplib2.Response({'status': status}), content)
+
+def make_scheduler(clock: FakeClock, **options) -> RequestScheduler:
+    options = dict(dict(daily_quota=100, requests_per_second=2, burst=2, max_retries=3), **options)
+    return RequestScheduler(clock=clock, sleep=clock.sleep, **options)
+
+def test_token_bucket_allows_the_burst_then_paces_requests():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock, sleep=clock.sleep)
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.sleeps == pytest.approx([0.5, 0.5, 0.5])
+    assert clock.now == pytest.approx(1.5)
+
+def test_execute_charges_quota_per_endpoint():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, daily_quota=101)
+    scheduler.execute(FakeRequest({'items': []}))
+    scheduler.execute(FakeRequest({'items': []}, method_id='youtube.search.list'))
+    stats = scheduler.stats()
+    assert stats['calls'] == {'videos.list': 1, 'search.list': 1}
+    assert stats['units'] == {'videos.list': 1, 'search.list': 100}
+    assert scheduler.remaining_quota() == 0
+
+def test_counts_reset_with_the_quota_on_a_new_day():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, burst=10)
+    scheduler.execute(FakeRequest(http_error(503), {'items': []}))
+    scheduler._today = lambda: date(2099, 1, 1)
+    # Read without any request sent on the new day
+    assert scheduler.stats() == {'quota_used': 0, 'quota_remaining': 100, 'calls': {}, 'units': {}, 'retries': 0}
+    scheduler.execute(FakeRequest({'items': []}))
+    assert scheduler.stats()['calls'] == {'videos.list': 1}
+
+def test_local_budget_exhaustion_raises_without_sending():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, daily_quota=2)
+    scheduler.execute(FakeRequest({}))
+    scheduler.execute(FakeRequest({}))
+    request = FakeRequest({})
+    with pytest.raises(QuotaExceededError):
+        scheduler.execute(request)
+    assert request.executed == 0
+
+def test_quota_exceeded_response_stops_later_requests():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    with pytest.raises(QuotaExceededError):
+        scheduler.execute(FakeRequest(http_error(403, 'quotaExceeded')))
+    assert scheduler.remaining_quota() == 0
+    request = FakeRequest({})
+    with pytest.raises(QuotaExceededError):
+        scheduler.execute(request)
+    assert request.executed == 0
+
+def test_conditional_request_returns_none_when_not_modified():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    request = FakeRequest(http_error(304))
+    assert scheduler.execute(request, etag='"abc"') is None
+    assert request.headers['If-None-Match'] == '"abc"'
+    # A 304 is still charged, the API counts the request against the quota
+    assert scheduler.stats()['quota_used'] == 1
+
+def test_not_modified_without_etag_is_an_error():
+    clock = FakeClock()
+    with pytest.raises(HttpError):
+        make_scheduler(clock).execute(FakeRequest(http_error(304)))
+
+def test_transient_errors_are_retried_with_bounded_backoff():
+    clock = FakeClock()
+    # A burst large enough that every sleep is a backoff
+    scheduler = make_scheduler(clock, burst=10, backoff_base=1, backoff_max=3)
+    request = FakeRequest(http_error(503), http_error(403, 'rateLimitExceeded'), ConnectionError(), {'items': [1]})
+    assert scheduler.execute(request) == {'items': [1]}
+    assert request.executed == 4
+    assert scheduler.stats()['retries'] == 3
+    assert len(clock.sleeps) == 3
+    for attempt, wait in enumerate(clock.sleeps):
+        assert 0 <= wait <= min(3, 2 ** attempt)
+
+def test_retries_stop_after_max_retries():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock, max_retries=2)
+    request = FakeRequest(http_error(500), http_error(500), http_error(500), {})
+    with pytest.raises(HttpError):
+        scheduler.execute(request)
+    assert request.executed == 3
+
+def test_client_errors_are_not_retried():
+    clock = FakeClock()
+    scheduler = make_scheduler(clock)
+    request = FakeRequest(http_error(404, 'notFound'), {})
+    with pytest.raises(HttpError):
+        scheduler.execute(request)
+    assert request.executed == 1
+    assert scheduler.stats()['retries'] == 0
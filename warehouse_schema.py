@@ -0,0 +1,304 @@
+import logging
+import os
+from datetime import date
+from job_queue import JOBS_DDL
+from query_cache import WAREHOUSE_VERSION_DDL
+from stats_history import SNAPSHOTS_DDL, STATS_ROLLUPS
+
+logger = logging.getLogger(__name__)
+
+# Key of the advisory lock held while migrating, so concurrent processes migrate once
+MIGRATION_LOCK_KEY = 7310425
+
+# YouTube was launched in 2005, videos published earlier do not exist
+FIRST_VIDEO_YEAR = 2005
+
+TABLES = {
+    'channel_details': """
+        CREATE TABLE IF NOT EXISTS myschema."channel_details" (
+            channel_id VARCHAR(255) PRIMARY KEY,
+            channel_name VARCHAR(255),
+            channel_views BIGINT,
+            channel_description TEXT,
+            channel_status VARCHAR(255),
+            channel_subscribers BIGINT,
+            channel_video_count INT
+        )
+    """,
+    'playlist': """
+        CREATE TABLE IF NOT EXISTS myschema."playlist" (
+            playlist_id VARCHAR(255) PRIMARY KEY,
+            channel_id VARCHAR(255) REFERENCES myschema."channel_details" (channel_id)
+                ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+            playlist_name VARCHAR(255),
+            playlist_description TEXT
+        )
+    """,
+    'Video': """
+        CREATE TABLE IF NOT EXISTS myschema."Video" (
+            video_id VARCHAR(255) NOT NULL,
+            playlist_id VARCHAR(255) REFERENCES myschema."playlist" (playlist_id)
+                ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+            video_name VARCHAR(255),
+            video_description TEXT,
+            published_date TIMESTAMP{published_date_constraint},
+            view_count BIGINT,
+            like_count BIGINT,
+            dislike_count BIGINT,
+            favourite_count BIGINT,
+            comment_count BIGINT,
+            duration INT,
+            thumbnail_url VARCHAR(255),
+            caption_status VARCHAR(255),
+            PRIMARY KEY ({primary_key})
+        ){partitioning}
+    """,
+    'Comment': """
+        CREATE TABLE IF NOT EXISTS myschema."Comment" (
+            comment_id VARCHAR(255) PRIMARY KEY,
+            video_id VARCHAR(255){video_reference},
+            comment_text TEXT,
+            comment_author VARCHAR(255),
+            comment_published_date TIMESTAMP
+        )
+    """,
+}
+
+# Primary keys added to tables created before the schema was managed
+PRIMARY_KEYS = {
+    'channel_details': 'channel_id',
+    'playlist': 'playlist_id',
+    'Video': 'video_id',
+    'Comment': 'comment_id',
+}
+
+# Indexes of the channel scoped deletes of the loads and of the Analyze joins and sorts
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS playlist_channel_id ON myschema."playlist" (channel_id)',
+    'CREATE INDEX IF NOT EXISTS video_playlist_id ON myschema."Video" (playlist_id)',
+    'CREATE INDEX IF NOT EXISTS video_view_count ON myschema."Video" (view_count DESC NULLS LAST)',
+    'CREATE INDEX IF NOT EXISTS video_like_count ON myschema."Video" (like_count DESC NULLS LAST)',
+    'CREATE INDEX IF NOT EXISTS video_comment_count ON myschema."Video" (comment_count DESC NULLS LAST)',
+    'CREATE INDEX IF NOT EXISTS video_published_date ON myschema."Video" (published_date)',
+    'CREATE INDEX IF NOT EXISTS comment_video_id ON myschema."Comment" (video_id)',
+)
+
+# Columns of the comment threads added to tables created before replies were stored
+COMMENT_THREAD_COLUMNS = (
+    'ALTER TABLE myschema."Comment" ADD COLUMN IF NOT EXISTS parent_id VARCHAR(255)',
+    'ALTER TABLE myschema."Comment" ADD COLUMN IF NOT EXISTS reply_count INT',
+    'CREATE INDEX IF NOT EXISTS comment_parent_id ON myschema."Comment" (parent_id)',
+)
+
+# Materialized views the Analyze page reads from, with the unique index each one needs
+# to be refreshed concurrently and the indexes of its top-n queries
+WAREHOUSE_SUMMARIES = (
+    ('video_summary', """
+        SELECT v.video_id, v.video_name, p.channel_id, c.channel_name, v.published_date,
+            v.view_count, v.like_count, v.dislike_count, v.comment_count, v.duration
+        FROM myschema."Video" v
+        LEFT JOIN myschema."playlist" p ON v.playlist_id = p.playlist_id
+        LEFT JOIN myschema."channel_details" c ON p.channel_id = c.channel_id
+    """, (
+        'CREATE UNIQUE INDEX IF NOT EXISTS video_summary_video_id ON myschema.video_summary (video_id)',
+        'CREATE INDEX IF NOT EXISTS video_summary_view_count ON myschema.video_summary (view_count DESC NULLS LAST)',
+        'CREATE INDEX IF NOT EXISTS video_summary_like_count ON myschema.video_summary (like_count DESC NULLS LAST)',
+        'CREATE INDEX IF NOT EXISTS video_summary_comment_count ON myschema.video_summary (comment_count DESC NULLS LAST)',
+    )),
+    ('channel_summary', """
+        SELECT c.channel_id, c.channel_name, c.channel_views, c.channel_video_count,
+            COUNT(v.video_id) AS video_count, SUM(v.duration) AS total_duration, AVG(v.duration) AS average_duration
+        FROM myschema."channel_details" c
+        LEFT JOIN myschema."playlist" p ON p.channel_id = c.channel_id
+        LEFT JOIN myschema."Video" v ON v.playlist_id = p.playlist_id
+        GROUP BY c.channel_id, c.channel_name, c.channel_views, c.channel_video_count
+    """, (
+        'CREATE UNIQUE INDEX IF NOT EXISTS channel_summary_channel_id ON myschema.channel_summary (channel_id)',
+    )),
+    ('channel_year_summary', """
+        SELECT c.channel_id, c.channel_name, date_part('year', v.published_date::timestamp)::int AS publish_year,
+            COUNT(*) AS video_count
+        FROM myschema."Video" v
+        INNER JOIN myschema."playlist" p ON v.playlist_id = p.playlist_id
+        INNER JOIN myschema."channel_details" c ON p.channel_id = c.channel_id
+        GROUP BY c.channel_id, c.channel_name, publish_year
+    """, (
+        'CREATE UNIQUE INDEX IF NOT EXISTS channel_year_summary_key ON myschema.channel_year_summary (channel_id, publish_year)',
+        'CREATE INDEX IF NOT EXISTS channel_year_summary_publish_year ON myschema.channel_year_summary (publish_year)',
+    )),
+)
+
+# Indexes of the keyset paginated Analyze queries
+KEYSET_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS video_summary_comment_count_keyset '
+    'ON myschema.video_summary ((COALESCE(comment_count, 0)), video_id)',
+)
+
+def _deduplicate_legacy_rows(cursor, table: str, key: str):
+    """
+        Removes the rows a primary key cannot be added over, from tables older versions
+        appended every load to: rows without a key, and of the rows sharing a key all
+        but the one stored last (the most recent load)
+    """
+    cursor.execute('DELETE FROM myschema."{0}" WHERE {1} IS NULL'.format(table, key))
+    missing = cursor.rowcount
+    cursor.execute("""
+        DELETE FROM myschema."{0}" AS older USING myschema."{0}" AS newer
+        WHERE older.{1} = newer.{1} AND older.ctid < newer.ctid
+    """.format(table, key))
+    if missing or cursor.rowcount:
+        logger.warning(
+            'Deleted %d duplicate rows and %d rows without %s from %s before adding its primary key',
+            cursor.rowcount, missing, key, table
+        )
+
+def _create_tables(cursor, partition_videos: bool):
+    cursor.execute('CREATE SCHEMA IF NOT EXISTS myschema')
+    for table, ddl in TABLES.items():
+        if table == 'Video':
+            # Unique keys of a partitioned table must contain the partition key, so the
+            # comments of a partitioned Video table cannot reference it
+            ddl = ddl.format(
+                published_date_constraint=' NOT NULL' if partition_videos else '',
+                primary_key='video_id, published_date' if partition_videos else 'video_id',
+                partitioning=' PARTITION BY RANGE (published_date)' if partition_videos else '',
+            )
+        elif table == 'Comment':
+            ddl = ddl.format(video_reference='' if partition_videos else (
+                ' REFERENCES myschema."Video" (video_id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED'
+            ))
+        cursor.execute(ddl)
+        # Keyed before the next table is created, as its foreign key needs the key
+        cursor.execute("""
+            SELECT 1 FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'p'
+        """, ('myschema."{}"'.format(table),))
+        if cursor.fetchone() is None:
+            key = PRIMARY_KEYS[table]
+            _deduplicate_legacy_rows(cursor, table, key)
+            logger.info('Adding the primary key of %s', table)
+            cursor.execute('ALTER TABLE myschema."{}" ADD PRIMARY KEY ({})'.format(table, key))
+
+def _create_indexes(cursor, partition_videos: bool):
+    for index in INDEXES:
+        cursor.execute(index)
+
+def _create_warehouse_version(cursor, partition_videos: bool):
+    cursor.execute(WAREHOUSE_VERSION_DDL)
+
+def _create_summaries(cursor, partition_videos: bool):
+    for view, query, indexes in WAREHOUSE_SUMMARIES:
+        cursor.execute('CREATE MATERIALIZED VIEW IF NOT EXISTS myschema.{} AS {}'.format(view, query))
+        for index in indexes:
+            cursor.execute(index)
+
+def _create_keyset_indexes(cursor, partition_videos: bool):
+    for index in KEYSET_INDEXES:
+        cursor.execute(index)
+
+def _create_jobs(cursor, partition_videos: bool):
+    for statement in JOBS_DDL:
+        cursor.execute(statement)
+
+def _add_comment_threads(cursor, partition_videos: bool):
+    for statement in COMMENT_THREAD_COLUMNS:
+        cursor.execute(statement)
+
+def _create_stats_snapshots(cursor, partition_videos: bool):
+    for statement in SNAPSHOTS_DDL:
+        cursor.execute(statement)
+    for view, query, indexes in STATS_ROLLUPS:
+        cursor.execute('CREATE MATERIALIZED VIEW IF NOT EXISTS myschema.{} AS {}'.format(view, query))
+        for index in indexes:
+            cursor.execute(index)
+
+# Ordered (version, description, function applying it), applied versions are recorded in
+# myschema.schema_migrations and never applied twice
+MIGRATIONS = (
+    (1, 'warehouse tables', _create_tables),
+    (2, 'indexes of the load deletes and analyze queries', _create_indexes),
+    (3, 'warehouse data version', _create_warehouse_version),
+    (4, 'analyze summary views', _create_summaries),
+    (5, 'keyset pagination indexes', _create_keyset_indexes),
+    (6, 'background job queue', _create_jobs),
+    (7, 'comment replies', _add_comment_threads),
+    (8, 'statistics snapshots and daily rollup', _create_stats_snapshots),
+)
+
+def is_video_table_partitioned(cursor) -> bool:
+    """Whether the Video table was created range partitioned by published_date"""
+    cursor.execute("""
+        SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('myschema."Video"')
+    """)
+    return cursor.fetchone() is not None
+
+def ensure_video_partitions(cursor, through_year: int):
+    """
+        Creates the yearly partitions of a partitioned Video table up to through_year,
+        videos outside of them land in the default partition
+
+        Args:
+            cursor: psycopg2 cursor
+            through_year: int, last year that gets its own partition
+    """
+    if not is_video_table_partitioned(cursor):
+        return
+    cursor.execute('CREATE TABLE IF NOT EXISTS myschema."Video_default" PARTITION OF myschema."Video" DEFAULT')
+    for year in range(FIRST_VIDEO_YEAR, through_year + 1):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS myschema."Video_{0}" PARTITION OF myschema."Video"
+            FOR VALUES FROM ('{0}-01-01') TO ('{1}-01-01')
+        """.format(year, year + 1))
+
+def migrate_warehouse_schema(connection, partition_videos: bool = None) -> list:
+    """
+        Applies the schema migrations the warehouse has not seen yet, each in its own
+        transaction. Existing tables are kept, partitioning only applies when the Video
+        table is created by the migration.
+
+        Args:
+            connection: psycopg2 connection object
+            partition_videos: bool, range partition the Video table by published_date,
+                              defaults to the warehouse_partition_videos setting
+        Returns:
+            The list of the versions applied
+    """
+    if partition_videos is None:
+        partition_videos = os.getenv('warehouse_partition_videos', '').lower() in ('1', 'true', 'yes')
+    applied = []
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_KEY,))
+        cursor.execute('CREATE SCHEMA IF NOT EXISTS myschema')
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS myschema.schema_migrations (
+                version INT PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        connection.commit()
+        cursor.execute('SELECT version FROM myschema.schema_migrations')
+        done = {row[0] for row in cursor.fetchall()}
+        for version, description, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            logger.info('Applying warehouse migration %d: %s', version, description)
+            migrate(cursor, partition_videos)
+            cursor.execute(
+                'INSERT INTO myschema.schema_migrations (version, description) VALUES (%s, %s)',
+                (version, description)
+            )
+            connection.commit()
+            applied.append(version)
+        # Keeps a partition ahead of the videos being published
+        ensure_video_partitions(cursor, date.today().year + 1)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_KEY,))
+        connection.commit()
+        cursor.close()
+    return applied
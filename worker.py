@@ -0,0 +1,196 @@
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+import streamlit_api as yt
+from instrumentation import start_metrics_server
+from response_cache import CACHE_MODES, set_response_cache_mode
+from job_queue import JOB_KINDS, claim_job, enqueue_job, finish_job, heartbeat_job, requeue_stale_jobs, update_job_progress
+from stats_history import compact_snapshots
+
+logger = logging.getLogger(__name__)
+
+# Seconds between the heartbeats of a running job, and without a heartbeat before it is requeued
+JOB_HEARTBEAT_INTERVAL = int(os.getenv('job_heartbeat_interval', 30))
+JOB_HEARTBEAT_TIMEOUT = int(os.getenv('job_heartbeat_timeout', 300))
+
+# Seconds between the compactions of the statistics snapshots
+STATS_COMPACT_INTERVAL = int(os.getenv('stats_compact_interval', 24 * 60 * 60))
+
+def _report(job: dict, progress: float, message: str):
+    with yt.postgre_connection() as connection:
+        update_job_progress(connection, job['job_id'], progress, message)
+
+def run_ingest_job(job: dict, mongo_db) -> dict:
+    """
+        Fetches a channel from the YouTube Data API into the data lake
+
+        Args:
+            job: dictionary, claimed job with the options incremental (default true)
+                 and migrate (queue a migration once the channel is saved)
+            mongo_db: mongo database object
+        Returns:
+            A dictionary of the number of playlists, videos and comments saved
+    """
+    channel_id = job['channel_id']
+    options = job['options'] or {}
+    errors = {}
+    _report(job, 0.05, 'fetching the channel from YouTube')
+    if options.get('incremental', True):
+        channels = yt.sync_youtube_channels_information([channel_id], mongo_db, errors=errors, comments=False)
+    else:
+        channels = yt.get_youtube_channels_information([channel_id], errors=errors)
+        if channel_id in channels:
+            _report(job, 0.8, 'saving the channel to the data lake')
+            yt.save_data_to_mongo_db(channels[channel_id], mongo_db)
+    if channel_id in errors:
+        raise errors[channel_id]
+    if channel_id not in channels:
+        raise LookupError('Channel {} not found'.format(channel_id))
+    _report(job, 0.85, 'fetching the comments of the changed videos')
+    comment_stats = yt.sync_channel_comments(channel_id, mongo_db)
+    data = channels[channel_id]
+    result = {
+        'channel_name': data['channel_name'],
+        'playlists': len(data['playlists']),
+        'videos': sum(len(playlist['videos']) for playlist in data['playlists']),
+        'comments': comment_stats['comments'],
+    }
+    if options.get('migrate'):
+        with yt.postgre_connection() as connection:
+            result['migrate_job_id'] = enqueue_job(connection, 'migrate', channel_id, priority=job['priority'])
+    return result
+
+def run_migrate_job(job: dict, mongo_db) -> dict:
+    """
+        Migrates a channel of the data lake to the warehouse
+
+        Args:
+            job: dictionary, claimed job
+            mongo_db: mongo database object
+        Returns:
+            The result of migrate_channel_to_warehouse
+    """
+    _report(job, 0.05, 'migrating the channel to the warehouse')
+    result = yt.migrate_channels_to_warehouse([job['channel_id']], mongo_db, max_workers=1)[0]
+    if result['status'] != 'migrated':
+        raise RuntimeError(result['error'] or 'Channel {} {}'.format(job['channel_id'], result['status']))
+    return result
+
+JOB_RUNNERS = {
+    'ingest': run_ingest_job,
+    'migrate': run_migrate_job,
+}
+
+def run_job(job: dict, mongo_db):
+    """Runs a claimed job while sending its heartbeats, and records its outcome"""
+    done = threading.Event()
+
+    def heartbeat():
+        while not done.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                with yt.postgre_connection() as connection:
+                    heartbeat_job(connection, job['job_id'])
+            except Exception as e:
+                logger.warning('Heartbeat of job %s failed: %r', job['job_id'], e)
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    logger.info('Running %s job %s for channel %s', job['kind'], job['job_id'], job['channel_id'])
+    try:
+        result = JOB_RUNNERS[job['kind']](job, mongo_db)
+        status, message = 'done', None
+    except Exception as e:
+        logger.exception('%s job %s failed', job['kind'], job['job_id'])
+        result, status, message = None, 'failed', str(e) or repr(e)
+    finally:
+        done.set()
+        heartbeat_thread.join()
+    with yt.postgre_connection() as connection:
+        if not finish_job(connection, job['job_id'], job['worker'], status, message, result):
+            logger.warning('%s job %s was taken over by another worker, its outcome was not recorded',
+                           job['kind'], job['job_id'])
+
+def compact_statistics(mongo_db):
+    """Downsamples and expires the statistics snapshots of the data lake and the warehouse"""
+    try:
+        yt.compact_stats_snapshots_datalake(mongo_db)
+        with yt.postgre_connection() as connection:
+            compact_snapshots(connection)
+    except Exception as e:
+        logger.warning('Compacting the statistics snapshots failed: %r', e)
+
+def work(name: str, stop: threading.Event, mongo_db, kinds: tuple = JOB_KINDS,
+         poll_interval: float = 5, once: bool = False):
+    """
+        Claims and runs jobs until stop is set
+
+        Args:
+            name: string, name of the worker recorded on the jobs it claims
+            stop: threading.Event, set to stop after the running job
+            mongo_db: mongo database object
+            kinds: tuple of the job kinds to run
+            poll_interval: float, seconds to wait when no job is queued
+            once: bool, return as soon as the queue is empty
+    """
+    while not stop.is_set():
+        with yt.postgre_connection() as connection:
+            job = claim_job(connection, name, kinds)
+        if job is None:
+            if once:
+                return
+            stop.wait(poll_interval)
+            continue
+        run_job(job, mongo_db)
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the background ingestion and migration jobs')
+    parser.add_argument('--workers', type=int, default=2, help='jobs run at the same time')
+    parser.add_argument('--kinds', nargs='+', choices=JOB_KINDS, default=list(JOB_KINDS), help='job kinds to run')
+    parser.add_argument('--poll-interval', type=float, default=5, help='seconds between polls of an empty queue')
+    parser.add_argument('--once', action='store_true', help='exit once the queue is empty')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics at /metrics on this port')
+    parser.add_argument('--cache-mode', choices=CACHE_MODES,
+                        help='API response cache mode, youtube_cache_mode by default')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(threadName)s %(levelname)s %(message)s')
+
+    if args.cache_mode:
+        set_response_cache_mode(args.cache_mode)
+
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_port)
+
+    mongo_db = yt.get_mongo_client()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(
+            target=work,
+            args=('{}:{}:{}'.format(socket.gethostname(), os.getpid(), index), stop, mongo_db,
+                  tuple(args.kinds), args.poll_interval, args.once),
+            name='worker-{}'.format(index)
+        )
+        for index in range(args.workers)
+    ]
+    for thread in threads:
+        thread.start()
+    compacted_at = None
+    try:
+        while any(thread.is_alive() for thread in threads):
+            with yt.postgre_connection() as connection:
+                requeue_stale_jobs(connection, JOB_HEARTBEAT_TIMEOUT)
+            if compacted_at is None or time.monotonic() - compacted_at > STATS_COMPACT_INTERVAL:
+                compact_statistics(mongo_db)
+                compacted_at = time.monotonic()
+            for thread in threads:
+                thread.join(JOB_HEARTBEAT_INTERVAL / len(threads))
+    except KeyboardInterrupt:
+        logger.info('Stopping once the running jobs finish')
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger(__name__)
+
+# Quota units charged by the YouTube Data API per request, unlisted endpoints cost 1
+QUOTA_COSTS = {
+    'channels.list': 1,
+    'playlists.list': 1,
+    'playlistItems.list': 1,
+    'videos.list': 1,
+    'commentThreads.list': 1,
+    'comments.list': 1,
+    'search.list': 100,
+}
+DEFAULT_QUOTA_COST = 1
+
+# The daily quota of the YouTube Data API resets at midnight Pacific time
+QUOTA_RESET_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+QUOTA_EXHAUSTED_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}
+RETRYABLE_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded', 'backendError', 'internalError'}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class QuotaExceededError(Exception):
+    """Raised when a request would go over the daily quota budget"""
+
+def get_endpoint(request: any) -> str:
+    """
+        Gets the endpoint name of a google api request e.g. videos.list
+
+        Args:
+            request: googleapiclient HttpRequest object
+        Returns:
+            The endpoint name without the api prefix
+    """
+    method_id = getattr(request, 'methodId', None) or ''
+    return method_id.split('.', 1)[1] if method_id.count('.') > 1 else method_id
+
+def get_error_reason(error: HttpError) -> str:
+    """
+        Gets the reason of the first error in a YouTube Data API error response
+
+        Args:
+            error: googleapiclient HttpError
+        Returns:
+            The reason string e.g. quotaExceeded, empty string if there is none
+    """
+    try:
+        return json.loads(error.content.decode('utf-8'))['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return ''
+
+class TokenBucket:
+    """
+        Token bucket rate limiter shared by all the threads of the process.
+
+        Args:
+            rate: float, tokens added per second
+            capacity: float, maximum number of tokens i.e. the allowed burst
+    """
+
+    def __init__(self, rate: float, capacity: float, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1):
+        """Blocks until the tokens are available and takes them"""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            self._sleep(wait)
+
+class RequestScheduler:
+    """
+        Executes YouTube Data API requests against a daily quota budget. Requests are
+        paced by a token bucket and retried with jittered exponential backoff on rate
+        limit and transient server errors.
+
+        Args:
+            daily_quota: int, quota units that may be spent per day
+            requests_per_second: float, sustained request rate
+            burst: int, number of requests that may be sent back to back
+            max_retries: int, retries of a request before the error is raised
+            backoff_base: float, seconds to wait before the first retry
+            backoff_max: float, upper bound of the wait between retries
+    """
+
+    def __init__(self, daily_quota: int = 10000, requests_per_second: float = 10, burst: int = 10,
+                 max_retries: int = 5, backoff_base: float = 1, backoff_max: float = 64,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.daily_quota = daily_quota
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = TokenBucket(requests_per_second, burst, clock=clock, sleep=sleep)
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._quota_day = self._today()
+        self._quota_used = 0
+        self._quota_exhausted = False
+        self._calls = {}
+        self._units = {}
+        self._retries = 0
+
+    @staticmethod
+    def _today():
+        return datetime.now(QUOTA_RESET_TIMEZONE).date()
+
+    def _roll_over(self):
+        # The quota and the counts of the previous day are dropped when it resets
+        today = self._today()
+        if today != self._quota_day:
+            self._quota_day = today
+            self._quota_used = 0
+            self._quota_exhausted = False
+            self._calls = {}
+            self._units = {}
+            self._retries = 0
+
+    def _charge(self, endpoint: str, cost: int):
+        with self._lock:
+            self._roll_over()
+            if self._quota_exhausted or self._quota_used + cost > self.daily_quota:
+                raise QuotaExceededError(
+                    'Daily quota budget of {} units exhausted, {} units used'.format(self.daily_quota, self._quota_used)
+                )
+            self._quota_used += cost
+            self._calls[endpoint] = self._calls.get(endpoint, 0) + 1
+            self._units[endpoint] = self._units.get(endpoint, 0) + cost
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def execute(self, request: any, etag: str = None) -> dict:
+        """
+            Executes a request once quota and rate limit allow it
+
+            Args:
+                request: googleapiclient HttpRequest object
+                etag: string, when given the request is sent with If-None-Match
+            Returns:
+                The decoded response of the request, None when the resource is
+                unchanged since etag (304 Not Modified)
+        """
+        endpoint = get_endpoint(request)
+        cost = QUOTA_COSTS.get(endpoint, DEFAULT_QUOTA_COST)
+        if etag:
+            request.headers['If-None-Match'] = etag
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            self._charge(endpoint, cost)
+            try:
+                return request.execute()
+            except HttpError as e:
+                if etag and e.resp.status == 304:
+                    return None
+                reason = get_error_reason(e)
+                if reason in QUOTA_EXHAUSTED_REASONS:
+                    with self._lock:
+                        self._quota_exhausted = True
+                    raise QuotaExceededError('YouTube Data API quota exceeded') from e
+                if reason not in RETRYABLE_REASONS and e.resp.status not in RETRYABLE_STATUS_CODES:
+                    raise
+                error = e
+            except (socket.timeout, ConnectionError) as e:
+                error = e
+            if attempt >= self.max_retries:
+                raise error
+            wait = self._backoff(attempt)
+            attempt += 1
+            with self._lock:
+                self._retries += 1
+            logger.warning('Retrying %s in %.1fs after %r', endpoint, wait, error)
+            self._sleep(wait)
+
+    def remaining_quota(self) -> int:
+        """Estimate of the quota units left for today"""
+        with self._lock:
+            self._roll_over()
+            return 0 if self._quota_exhausted else max(0, self.daily_quota - self._quota_used)
+
+    def stats(self) -> dict:
+        """Requests and quota units spent per endpoint today, and the number of retries"""
+        with self._lock:
+            self._roll_over()
+            return {
+                'quota_used': self._quota_used,
+                'quota_remaining': 0 if self._quota_exhausted else max(0, self.daily_quota - self._quota_used),
+                'calls': dict(self._calls),
+                'units': dict(self._units),
+                'retries': self._retries,
+            }
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_request_scheduler() -> RequestScheduler:
+    """
+        Gets the scheduler shared by every request of the process, configured from
+        youtube_daily_quota, youtube_requests_per_second and youtube_max_retries
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            requests_per_second = float(os.getenv('youtube_requests_per_second', 10))
+            _scheduler = RequestScheduler(
+                daily_quota=int(os.getenv('youtube_daily_quota', 10000)),
+                requests_per_second=requests_per_second,
+                burst=max(1, int(requests_per_second)),
+                max_retries=int(os.getenv('youtube_max_retries', 5)),
+            )
+        return _scheduler
+
+def set_request_scheduler(scheduler: RequestScheduler):
+    """Replaces the shared scheduler e.g. to use a different budget"""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler